@@ -109,8 +109,10 @@ class uploadedTable extends React.Component {
 
   processAndSaveDataset() {
 
+    // Only a preview of the rows is loaded here, so the import reads the rest from the stored spreadsheet
     var dataset = {
-      data: this.dataList.slice(this.state.firstDataRow),
+      spreadsheetToken: this.props.data.spreadsheet_token,
+      firstDataRow: this.state.firstDataRow,
       headerPositions: this.state.headerPositions,
       country: this.state.country,
       saveName: this.state.saveName,
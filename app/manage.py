@@ -1,6 +1,6 @@
 from flask_script import Manager
 from flask_migrate import Migrate, MigrateCommand
-from flask_script import Command
+from flask_script import Command, Option
 import sys
 
 sys.path.append('../')
@@ -39,6 +39,93 @@ class UpdateData(Command):
 
             print(master_address)
 
+class ReconcileBalances(Command):
+    """
+    Recomputes every transfer account balance from the credit transfer history and reports
+    any accounts where the persisted balance has drifted. Pass --fix to overwrite them.
+    """
+
+    option_list = (
+        Option('--fix', dest='fix', action='store_true', default=False),
+    )
+
+    def run(self, fix):
+        from server.utils.transfer_account import reconcile_transfer_account_balances
+
+        with app.app_context():
+
+            print("~~~~~~~~~~ Reconciling Transfer Account Balances ~~~~~~~~~~")
+
+            drift = reconcile_transfer_account_balances(fix=fix)
+
+            for item in drift:
+                print('Transfer Account {transfer_account_id}: persisted {persisted_balance}, '
+                      'expected {expected_balance} (difference {difference})'.format(**item))
+
+            if fix:
+                db.session.commit()
+                print('Fixed {} drifting balances'.format(len(drift)))
+            else:
+                print('Found {} drifting balances'.format(len(drift)))
+
+
+class RebuildTransferRollups(Command):
+    """
+    Recomputes the daily transfer rollups used by the dashboard stats from the credit transfer history.
+    """
+
+    def run(self):
+        from server.utils.credit_transfers import rebuild_daily_transfer_rollups
+
+        with app.app_context():
+
+            print("~~~~~~~~~~ Rebuilding Daily Transfer Rollups ~~~~~~~~~~")
+
+            rebuild_daily_transfer_rollups()
+            db.session.commit()
+
+            print('Done')
+
+
+class UpdateBlockchainStatuses(Command):
+    """
+    Recalculates the persisted blockchain status of every credit transfer from its blockchain transactions.
+    """
+
+    def run(self):
+        from server.models import CreditTransfer
+
+        with app.app_context():
+
+            print("~~~~~~~~~~ Updating Credit Transfer Blockchain Statuses ~~~~~~~~~~")
+
+            ids = [row.id for row in db.session.query(CreditTransfer.id).order_by(CreditTransfer.id).all()]
+
+            for i in range(0, len(ids), 500):
+                for credit_transfer in CreditTransfer.query.filter(CreditTransfer.id.in_(ids[i:i + 500])).all():
+                    credit_transfer.update_blockchain_status()
+
+                db.session.commit()
+
+            print('Updated {} credit transfers'.format(len(ids)))
+
+
+class ReencryptSecrets(Command):
+    """
+    Re-encrypts private keys and TFA secrets still encrypted with an older ENCRYPTION_SECRETS entry.
+    Safe to stop and rerun.
+    """
+
+    def run(self):
+        from server.utils.key_rotation import reencrypt_stale_secrets
+
+        with app.app_context():
+
+            print("~~~~~~~~~~ Re-encrypting Secrets ~~~~~~~~~~")
+
+            for model_name, count in reencrypt_stale_secrets().items():
+                print('Re-encrypted {} {} values'.format(count, model_name))
+
 
 app = create_app()
 manager = Manager(app)
@@ -48,6 +135,10 @@ migrate = Migrate(app, db)
 manager.add_command('db', MigrateCommand)
 
 manager.add_command('update_data', UpdateData())
+manager.add_command('reconcile_balances', ReconcileBalances())
+manager.add_command('rebuild_transfer_rollups', RebuildTransferRollups())
+manager.add_command('update_blockchain_statuses', UpdateBlockchainStatuses())
+manager.add_command('reencrypt_secrets', ReencryptSecrets())
 
 
 if __name__ == '__main__':
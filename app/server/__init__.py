@@ -95,6 +95,9 @@ def register_extensions(app):
 def register_blueprints(app):
     @app.before_request
     def before_request():
+        from server.utils.invalidation import ensure_invalidation_subscriber
+        ensure_invalidation_subscriber()
+
         if request.url.startswith('http://') and '.sempo.ai' in request.url:
             url = request.url.replace('http://', 'https://', 1)
             code = 301
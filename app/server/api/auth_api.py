@@ -3,12 +3,13 @@ from flask.views import MethodView
 from server import db, sentry, basic_auth
 # from server import limiter
 from server.constants import DENOMINATION_DICT
-from server.models import User, BlacklistToken, EmailWhitelist, CurrencyConversion, TransferUsage
+from server.models import User, BlacklistToken, EmailWhitelist
 from server.utils.intercom import create_intercom_android_secret
 from server.utils.auth import requires_auth, tfa_logic
 from server.utils.user import save_device_info
 from server.utils.phone import proccess_phone_number
 from server.utils.feedback import request_feedback_questions
+from server.utils.reference_data import get_reference_data
 from server.utils.amazon_ses import send_reset_email, send_activation_email, send_invite_email
 from server.utils.blockchain_transaction import get_usd_to_satoshi_rate
 from sqlalchemy import and_, or_
@@ -54,21 +55,20 @@ def create_user_response_object(user, auth_token, message):
     conversion_rate = 1
     currency_name = current_app.config['CURRENCY_NAME']
     if user.default_currency:
-        conversion = CurrencyConversion.query.filter_by(code = user.default_currency).first()
-        if conversion is not None:
-            conversion_rate = conversion.rate
+        conversion_rates = get_reference_data('currency_conversions')
+        if user.default_currency in conversion_rates:
+            conversion_rate = conversion_rates[user.default_currency]
             currency_name = user.default_currency
 
     transfer_usages = []
-    usage_objects = TransferUsage.query.order_by(TransferUsage.priority).limit(11).all()
-    for usage in usage_objects:
-        if ((usage.is_cashout and user.cashout_authorised) or not usage.is_cashout):
+    for usage in get_reference_data('transfer_usages')[:11]:
+        if ((usage['is_cashout'] and user.cashout_authorised) or not usage['is_cashout']):
             transfer_usages.append({
-                'id': usage.id,
-                'name': usage.name,
-                'icon': usage.icon,
-                'priority': usage.priority,
-                'translations': usage.translations
+                'id': usage['id'],
+                'name': usage['name'],
+                'icon': usage['icon'],
+                'priority': usage['priority'],
+                'translations': usage['translations']
             })
 
     responseObject = {
@@ -1,9 +1,10 @@
 from flask import Blueprint, request, make_response, jsonify, g, session
 from flask.views import MethodView
 
-from server import db
+from server import db, basic_auth
 from server.models import BlockchainAddress, User
 from server.utils.auth import requires_auth
+from server.utils.keypair_pool import refill_blockchain_keypair_pool
 from server.schemas import blockchain_address_schema
 
 blockchain_address_blueprint = Blueprint('blockchain_address', __name__)
@@ -38,8 +39,36 @@ class BlockchainAddressAPI(MethodView):
         return make_response(jsonify(responseObject)), 201
 
 
+class BlockchainKeypairPoolAPI(MethodView):
+
+    @basic_auth.required
+    def post(self):
+        """
+        Called periodically by the worker beat to top up the pool of keypairs for new transfer accounts,
+        a batch per request
+        """
+
+        generated, shortfall = refill_blockchain_keypair_pool()
+
+        responseObject = {
+            'message': 'Generated {} keypairs'.format(generated),
+            'data': {
+                'generated': generated,
+                'shortfall': shortfall
+            }
+        }
+
+        return make_response(jsonify(responseObject)), 201
+
+
 blockchain_address_blueprint.add_url_rule(
     '/blockchain_address/',
     view_func=BlockchainAddressAPI.as_view('blockchain_address'),
     methods=['GET']
 )
+
+blockchain_address_blueprint.add_url_rule(
+    '/blockchain_address/keypair_pool/',
+    view_func=BlockchainKeypairPoolAPI.as_view('blockchain_keypair_pool'),
+    methods=['POST']
+)
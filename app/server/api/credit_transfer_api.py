@@ -1,14 +1,19 @@
+import datetime
 from flask import Blueprint, request, make_response, jsonify, g
 from flask.views import MethodView
 
 from sqlalchemy import or_
 
 from server import db
-from server.models import paginate_query, CreditTransfer, TransferTypeEnum, BlockchainAddress, BlockchainTransaction
-from server.schemas import credit_transfers_schema, credit_transfer_schema, view_credit_transfers_schema
+from server.models import paginate_query, paginate_query_by_cursor, cursor_pagination_requested, CreditTransfer, TransferTypeEnum, BlockchainAddress, BlockchainTransaction
+from server.schemas import credit_transfers_schema, credit_transfer_schema, view_credit_transfers_schema, \
+    credit_transfer_loader_options, sparse_fieldset_schema
 from server.utils.auth import requires_auth
+from server.utils.misc import parse_utc_date
+from server.utils.streaming import streaming_requested, stream_query_as_json
 
 from server.utils.credit_transfers import calculate_transfer_stats, find_user_with_transfer_account_from_identifiers
+from server.utils.credit_transfers import calculate_transfer_time_series, DEFAULT_TIME_SERIES_DAYS
 from server.utils.credit_transfers import (
     make_payment_transfer,
     make_withdrawal_transfer,
@@ -16,7 +21,7 @@ from server.utils.credit_transfers import (
     make_target_balance_transfer,
     make_blockchain_transfer)
 
-from server.exceptions import NoTransferAccountError, UserNotFoundError, InsufficientBalanceError, AccountNotApprovedError, \
+from server.exceptions import InvalidCursorError, NoTransferAccountError, UserNotFoundError, InsufficientBalanceError, AccountNotApprovedError, \
     InvalidTargetBalanceError, BlockchainError
 
 credit_transfer_blueprint = Blueprint('credit_transfer', __name__)
@@ -29,6 +34,7 @@ class CreditTransferAPI(MethodView):
 
         transfer_account_ids = request.args.get('transfer_account_ids')
         transfer_type = request.args.get('transfer_type', 'ALL')
+        blockchain_status = request.args.get('blockchain_status')
         get_transfer_stats = request.args.get('get_stats', False)
 
         transfer_list = None
@@ -36,14 +42,26 @@ class CreditTransferAPI(MethodView):
         if transfer_type:
             transfer_type = transfer_type.upper()
 
+        if g.user.is_admin:
+            transfers_schema = credit_transfers_schema
+        else:
+            transfers_schema = view_credit_transfers_schema
+
+        try:
+            transfers_schema = sparse_fieldset_schema(transfers_schema, request.args.get('fields'))
+        except ValueError as e:
+            response_object = {
+                'message': str(e),
+            }
+            return make_response(jsonify(response_object)), 400
+
+        loader_options = credit_transfer_loader_options(transfers_schema)
+
         if credit_transfer_id:
 
-            credit_transfer = CreditTransfer.query.get(credit_transfer_id)
+            credit_transfer = CreditTransfer.query.options(*loader_options).get(credit_transfer_id)
 
-            if g.user.is_admin:
-                transfer_list = credit_transfers_schema.dump([credit_transfer]).data
-            elif g.user.is_view:
-                transfer_list = view_credit_transfers_schema.dump([credit_transfer]).data
+            transfer_list = transfers_schema.dump([credit_transfer]).data
 
             transfer_stats = []
 
@@ -91,23 +109,52 @@ class CreditTransferAPI(MethodView):
                         or_(CreditTransfer.recipient_transfer_account_id.in_(parsed_transfer_account_ids),
                             CreditTransfer.sender_transfer_account_id.in_(parsed_transfer_account_ids)))
 
-            transfers, total_items, total_pages = paginate_query(query, CreditTransfer)
+            if blockchain_status:
+                blockchain_status = blockchain_status.upper()
+
+                if blockchain_status not in ['COMPLETE', 'PENDING', 'ERROR', 'UNKNOWN']:
+                    response_object = {
+                        'message': 'Invalid Filter: Blockchain Status ',
+                    }
+                    return make_response(jsonify(response_object)), 400
+
+                query = query.filter(CreditTransfer.blockchain_status == blockchain_status)
 
             if get_transfer_stats:
-                transfer_stats = calculate_transfer_stats(total_time_series=True)
+                transfer_stats = calculate_transfer_stats()
             else:
                 transfer_stats = None
 
-            if g.user.is_admin:
-                transfer_list = credit_transfers_schema.dump(transfers).data
-            elif g.user.is_view:
-                transfer_list = view_credit_transfers_schema.dump(transfers).data
+            if streaming_requested(request.args):
+                return stream_query_as_json(query, CreditTransfer, transfers_schema, 'credit_transfers',
+                                            loader_options=loader_options,
+                                            extra_data={'transfer_stats': transfer_stats})
+
+            query = query.options(*loader_options)
+
+            try:
+                if cursor_pagination_requested():
+                    transfers, total_items, next_cursor, previous_cursor = paginate_query_by_cursor(query, CreditTransfer)
+                    total_pages = None
+                else:
+                    transfers, total_items, total_pages = paginate_query(query, CreditTransfer)
+                    next_cursor, previous_cursor = None, None
+
+            except InvalidCursorError as e:
+                response_object = {
+                    'message': str(e),
+                }
+                return make_response(jsonify(response_object)), 400
+
+            transfer_list = transfers_schema.dump(transfers).data
 
             response_object = {
                 'status': 'success',
                 'message': 'Successfully Loaded.',
                 'items': total_items,
                 'pages': total_pages,
+                'next_cursor': next_cursor,
+                'previous_cursor': previous_cursor,
                 'data': {
                     'credit_transfers': transfer_list,
                     'transfer_stats': transfer_stats
@@ -405,6 +452,71 @@ class InternalCreditTransferAPI(MethodView):
         }
         return make_response(jsonify(response_object)), 201
 
+
+class CreditTransferStatsAPI(MethodView):
+
+    @requires_auth(allowed_roles=['is_admin', 'is_view'])
+    def get(self):
+
+        start = request.args.get('start')
+        end = request.args.get('end')
+        bucket = request.args.get('bucket', 'day').lower()
+        transfer_account_ids = request.args.get('transfer_account_ids')
+        is_vendor = request.args.get('is_vendor')
+
+        try:
+            # Defaults to the end of the current minute, so that requests within it share a cache key
+            end = parse_utc_date(end) if end else (
+                datetime.datetime.utcnow().replace(second=0, microsecond=0) + datetime.timedelta(minutes=1))
+            start = parse_utc_date(start) if start else end - datetime.timedelta(days=DEFAULT_TIME_SERIES_DAYS)
+        except (ValueError, OverflowError):
+            response_object = {
+                'message': 'Invalid Filter: Start/End Date',
+            }
+            return make_response(jsonify(response_object)), 400
+
+        if start > end:
+            response_object = {
+                'message': 'Invalid Filter: Start must be before End',
+            }
+            return make_response(jsonify(response_object)), 400
+
+        if transfer_account_ids:
+            try:
+                transfer_account_ids = list(map(lambda x: int(x), filter(None, transfer_account_ids.split(','))))
+
+            except ValueError:
+                response_object = {
+                    'message': 'Invalid Filter: Transfer Account IDs ',
+                }
+                return make_response(jsonify(response_object)), 400
+        else:
+            transfer_account_ids = None
+
+        if is_vendor is not None:
+            is_vendor = is_vendor.lower() == 'true'
+
+        try:
+            transfer_stats = calculate_transfer_time_series(
+                start, end, bucket, transfer_account_ids=transfer_account_ids, is_vendor=is_vendor)
+
+        except ValueError as e:
+            response_object = {
+                'message': 'Invalid Filter: {}'.format(str(e)),
+            }
+            return make_response(jsonify(response_object)), 400
+
+        response_object = {
+            'status': 'success',
+            'message': 'Successfully Loaded.',
+            'data': {
+                'transfer_stats': transfer_stats
+            }
+        }
+
+        return make_response(jsonify(response_object)), 201
+
+
 # add Rules for API Endpoints
 credit_transfer_blueprint.add_url_rule(
     '/credit_transfer/',
@@ -423,4 +535,10 @@ credit_transfer_blueprint.add_url_rule(
     '/credit_transfer/internal/',
     view_func=InternalCreditTransferAPI.as_view('internal_credit_transfer_view'),
     methods=['POST']
-)
\ No newline at end of file
+)
+
+credit_transfer_blueprint.add_url_rule(
+    '/credit_transfer/stats/',
+    view_func=CreditTransferStatsAPI.as_view('credit_transfer_stats_view'),
+    methods=['GET']
+)
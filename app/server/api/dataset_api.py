@@ -1,12 +1,14 @@
 from flask import Blueprint, request, make_response, jsonify, g
 from flask.views import MethodView
-from openpyxl import load_workbook
-import pandas as pd
 
 from server.constants import ALLOWED_SPREADSHEET_EXTENSIONS, SPREADSHEET_UPLOAD_REQUESTED_ATTRIBUTES
-from server import db
+from server import db, basic_auth, celery_app, sentry
+from server.models import DatasetImportJob
+from server.schemas import dataset_import_job_schema, dataset_import_progress_schema
 from server.utils.auth import requires_auth
-from server.utils import user as UserUtils
+from server.utils.spreadsheet import save_spreadsheet, preview_spreadsheet
+from server.utils.user_import import attribute_dict_from_row, create_import_job, create_spreadsheet_import_job, \
+    claim_import_job, run_import_job_chunk, fail_import_job
 
 def allowed_file(filename):
     return '.' in filename and \
@@ -32,16 +34,17 @@ class SpreadsheetUploadAPI(MethodView):
         if not allowed_file(spreadsheet.filename):
             return make_response(jsonify({'message': 'Must be XSLX or CSV'})), 400
 
-        worksheet = load_workbook(spreadsheet).active
+        spreadsheet_token = save_spreadsheet(spreadsheet)
 
-        df = pd.DataFrame(worksheet.values)
+        table_data, row_count, column_stats = preview_spreadsheet(spreadsheet_token)
 
-        data_dict = df.to_dict(orient='index')
-
-        column_firstrows = {v: k for k, v in data_dict[0].items()}
+        column_firstrows = {v: k for k, v in table_data.get(0, {}).items()}
 
         reponse_object = {
-            'table_data': data_dict,
+            'spreadsheet_token': spreadsheet_token,
+            'table_data': table_data,
+            'row_count': row_count,
+            'column_stats': column_stats,
             'column_firstrows': column_firstrows,
             'requested_attributes':  SPREADSHEET_UPLOAD_REQUESTED_ATTRIBUTES
         }
@@ -50,10 +53,6 @@ class SpreadsheetUploadAPI(MethodView):
 
 class DatasetAPI(MethodView):
 
-    def add_diagnostic(self, diagnostic):
-        print(diagnostic)
-        self.diagnostics.append(diagnostic)
-
     @requires_auth(allowed_roles=['is_admin'])
     def post(self):
         # get the post data
@@ -63,41 +62,110 @@ class DatasetAPI(MethodView):
 
         header_postions = post_data.get('headerPositions')
 
-        self.diagnostics = []
+        spreadsheet_token = post_data.get('spreadsheetToken')
 
-        for datarow in post_data.get('data'):
+        if spreadsheet_token:
+            try:
+                job = create_spreadsheet_import_job(spreadsheet_token, header_postions,
+                                                    first_data_row=post_data.get('firstDataRow') or 0)
+            except ValueError as e:
+                response_object = {
+                    'message': str(e)
+                }
 
+                return make_response(jsonify(response_object)), 400
 
-            attribute_dict = {}
+        else:
+            # Rows posted by an older client
+            attribute_dicts = [attribute_dict_from_row(datarow, header_postions) for datarow in post_data.get('data')]
+            job = create_import_job([attribute_dict for attribute_dict in attribute_dicts if attribute_dict])
 
-            contains_anything = False
-            for key, header_label in header_postions.items():
+        db.session.commit()
 
-                attribute = datarow.get(key)
+        try:
+            import_task = celery_app.signature('worker.celery_tasks.import_dataset', args=(job.id,))
+            import_task.delay()
+        except Exception as e:
+            print(e)
+            sentry.captureException()
+            fail_import_job(job, 'Could not queue import')
 
-                if attribute:
-                    contains_anything = True
-                    attribute_dict[header_label] = attribute
+        responseObject = {
+            'status': 'success',
+            'message': 'Import Queued',
+            # Filled in as the job runs, see DatasetImportJobAPI
+            'diagnostics': [],
+            'data': {'dataset_import_job': dataset_import_job_schema.dump(job).data}
+        }
 
-            if contains_anything:
-                item_response_object, response_code = UserUtils.proccess_attribute_dict(attribute_dict,
-                                                                                        force_dict_keys_lowercase=True,
-                                                                                        allow_existing_user_modify=True)
+        return make_response(jsonify(responseObject)), 201
 
-                self.diagnostics.append((item_response_object.get('message'), response_code))
 
-                if response_code == 200:
-                    db.session.commit()
-                else:
-                    db.session.flush()
+class DatasetImportJobAPI(MethodView):
 
-        responseObject = {
-            'status': 'success',
-            'message': 'Successfully Saved.',
-            'diagnostics': self.diagnostics
+    @requires_auth(allowed_roles=['is_admin'])
+    def get(self, job_id):
+
+        job = DatasetImportJob.query.get(job_id)
+
+        if job is None:
+            response_object = {
+                'message': 'Dataset import job {} not found'.format(job_id)
+            }
+
+            return make_response(jsonify(response_object)), 404
+
+        response_object = {
+            'message': 'Successfully Loaded.',
+            'data': {'dataset_import_job': dataset_import_job_schema.dump(job).data}
         }
 
-        return make_response(jsonify(responseObject)), 201
+        return make_response(jsonify(response_object)), 200
+
+
+class DatasetImportJobProcessAPI(MethodView):
+
+    @basic_auth.required
+    def post(self, job_id):
+        """
+        Called repeatedly by the worker's import_dataset task, importing the next chunk of the job each time
+        """
+
+        job, claimed = claim_import_job(job_id)
+
+        if job is None:
+            response_object = {
+                'message': 'Dataset import job {} not found'.format(job_id)
+            }
+
+            return make_response(jsonify(response_object)), 404
+
+        if not claimed:
+            response_object = {
+                'message': 'Dataset import job {} is already being processed'.format(job_id)
+            }
+
+            return make_response(jsonify(response_object)), 409
+
+        try:
+            run_import_job_chunk(job)
+        except Exception as e:
+            sentry.captureException()
+            fail_import_job(job, e)
+
+            response_object = {
+                'message': 'Import failed: {}'.format(e),
+                'data': {'dataset_import_job': dataset_import_progress_schema.dump(job).data}
+            }
+
+            return make_response(jsonify(response_object)), 500
+
+        response_object = {
+            'message': 'Imported {} of {} rows'.format(job.processed_count, job.row_count),
+            'data': {'dataset_import_job': dataset_import_progress_schema.dump(job).data}
+        }
+
+        return make_response(jsonify(response_object)), 200
 
 
 # add Rules for API Endpoints
@@ -110,7 +178,19 @@ dataset_blueprint.add_url_rule(
 dataset_blueprint.add_url_rule(
     '/dataset/',
     view_func=DatasetAPI.as_view('dataset_view'),
-    methods=['POST', 'GET']
+    methods=['POST']
+)
+
+dataset_blueprint.add_url_rule(
+    '/dataset/<int:job_id>/',
+    view_func=DatasetImportJobAPI.as_view('dataset_import_job_view'),
+    methods=['GET']
+)
+
+dataset_blueprint.add_url_rule(
+    '/dataset/<int:job_id>/process/',
+    view_func=DatasetImportJobProcessAPI.as_view('dataset_import_job_process_view'),
+    methods=['POST']
 )
 
 import numpy
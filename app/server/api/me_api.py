@@ -6,14 +6,15 @@ import datetime
 from sqlalchemy import func, or_
 
 from server import db
-from server.models import paginate_query, CreditTransfer, User, Feedback, TargetingSurvey, Referral
+from server.models import paginate_query, paginate_query_by_cursor, cursor_pagination_requested, CreditTransfer, User, Feedback, TargetingSurvey, Referral
 from server.schemas import (
     me_credit_transfers_schema,
     me_credit_transfer_schema,
     user_schema,
     old_user_schema,
     referrals_schema,
-    referral_schema)
+    referral_schema,
+    credit_transfer_loader_options)
 from server.utils.auth import requires_auth
 from server.utils.pusher import push_user_transfer_confirmation
 from server.utils.credit_transfers import (
@@ -22,7 +23,7 @@ from server.utils.credit_transfers import (
     find_user_with_transfer_account_from_identifiers,
     check_for_any_valid_hash
 )
-from server.exceptions import NoTransferAccountError, UserNotFoundError, InsufficientBalanceError, AccountNotApprovedError
+from server.exceptions import InvalidCursorError, NoTransferAccountError, UserNotFoundError, InsufficientBalanceError, AccountNotApprovedError
 from server.utils.mobile_version import check_mobile_version
 from server.utils.assembly_payments import (
     create_ap_user,
@@ -106,7 +107,21 @@ class MeCreditTransferAPI(MethodView):
                 or_(CreditTransfer.recipient_user_id == user.id,
                     CreditTransfer.sender_user_id == user.id))
 
-        transfers, total_items, total_pages = paginate_query(transfers_query, CreditTransfer)
+        transfers_query = transfers_query.options(*credit_transfer_loader_options(me_credit_transfers_schema))
+
+        try:
+            if cursor_pagination_requested():
+                transfers, total_items, next_cursor, previous_cursor = paginate_query_by_cursor(transfers_query, CreditTransfer)
+                total_pages = None
+            else:
+                transfers, total_items, total_pages = paginate_query(transfers_query, CreditTransfer)
+                next_cursor, previous_cursor = None, None
+
+        except InvalidCursorError as e:
+            response_object = {
+                'message': str(e),
+            }
+            return make_response(jsonify(response_object)), 400
 
         transfer_list = me_credit_transfers_schema.dump(transfers).data
 
@@ -114,6 +129,8 @@ class MeCreditTransferAPI(MethodView):
             'message': 'Successfully Loaded.',
             'items': total_items,
             'pages': total_pages,
+            'next_cursor': next_cursor,
+            'previous_cursor': previous_cursor,
             'data': {
                 'credit_transfers': transfer_list,
             }
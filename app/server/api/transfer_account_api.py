@@ -4,11 +4,15 @@ from flask.views import MethodView
 
 from sqlalchemy import and_, or_
 
-from server import db
-from server.models import paginate_query, TransferAccount
+from server import db, basic_auth
+from server.models import paginate_query, paginate_query_by_cursor, cursor_pagination_requested, TransferAccount
 from server.schemas import transfer_accounts_schema, transfer_account_schema, \
-    view_transfer_account_schema, view_transfer_accounts_schema
+    view_transfer_account_schema, view_transfer_accounts_schema, transfer_account_loader_options, sparse_fieldset_schema
 from server.utils.auth import requires_auth
+from server.utils.misc import parse_utc_date
+from server.utils.streaming import streaming_requested, stream_query_as_json
+from server.utils.transfer_account import calculate_balances_as_of, create_balance_checkpoints
+from server.exceptions import InvalidCursorError
 
 transfer_account_blueprint = Blueprint('transfer_account', __name__)
 
@@ -24,8 +28,21 @@ class TransferAccountAPI(MethodView):
 
 
         account_type_filter = request.args.get('account_type')
+        sort = request.args.get('sort')
+        min_balance = request.args.get('min_balance')
+        max_balance = request.args.get('max_balance')
+        as_of = request.args.get('as_of')
         result = None
 
+        if as_of:
+            try:
+                as_of = parse_utc_date(as_of)
+            except (ValueError, OverflowError):
+                response_object = {
+                    'message': 'Invalid Filter: As Of Date',
+                }
+                return make_response(jsonify(response_object)), 400
+
         if transfer_account_id:
             transfer_account = TransferAccount.query.get(transfer_account_id)
 
@@ -41,6 +58,9 @@ class TransferAccountAPI(MethodView):
             elif g.user.is_view:
                 result = view_transfer_account_schema.dump(transfer_account)
 
+            if as_of:
+                result.data['balance'] = calculate_balances_as_of([transfer_account.id], as_of)[transfer_account.id]
+
             response_object = {
                 'message': 'Successfully Loaded.',
                 'data': {'transfer_account': result.data,}
@@ -55,7 +75,98 @@ class TransferAccountAPI(MethodView):
             else:
                 transfer_accounts_query = TransferAccount.query
 
-            transfer_accounts, total_items, total_pages = paginate_query(transfer_accounts_query, TransferAccount)
+            try:
+                if min_balance is not None:
+                    transfer_accounts_query = transfer_accounts_query.filter(
+                        TransferAccount.balance >= int(min_balance))
+
+                if max_balance is not None:
+                    transfer_accounts_query = transfer_accounts_query.filter(
+                        TransferAccount.balance <= int(max_balance))
+
+            except ValueError:
+                response_object = {
+                    'message': 'Invalid Filter: Min/Max Balance',
+                }
+                return make_response(jsonify(response_object)), 400
+
+            # Sort by balance ascending with 'balance', or descending with '-balance'
+            if sort == 'balance':
+                transfer_accounts_query = transfer_accounts_query.order_by(
+                    TransferAccount.balance.asc(), TransferAccount.id.asc())
+                queried_object = None
+
+            elif sort == '-balance':
+                transfer_accounts_query = transfer_accounts_query.order_by(
+                    TransferAccount.balance.desc(), TransferAccount.id.desc())
+                queried_object = None
+
+            elif sort is None:
+                queried_object = TransferAccount
+
+            else:
+                response_object = {
+                    'message': 'Invalid Sort: {}'.format(sort),
+                }
+                return make_response(jsonify(response_object)), 400
+
+            if cursor_pagination_requested() and queried_object is None:
+                response_object = {
+                    'message': 'Cursor pagination is only supported with the default sort',
+                }
+                return make_response(jsonify(response_object)), 400
+
+            if g.user.is_admin:
+                accounts_schema = transfer_accounts_schema
+            else:
+                accounts_schema = view_transfer_accounts_schema
+
+            try:
+                accounts_schema = sparse_fieldset_schema(accounts_schema, request.args.get('fields'))
+            except ValueError as e:
+                response_object = {
+                    'message': str(e),
+                }
+                return make_response(jsonify(response_object)), 400
+
+            loader_options = transfer_account_loader_options(accounts_schema)
+
+            def apply_balances_as_of(accounts, dumped):
+                if 'balance' not in accounts_schema.fields:
+                    return
+
+                balances_as_of = calculate_balances_as_of([account.id for account in accounts], as_of)
+                for account_data in dumped:
+                    account_data['balance'] = balances_as_of[account_data['id']]
+
+            if streaming_requested(request.args):
+                if sort == 'balance':
+                    order_by = [TransferAccount.balance.asc(), TransferAccount.id.asc()]
+                elif sort == '-balance':
+                    order_by = [TransferAccount.balance.desc(), TransferAccount.id.desc()]
+                else:
+                    order_by = None
+
+                return stream_query_as_json(transfer_accounts_query, TransferAccount, accounts_schema, 'transfer_accounts',
+                                            order_by=order_by,
+                                            loader_options=loader_options,
+                                            process_chunk=apply_balances_as_of if as_of else None)
+
+            transfer_accounts_query = transfer_accounts_query.options(*loader_options)
+
+            try:
+                if cursor_pagination_requested():
+                    transfer_accounts, total_items, next_cursor, previous_cursor = paginate_query_by_cursor(transfer_accounts_query, queried_object)
+                    total_pages = None
+                else:
+                    transfer_accounts, total_items, total_pages = paginate_query(transfer_accounts_query, queried_object)
+                    next_cursor, previous_cursor = None, None
+
+            except InvalidCursorError as e:
+                response_object = {
+                    'message': str(e),
+                }
+                return make_response(jsonify(response_object)), 400
 
             if transfer_accounts is None:
                 response_object = {
@@ -64,15 +175,17 @@ class TransferAccountAPI(MethodView):
 
                 return make_response(jsonify(response_object)), 400
 
-            if g.user.is_admin:
-                result = transfer_accounts_schema.dump(transfer_accounts)
-            elif g.user.is_view:
-                result = view_transfer_accounts_schema.dump(transfer_accounts)
+            result = accounts_schema.dump(transfer_accounts)
+
+            if as_of:
+                apply_balances_as_of(transfer_accounts, result.data)
 
             response_object = {
                 'message': 'Successfully Loaded.',
                 'items': total_items,
                 'pages': total_pages,
+                'next_cursor': next_cursor,
+                'previous_cursor': previous_cursor,
                 'data': {'transfer_accounts': result.data}
             }
             return make_response(jsonify(response_object)), 201
@@ -159,6 +272,23 @@ class TransferAccountAPI(MethodView):
             }
             return make_response(jsonify(response_object)), 201
 
+class BalanceCheckpointAPI(MethodView):
+
+    @basic_auth.required
+    def post(self):
+        """
+        Called periodically by the worker beat to checkpoint the balances of accounts with new transfers
+        """
+
+        checkpoints = create_balance_checkpoints()
+
+        db.session.commit()
+
+        response_object = {
+            'message': 'Created {} balance checkpoints'.format(len(checkpoints)),
+        }
+        return make_response(jsonify(response_object)), 201
+
 # add Rules for API Endpoints
 transfer_account_blueprint.add_url_rule(
     '/transfer_account/',
@@ -171,4 +301,10 @@ transfer_account_blueprint.add_url_rule(
     '/transfer_account/<int:transfer_account_id>/',
     view_func=TransferAccountAPI.as_view('single_transfer_account_view'),
     methods=['GET', 'PUT']
-)
\ No newline at end of file
+)
+
+transfer_account_blueprint.add_url_rule(
+    '/transfer_account/balance_checkpoint/',
+    view_func=BalanceCheckpointAPI.as_view('balance_checkpoint_view'),
+    methods=['POST']
+)
@@ -1,11 +1,14 @@
 from flask import Blueprint, request, make_response, jsonify, g
 from flask.views import MethodView
 
-from server import db
-from server.models import paginate_query, User, TransferAccount
-from server.schemas import user_schema, users_schema
+from server import db, basic_auth
+from server.models import paginate_query, paginate_query_by_cursor, cursor_pagination_requested, User, TransferAccount
+from server.schemas import user_schema, users_schema, user_loader_options, sparse_fieldset_schema
 from server.utils.auth import requires_auth
+from server.utils.user_activity import flush_user_activity
+from server.utils.streaming import streaming_requested, stream_query_as_json
 from server.utils import user as UserUtils
+from server.exceptions import InvalidCursorError
 
 user_blueprint = Blueprint('user', __name__)
 
@@ -94,7 +97,34 @@ class UserAPI(MethodView):
             else:
                 user_query = User.query
 
-            users, total_items, total_pages = paginate_query(user_query, User)
+            try:
+                list_schema = sparse_fieldset_schema(users_schema, request.args.get('fields'))
+            except ValueError as e:
+                response_object = {
+                    'message': str(e),
+                }
+                return make_response(jsonify(response_object)), 400
+
+            loader_options = user_loader_options(list_schema)
+
+            if streaming_requested(request.args):
+                return stream_query_as_json(user_query, User, list_schema, 'users', loader_options=loader_options)
+
+            user_query = user_query.options(*loader_options)
+
+            try:
+                if cursor_pagination_requested():
+                    users, total_items, next_cursor, previous_cursor = paginate_query_by_cursor(user_query, User)
+                    total_pages = None
+                else:
+                    users, total_items, total_pages = paginate_query(user_query, User)
+                    next_cursor, previous_cursor = None, None
+
+            except InvalidCursorError as e:
+                response_object = {
+                    'message': str(e),
+                }
+                return make_response(jsonify(response_object)), 400
 
             if users is None:
                 response_object = {
@@ -103,12 +133,14 @@ class UserAPI(MethodView):
 
                 return make_response(jsonify(response_object)), 400
 
-            user_list = users_schema.dump(users).data
+            user_list = list_schema.dump(users).data
 
             response_object = {
                 'message': 'Successfully Loaded.',
                 'pages': total_pages,
                 'items': total_items,
+                'next_cursor': next_cursor,
+                'previous_cursor': previous_cursor,
                 'data': {
                     'users': user_list,
                 }
@@ -182,6 +214,22 @@ class UserAPI(MethodView):
 
         return make_response(jsonify(responseObject)), 201
 
+
+class UserActivityFlushAPI(MethodView):
+
+    @basic_auth.required
+    def post(self):
+        """
+        Called periodically by the worker beat to save the last seen times and ip addresses buffered by requires_auth
+        """
+
+        users_seen, new_ip_addresses = flush_user_activity()
+
+        response_object = {
+            'message': 'Saved activity for {} users and {} new ip addresses'.format(users_seen, new_ip_addresses),
+        }
+        return make_response(jsonify(response_object)), 201
+
 # add Rules for API Endpoints
 user_blueprint.add_url_rule(
     '/user/',
@@ -194,4 +242,10 @@ user_blueprint.add_url_rule(
     '/user/<int:user_id>/',
     view_func=UserAPI.as_view('single_user_view'),
     methods=['GET', 'PUT']
-)
\ No newline at end of file
+)
+
+user_blueprint.add_url_rule(
+    '/user/activity_flush/',
+    view_func=UserActivityFlushAPI.as_view('user_activity_flush_view'),
+    methods=['POST']
+)
@@ -59,4 +59,10 @@ class BlockchainError(Exception):
 
 
 class NoTransferCardError(Exception):
-    pass
\ No newline at end of file
+    pass
+
+class InvalidCursorError(Exception):
+    """
+    Raise if a pagination cursor token can't be decoded
+    """
+    pass
@@ -2,16 +2,17 @@ import os, base64
 from ethereum import utils
 from web3 import Web3
 from sqlalchemy.ext.hybrid import hybrid_property
-from sqlalchemy.dialects.postgresql import JSON, INET
-from sqlalchemy.sql import func
-from cryptography.fernet import Fernet
+from sqlalchemy.dialects.postgresql import JSON, INET, insert
+from sqlalchemy.sql import func, tuple_, select
 from itsdangerous import TimedJSONWebSignatureSerializer, BadSignature, SignatureExpired
 from flask import g, request, current_app
-import datetime, bcrypt, jwt, enum, random, string
+import datetime, bcrypt, jwt, enum, random, string, json
 import pyotp
+from phonenumbers.phonenumberutil import NumberParseException
 
 
-from server.exceptions import TierNotFoundException, InvalidTransferTypeException, NoTransferAccountError, NoTransferCardError, TypeNotFoundException, IconNotSupportedException
+from server.exceptions import TierNotFoundException, InvalidTransferTypeException, NoTransferAccountError, NoTransferCardError, TypeNotFoundException, IconNotSupportedException, \
+    InvalidCursorError
 from server.constants import ALLOWED_ADMIN_TIERS, ALLOWED_KYC_TYPES, ALLOWED_BLOCKCHAIN_ADDRESS_TYPES, MATERIAL_COMMUNITY_ICONS
 from server import db, sentry, celery_app
 from server.utils.phone import proccess_phone_number
@@ -19,6 +20,8 @@ from server.utils.credit_transfers import make_disbursement_transfer, make_withd
 from server.utils.amazon_s3 import get_file_url
 from server.utils.user import get_transfer_card
 from server.utils.misc import elapsed_time, encrypt_string, decrypt_string
+from server.utils.master_wallet import release_master_wallet_funds
+from server.utils.auth_cache import is_token_blacklisted
 
 class TransferTypeEnum(enum.Enum):
     PAYMENT      = "PAYMENT"
@@ -42,6 +45,12 @@ class TransferStatusEnum(enum.Enum):
     # BLOCKCHAIN_REJECTED = -2
     # BLOCKCHAIN_COMPLETE = 2
 
+class MasterWalletApprovalStatusEnum(enum.Enum):
+    NO_REQUEST = 'NO_REQUEST'
+    REQUESTED  = 'REQUESTED'
+    APPROVED   = 'APPROVED'
+    FAILED     = 'FAILED'
+
 def paginate_query(query, queried_object=None, order_override=None):
     """
     Paginates an sqlalchemy query, gracefully managing missing queries.
@@ -82,6 +91,91 @@ def paginate_query(query, queried_object=None, order_override=None):
     return paginated.items, paginated.total, paginated.pages
 
 
+DEFAULT_CURSOR_PAGE_SIZE = 50
+
+_CURSOR_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def encode_pagination_cursor(item):
+    """
+    Opaque token for an item's position in (created, id) order
+    """
+    created_microseconds = (item.created - _CURSOR_EPOCH) // datetime.timedelta(microseconds=1)
+    return base64.urlsafe_b64encode(json.dumps([created_microseconds, item.id]).encode()).decode()
+
+
+def decode_pagination_cursor(cursor):
+    try:
+        created_microseconds, item_id = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+        return _CURSOR_EPOCH + datetime.timedelta(microseconds=int(created_microseconds)), int(item_id)
+
+    except Exception:
+        raise InvalidCursorError('Invalid Cursor: {}'.format(cursor))
+
+
+def cursor_pagination_requested():
+    return 'after_id' in request.args or 'before_id' in request.args
+
+
+def paginate_query_by_cursor(query, queried_object):
+    """
+    Keyset paginates an sqlalchemy query on (created, id), most recently created first.
+    Unlike paginate_query, deep pages cost the same as the first as there's no OFFSET,
+    and the total count is only run if requested with count=true.
+
+    Pass the next_cursor of a page as after_id to get the next (older) page, or the previous_cursor
+    as before_id to get the previous (newer) page. An empty after_id starts from the most recent.
+
+    :param query: base query
+    :param queried_object: underlying object being queried, with created and id columns
+    :returns: tuple of (item list, total number of items or None, next cursor or None, previous cursor or None)
+    :raises InvalidCursorError: if after_id or before_id isn't a cursor from a previous page
+    """
+
+    per_page = int(request.args.get('per_page') or DEFAULT_CURSOR_PAGE_SIZE)
+    after_cursor = request.args.get('after_id')
+    before_cursor = request.args.get('before_id')
+    include_count = request.args.get('count', '').lower() == 'true'
+
+    total_items = query.order_by(None).count() if include_count else None
+
+    position = tuple_(queried_object.created, queried_object.id)
+
+    if before_cursor:
+        created, item_id = decode_pagination_cursor(before_cursor)
+
+        items = (query.order_by(None)
+                 .filter(position > tuple_(created, item_id))
+                 .order_by(queried_object.created.asc(), queried_object.id.asc())
+                 .limit(per_page + 1)
+                 .all())
+
+        has_newer = len(items) > per_page
+        items = list(reversed(items[:per_page]))
+        has_older = True
+
+    else:
+        query = query.order_by(None)
+
+        if after_cursor:
+            created, item_id = decode_pagination_cursor(after_cursor)
+            query = query.filter(position < tuple_(created, item_id))
+
+        items = (query
+                 .order_by(queried_object.created.desc(), queried_object.id.desc())
+                 .limit(per_page + 1)
+                 .all())
+
+        has_older = len(items) > per_page
+        items = items[:per_page]
+        has_newer = bool(after_cursor)
+
+    next_cursor = encode_pagination_cursor(items[-1]) if items and has_older else None
+    previous_cursor = encode_pagination_cursor(items[0]) if items and has_newer else None
+
+    return items, total_items, next_cursor, previous_cursor
+
+
 def get_authorising_user_id():
     if hasattr(g,'user'):
         return g.user.id
@@ -111,16 +205,18 @@ class User(ModelBase):
         created using the POST user API or the bulk upload function
     """
     __tablename__ = 'user'
+    # For keyset pagination, see paginate_query_by_cursor
+    __table_args__ = (db.Index('ix_user_created_id', 'created', 'id'),)
 
     first_name      = db.Column(db.String())
     last_name       = db.Column(db.String())
 
     _last_seen       = db.Column(db.DateTime)
 
-    email                   = db.Column(db.String())
+    _email                  = db.Column('email', db.String())
     _phone                  = db.Column(db.String())
     _public_serial_number   = db.Column(db.String())
-    nfc_serial_number       = db.Column(db.String())
+    _nfc_serial_number      = db.Column('nfc_serial_number', db.String())
 
     password_hash   = db.Column(db.String(128))
     one_time_code   = db.Column(db.String)
@@ -182,6 +278,37 @@ class User(ModelBase):
 
     ip_addresses     = db.relationship('IpAddress', backref='user', lazy=True)
 
+    # Kept in sync by the identifier setters below, see find_user_from_public_identifier
+    identifiers      = db.relationship('UserIdentifier', backref='user', lazy=True,
+                                       cascade='all, delete-orphan')
+
+    def _set_identifier(self, identifier_type, value):
+        normalized_value = UserIdentifier.normalize(identifier_type, value)
+
+        existing = None
+        for identifier in self.identifiers:
+            if identifier.type == identifier_type:
+                existing = identifier
+
+        if normalized_value is None:
+            if existing:
+                self.identifiers.remove(existing)
+
+        elif existing:
+            existing.value = normalized_value
+
+        else:
+            self.identifiers.append(UserIdentifier(type=identifier_type, value=normalized_value))
+
+    @hybrid_property
+    def email(self):
+        return self._email
+
+    @email.setter
+    def email(self, email):
+        self._email = email
+        self._set_identifier(UserIdentifier.EMAIL, email)
+
     @hybrid_property
     def phone(self):
         return self._phone
@@ -189,6 +316,16 @@ class User(ModelBase):
     @phone.setter
     def phone(self, phone):
         self._phone = proccess_phone_number(phone)
+        self._set_identifier(UserIdentifier.PHONE, self._phone)
+
+    @hybrid_property
+    def nfc_serial_number(self):
+        return self._nfc_serial_number
+
+    @nfc_serial_number.setter
+    def nfc_serial_number(self, nfc_serial_number):
+        self._nfc_serial_number = nfc_serial_number
+        self._set_identifier(UserIdentifier.NFC_SERIAL_NUMBER, nfc_serial_number)
 
     @hybrid_property
     def public_serial_number(self):
@@ -197,6 +334,7 @@ class User(ModelBase):
     @public_serial_number.setter
     def public_serial_number(self, public_serial_number):
         self._public_serial_number = public_serial_number
+        self._set_identifier(UserIdentifier.PUBLIC_SERIAL_NUMBER, public_serial_number)
 
         try:
             transfer_card = get_transfer_card(public_serial_number)
@@ -534,6 +672,56 @@ class User(ModelBase):
             return '<Beneficiary {} {}>'.format(self.id, self.phone)
 
 
+class UserIdentifier(ModelBase):
+    """
+    A normalized email, phone, public serial number or nfc serial number that a user can be found by,
+    so that looking a user up by any of them is a single indexed query. Maintained by the User setters.
+    """
+    __tablename__ = 'user_identifier'
+    # Not unique, as nothing stops two users sharing a phone or email. Lookups take the earliest created
+    __table_args__ = (db.Index('ix_user_identifier_type_value', 'type', 'value'),)
+
+    EMAIL = 'EMAIL'
+    PHONE = 'PHONE'
+    PUBLIC_SERIAL_NUMBER = 'PUBLIC_SERIAL_NUMBER'
+    NFC_SERIAL_NUMBER = 'NFC_SERIAL_NUMBER'
+
+    # In the order find_user_from_public_identifier tries them
+    TYPES = [EMAIL, PHONE, PUBLIC_SERIAL_NUMBER, NFC_SERIAL_NUMBER]
+
+    # Not stored, as addresses belong to transfer accounts. Found through the blockchain address index instead
+    BLOCKCHAIN_ADDRESS = 'BLOCKCHAIN_ADDRESS'
+
+    type    = db.Column(db.String, nullable=False)
+    value   = db.Column(db.String, nullable=False)
+
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)
+
+    @classmethod
+    def normalize(cls, identifier_type, value):
+        """
+        :return: the value as stored for the identifier type, or None if it can't be one
+        """
+        if value is None:
+            return None
+
+        value = str(value).strip()
+
+        if value == '':
+            return None
+
+        if identifier_type == cls.PHONE:
+            try:
+                return proccess_phone_number(value)
+            except NumberParseException:
+                return None
+
+        if identifier_type == cls.NFC_SERIAL_NUMBER:
+            return value.upper()
+
+        return value.lower()
+
+
 class ChatbotState(ModelBase):
     __tablename__ = 'chatbot_state'
 
@@ -564,12 +752,22 @@ class DeviceInfo(ModelBase):
 
 class TransferAccount(ModelBase):
     __tablename__ = 'transfer_account'
+    # For keyset pagination, see paginate_query_by_cursor
+    __table_args__ = (db.Index('ix_transfer_account_created_id', 'created', 'id'),)
 
     name            = db.Column(db.String())
-    # balance         = db.Column(db.BigInteger, default=0)
+
+    # Running total of COMPLETE transfers in minus out, maintained by CreditTransfer resolution.
+    # Use the reconcile_balances manage command to check it against the transfer history.
+    _balance        = db.Column(db.BigInteger, default=0, index=True)
 
     is_approved     = db.Column(db.Boolean, default=False)
 
+    # Kept up to date from 'master wallet approval' blockchain transactions by update_master_wallet_approval_status
+    _master_wallet_approval_status = db.Column(db.Enum(MasterWalletApprovalStatusEnum),
+                                               default=MasterWalletApprovalStatusEnum.NO_REQUEST)
+    master_wallet_approval_status_updated = db.Column(db.DateTime)
+
     # These are different from the permissions on the user:
     # is_vendor determines whether the account is allowed to have cash out operations etc
     # is_beneficiary determines whether the account is included in disbursement lists etc
@@ -611,7 +809,28 @@ class TransferAccount(ModelBase):
 
     @hybrid_property
     def balance(self):
-        return self.total_received - self.total_sent
+        return self._balance or 0
+
+    @balance.expression
+    def balance(cls):
+        return cls._balance
+
+    def increment_balance(self, delta):
+        """
+        Applies delta to the persisted balance. For accounts already in the database this is done as a
+        single 'balance = balance + delta' update within the current transaction, so concurrent transfers
+        against the same account can't overwrite one another.
+        """
+        if self.id is None:
+            self._balance = (self._balance or 0) + delta
+            return
+
+        (db.session.query(TransferAccount)
+         .filter(TransferAccount.id == self.id)
+         .update({TransferAccount._balance: func.coalesce(TransferAccount._balance, 0) + delta},
+                 synchronize_session=False))
+
+        db.session.expire(self, ['_balance'])
 
     @hybrid_property
     def primary_user(self):
@@ -634,28 +853,29 @@ class TransferAccount(ModelBase):
         if not self.blockchain_address.encoded_private_key:
             return 'NOT_REQUIRED'
 
-        base_query = (
-            BlockchainTransaction.query
-            .filter(BlockchainTransaction.transaction_type == 'master wallet approval')
-            .filter(BlockchainTransaction.credit_transfer.has(recipient_transfer_account_id=self.id))
-        )
+        if self._master_wallet_approval_status is None:
+            return MasterWalletApprovalStatusEnum.NO_REQUEST.value
 
-        successful_transactions = base_query.filter(BlockchainTransaction.status == 'SUCCESS').all()
+        return self._master_wallet_approval_status.value
 
-        if len(successful_transactions) > 0:
-            return 'APPROVED'
-
-        requested_transactions = base_query.filter(BlockchainTransaction.status == 'PENDING').all()
-
-        if len(requested_transactions) > 0:
-            return 'REQUESTED'
+    def update_master_wallet_approval_status(self, transaction_status):
+        """
+        Updates the cached approval state from the status of a 'master wallet approval' blockchain transaction.
+        Approval is one way, so once APPROVED the account stays APPROVED.
+        """
 
-        failed_transactions = base_query.filter(BlockchainTransaction.status == 'FAILED').all()
+        if self._master_wallet_approval_status == MasterWalletApprovalStatusEnum.APPROVED:
+            return
 
-        if len(failed_transactions) > 0:
-            return 'FAILED'
+        new_status = {
+            'PENDING': MasterWalletApprovalStatusEnum.REQUESTED,
+            'SUCCESS': MasterWalletApprovalStatusEnum.APPROVED,
+            'FAILED': MasterWalletApprovalStatusEnum.FAILED
+        }.get(transaction_status)
 
-        return 'NO_REQUEST'
+        if new_status is not None and new_status != self._master_wallet_approval_status:
+            self._master_wallet_approval_status = new_status
+            self.master_wallet_approval_status_updated = datetime.datetime.utcnow()
 
     def approve(self):
 
@@ -689,10 +909,44 @@ class TransferAccount(ModelBase):
 
         self.blockchain_address = blockchain_address_obj
 
+class BalanceCheckpoint(ModelBase):
+    """
+    The balance of a transfer account counting every balance ledger entry claimed by checkpoint runs up to
+    checkpoint_date. Historical balances are found from the nearest earlier checkpoint plus the ledger entries
+    it didn't count, rather than summing the account's whole history.
+    """
+    __tablename__ = 'balance_checkpoint'
+
+    checkpoint_date     = db.Column(db.DateTime, index=True)
+    balance             = db.Column(db.BigInteger, default=0)
+    last_transfer_id    = db.Column(db.Integer)
+
+    transfer_account_id = db.Column(db.Integer, db.ForeignKey('transfer_account.id'), index=True)
+
+    transfer_account    = db.relationship('TransferAccount', lazy=True)
+
+class BalanceLedgerEntry(ModelBase):
+    """
+    A change made to a transfer account's balance, as a transfer is completed or a completed transfer is reversed.
+    Each checkpoint run claims the entries it counts by setting their checkpoint_date, so entries committed
+    late, and reversals of transfers already checkpointed, are counted by the next run.
+    """
+    __tablename__ = 'balance_ledger_entry'
+
+    amount              = db.Column(db.BigInteger)
+    entry_date          = db.Column(db.DateTime, default=datetime.datetime.utcnow, index=True)
+    checkpoint_date     = db.Column(db.DateTime, index=True)
+
+    transfer_account_id = db.Column(db.Integer, db.ForeignKey('transfer_account.id'), index=True)
+    credit_transfer_id  = db.Column(db.Integer, db.ForeignKey('credit_transfer.id'), index=True)
+
+    transfer_account    = db.relationship('TransferAccount', lazy=True)
+    credit_transfer     = db.relationship('CreditTransfer', lazy=True)
+
 class BlockchainAddress(ModelBase):
     __tablename__ = 'blockchain_address'
 
-    address             = db.Column(db.String())
+    address             = db.Column(db.String(), index=True)
     encoded_private_key = db.Column(db.String())
 
     # Either "MASTER", "TRANSFER_ACCOUNT" or "EXTERNAL"
@@ -713,18 +967,10 @@ class BlockchainAddress(ModelBase):
 
     @hybrid_property
     def decrypted_private_key(self):
-
-        fernet_encryption_key = base64.b64encode(utils.sha3(current_app.config['SECRET_KEY']))
-        cipher_suite = Fernet(fernet_encryption_key)
-
-        return cipher_suite.decrypt(self.encoded_private_key.encode('utf-8')).decode('utf-8')
+        return decrypt_string(self.encoded_private_key)
 
     def encrypt_private_key(self, unencoded_private_key):
-
-        fernet_encryption_key = base64.b64encode(utils.sha3(current_app.config['SECRET_KEY']))
-        cipher_suite = Fernet(fernet_encryption_key)
-
-        return cipher_suite.encrypt(unencoded_private_key.encode('utf-8')).decode('utf-8')
+        return encrypt_string(unencoded_private_key)
 
     def calculate_address(self, private_key):
         raw_address = utils.privtoaddr(private_key)
@@ -745,15 +991,61 @@ class BlockchainAddress(ModelBase):
 
         if self.type == "TRANSFER_ACCOUNT" and not blockchain_address:
 
-            hex_private_key = Web3.toHex(utils.sha3(os.urandom(4096)))
+            pooled_keypair = BlockchainKeypair.claim()
+
+            if pooled_keypair:
+                self.address, self.encoded_private_key = pooled_keypair
+
+            else:
+                hex_private_key = Web3.toHex(utils.sha3(os.urandom(4096)))
+
+                self.encoded_private_key = self.encrypt_private_key(hex_private_key)
+
+                self.calculate_address(hex_private_key)
+
+
+class BlockchainKeypair(ModelBase):
+    """
+    A pre-generated TRANSFER_ACCOUNT keypair, so that creating an account doesn't pay for the key generation
+    and encryption. Claimed by BlockchainAddress, and topped up by refill_blockchain_keypair_pool.
+    """
+    __tablename__ = 'blockchain_keypair_pool'
+
+    address             = db.Column(db.String())
+    encoded_private_key = db.Column(db.String())
 
-            self.encoded_private_key = self.encrypt_private_key(hex_private_key)
+    @classmethod
+    def claim(cls):
+        """
+        Takes a keypair out of the pool, skipping rows that concurrent transactions are claiming.
+        The row is only gone once the caller's transaction commits, so a rolled back claim returns it to the pool.
 
-            self.calculate_address(hex_private_key)
+        :return: tuple of (address, encoded private key), or None if the pool is empty
+        """
+        table = cls.__table__
+
+        claimable_id = (select([table.c.id])
+                        .order_by(table.c.id)
+                        .limit(1)
+                        .with_for_update(skip_locked=True)
+                        .as_scalar())
+
+        claimed = db.session.execute(
+            table.delete()
+            .where(table.c.id == claimable_id)
+            .returning(table.c.address, table.c.encoded_private_key)
+        ).first()
+
+        if claimed is None:
+            return None
+
+        return claimed.address, claimed.encoded_private_key
 
 
 class CreditTransfer(ModelBase):
     __tablename__ = 'credit_transfer'
+    # For keyset pagination, see paginate_query_by_cursor
+    __table_args__ = (db.Index('ix_credit_transfer_created_id', 'created', 'id'),)
 
     uuid            = db.Column(db.String, unique=True)
 
@@ -782,22 +1074,50 @@ class CreditTransfer(ModelBase):
 
     attached_images = db.relationship('UploadedImage', backref='credit_transfer', lazy=True)
 
+    # Denormalized from blockchain_transactions by update_blockchain_status, so they can be filtered and
+    # serialized without walking the transactions. Calculated on read while NULL
+    _blockchain_status           = db.Column(db.String, index=True)
+    _blockchain_status_breakdown = db.Column(JSON)
+
     @hybrid_property
     def blockchain_status(self):
+        if self._blockchain_status is None:
+            return self._calculate_blockchain_status()
+
+        return self._blockchain_status
+
+    @blockchain_status.expression
+    def blockchain_status(cls):
+        return cls._blockchain_status
+
+    @hybrid_property
+    def blockchain_status_breakdown(self):
+        if self._blockchain_status_breakdown is None:
+            return self._calculate_blockchain_status_breakdown()
+
+        return self._blockchain_status_breakdown
+
+    def update_blockchain_status(self):
+        """
+        Recalculates the persisted blockchain status and breakdown from the transfer's blockchain transactions.
+        Called whenever one of them changes.
+        """
+        self._blockchain_status_breakdown = self._calculate_blockchain_status_breakdown()
+        self._blockchain_status = self._calculate_blockchain_status()
+
+    def _calculate_blockchain_status(self):
         if len(self.uncompleted_blockchain_tasks) == 0:
             return 'COMPLETE'
 
-        if len(self.pending_blockchain_tasks) > 0:
+        elif len(self.pending_blockchain_tasks) > 0:
             return 'PENDING'
 
-        if len(self.failed_blockchain_tasks) > 0:
+        elif len(self.failed_blockchain_tasks) > 0:
             return 'ERROR'
 
         return 'UNKNOWN'
 
-
-    @hybrid_property
-    def blockchain_status_breakdown(self):
+    def _calculate_blockchain_status_breakdown(self):
 
         required_task_dict = {x: {'status': 'UNKNOWN', 'hash': None} for x in self._get_required_blockchain_tasks()}
 
@@ -805,7 +1125,7 @@ class CreditTransfer(ModelBase):
             status_hierarchy = ['UNKNOWN', 'FAILED', 'PENDING', 'SUCCESS']
             task_type = transaction.transaction_type
 
-            current_status = required_task_dict.get(task_type).get('status')
+            current_status = required_task_dict.get(task_type, {}).get('status')
             proposed_new_status = transaction.status
 
             try:
@@ -870,7 +1190,10 @@ class CreditTransfer(ModelBase):
     def delta_transfer_account_balance(self, transfer_account, delta):
 
             if transfer_account:
-                transfer_account.balance += delta
+                transfer_account.increment_balance(delta)
+
+                db.session.add(BalanceLedgerEntry(transfer_account=transfer_account, credit_transfer=self,
+                                                  amount=delta, entry_date=datetime.datetime.utcnow()))
 
     def send_blockchain_payload_to_worker(self, is_retry=False):
         if self.transfer_type == TransferTypeEnum.DISBURSEMENT:
@@ -952,6 +1275,9 @@ class CreditTransfer(ModelBase):
         else:
             raise InvalidTransferTypeException("Invalid Transfer Type")
 
+        # Persist the required tasks up front, so the transfer serializes without querying its transactions
+        self.update_blockchain_status()
+
         if not is_retry or len(blockchain_payload['uncompleted_tasks']) > 0:
             try:
                 blockchain_task = celery_app.signature('worker.celery_tasks.make_blockchain_transaction', kwargs={'blockchain_payload': blockchain_payload})
@@ -964,11 +1290,16 @@ class CreditTransfer(ModelBase):
 
 
     def resolve_as_completed(self, existing_blockchain_txn=None):
+        previous_status = self.transfer_status
+
         self.resolved_date = datetime.datetime.utcnow()
         self.transfer_status = TransferStatusEnum.COMPLETE
 
-        # self.delta_transfer_account_balance(self.sender_transfer_account, -self.transfer_amount)
-        # self.delta_transfer_account_balance(self.recipient_transfer_account, self.transfer_amount)
+        if previous_status != TransferStatusEnum.COMPLETE:
+            self.delta_transfer_account_balance(self.sender_transfer_account, -self.transfer_amount)
+            self.delta_transfer_account_balance(self.recipient_transfer_account, self.transfer_amount)
+
+            DailyTransferRollup.record_status_change(self, previous_status, TransferStatusEnum.COMPLETE)
 
         elapsed_time('4.3.1: Delta')
 
@@ -982,9 +1313,23 @@ class CreditTransfer(ModelBase):
         elapsed_time('4.3.3: Payload sent')
 
     def resolve_as_rejected(self, message=None):
+        previous_status = self.transfer_status
+
+        if previous_status == TransferStatusEnum.COMPLETE:
+            # Reverse the balance change made when this transfer was completed
+            self.delta_transfer_account_balance(self.sender_transfer_account, self.transfer_amount)
+            self.delta_transfer_account_balance(self.recipient_transfer_account, -self.transfer_amount)
+
         self.resolved_date = datetime.datetime.utcnow()
         self.transfer_status = TransferStatusEnum.REJECTED
 
+        if previous_status != TransferStatusEnum.REJECTED:
+            DailyTransferRollup.record_status_change(self, previous_status, TransferStatusEnum.REJECTED)
+
+        if self.transfer_type == TransferTypeEnum.DISBURSEMENT and self.id is not None:
+            # Return any master wallet funds held for the disbursement
+            release_master_wallet_funds(self.id)
+
         if message:
             self.resolution_message = message
 
@@ -1051,6 +1396,170 @@ class CreditTransfer(ModelBase):
 
         self.transfer_amount = amount
 
+class DailyTransferRollup(ModelBase):
+    """
+    Count, volume and distinct senders of resolved credit transfers, per day created x type x status.
+    Maintained as transfers resolve so that dashboard stats scale with days rather than transfers.
+    Rebuild from the transfer history with the rebuild_transfer_rollups manage command.
+    """
+    __tablename__ = 'daily_transfer_rollup'
+    __table_args__ = (db.UniqueConstraint('date', 'transfer_type', 'transfer_status'),)
+
+    ROLLED_UP_STATUSES = [TransferStatusEnum.COMPLETE, TransferStatusEnum.REJECTED]
+
+    date                = db.Column(db.DateTime, index=True)
+    transfer_type       = db.Column(db.Enum(TransferTypeEnum))
+    transfer_status     = db.Column(db.Enum(TransferStatusEnum))
+
+    transfer_count      = db.Column(db.Integer, default=0)
+    volume              = db.Column(db.BigInteger, default=0)
+    distinct_senders    = db.Column(db.Integer, default=0)
+
+    @classmethod
+    def record_status_change(cls, credit_transfer, previous_status, new_status):
+        """
+        Moves a credit transfer between rollup buckets. Unresolved (pending) transfers aren't rolled up.
+        """
+        if previous_status in cls.ROLLED_UP_STATUSES:
+            cls._apply(credit_transfer, previous_status, -1)
+
+        if new_status in cls.ROLLED_UP_STATUSES:
+            cls._apply(credit_transfer, new_status, 1)
+
+    @classmethod
+    def _apply(cls, credit_transfer, transfer_status, sign):
+        created = credit_transfer.created or datetime.datetime.utcnow()
+        day = datetime.datetime(created.year, created.month, created.day)
+
+        distinct_senders_delta = 0
+
+        if credit_transfer.sender_user_id is not None:
+            sender_transfer_count = DailyTransferSenderRollup.increment(
+                day, credit_transfer.transfer_type, transfer_status, credit_transfer.sender_user_id, sign)
+
+            if sign > 0 and sender_transfer_count == 1:
+                distinct_senders_delta = 1
+            elif sign < 0 and sender_transfer_count == 0:
+                distinct_senders_delta = -1
+
+        TransferAccountDailyRollup.increment(day, credit_transfer, transfer_status, sign)
+
+        table = cls.__table__
+
+        # Upsert, incrementing in the database so that concurrent resolutions don't overwrite one another
+        statement = insert(table).values(
+            date=day,
+            transfer_type=credit_transfer.transfer_type,
+            transfer_status=transfer_status,
+            transfer_count=sign,
+            volume=sign * (credit_transfer.transfer_amount or 0),
+            distinct_senders=distinct_senders_delta
+        )
+
+        statement = statement.on_conflict_do_update(
+            index_elements=['date', 'transfer_type', 'transfer_status'],
+            set_={
+                'transfer_count': table.c.transfer_count + statement.excluded.transfer_count,
+                'volume': table.c.volume + statement.excluded.volume,
+                'distinct_senders': table.c.distinct_senders + statement.excluded.distinct_senders,
+                'updated': datetime.datetime.utcnow()
+            })
+
+        db.session.execute(statement)
+
+
+class DailyTransferSenderRollup(ModelBase):
+    """
+    Number of transfers per sender within each DailyTransferRollup bucket,
+    used to keep the rollup's distinct sender count correct as transfers change status.
+    """
+    __tablename__ = 'daily_transfer_sender_rollup'
+    __table_args__ = (db.UniqueConstraint('date', 'transfer_type', 'transfer_status', 'sender_user_id'),)
+
+    date                = db.Column(db.DateTime, index=True)
+    transfer_type       = db.Column(db.Enum(TransferTypeEnum))
+    transfer_status     = db.Column(db.Enum(TransferStatusEnum))
+    sender_user_id      = db.Column(db.Integer, db.ForeignKey('user.id'))
+
+    transfer_count      = db.Column(db.Integer, default=0)
+
+    @classmethod
+    def increment(cls, day, transfer_type, transfer_status, sender_user_id, sign):
+        """
+        :return: the sender's transfer count in the bucket after incrementing
+        """
+        table = cls.__table__
+
+        statement = insert(table).values(
+            date=day,
+            transfer_type=transfer_type,
+            transfer_status=transfer_status,
+            sender_user_id=sender_user_id,
+            transfer_count=sign
+        )
+
+        statement = statement.on_conflict_do_update(
+            index_elements=['date', 'transfer_type', 'transfer_status', 'sender_user_id'],
+            set_={
+                'transfer_count': table.c.transfer_count + statement.excluded.transfer_count,
+                'updated': datetime.datetime.utcnow()
+            }
+        ).returning(table.c.transfer_count)
+
+        return db.session.execute(statement).scalar()
+
+
+class TransferAccountDailyRollup(ModelBase):
+    """
+    Count and volume of resolved credit transfers per day for each transfer account, used to segment stats.
+    Disbursements are attributed to the account receiving them, payments and withdrawals to the account sending.
+    """
+    __tablename__ = 'transfer_account_daily_rollup'
+    __table_args__ = (db.UniqueConstraint('date', 'transfer_type', 'transfer_status', 'transfer_account_id'),)
+
+    date                = db.Column(db.DateTime, index=True)
+    transfer_type       = db.Column(db.Enum(TransferTypeEnum))
+    transfer_status     = db.Column(db.Enum(TransferStatusEnum))
+    transfer_account_id = db.Column(db.Integer, db.ForeignKey('transfer_account.id'), index=True)
+
+    transfer_count      = db.Column(db.Integer, default=0)
+    volume              = db.Column(db.BigInteger, default=0)
+
+    @staticmethod
+    def attributed_transfer_account_id(credit_transfer):
+        if credit_transfer.transfer_type == TransferTypeEnum.DISBURSEMENT:
+            return credit_transfer.recipient_transfer_account_id
+        return credit_transfer.sender_transfer_account_id
+
+    @classmethod
+    def increment(cls, day, credit_transfer, transfer_status, sign):
+        transfer_account_id = cls.attributed_transfer_account_id(credit_transfer)
+
+        if transfer_account_id is None:
+            return
+
+        table = cls.__table__
+
+        statement = insert(table).values(
+            date=day,
+            transfer_type=credit_transfer.transfer_type,
+            transfer_status=transfer_status,
+            transfer_account_id=transfer_account_id,
+            transfer_count=sign,
+            volume=sign * (credit_transfer.transfer_amount or 0)
+        )
+
+        statement = statement.on_conflict_do_update(
+            index_elements=['date', 'transfer_type', 'transfer_status', 'transfer_account_id'],
+            set_={
+                'transfer_count': table.c.transfer_count + statement.excluded.transfer_count,
+                'volume': table.c.volume + statement.excluded.volume,
+                'updated': datetime.datetime.utcnow()
+            })
+
+        db.session.execute(statement)
+
+
 class BlockchainTransaction(ModelBase):
     __tablename__ = 'blockchain_transaction'
 
@@ -1153,12 +1662,8 @@ class BlacklistToken(ModelBase):
 
     @staticmethod
     def check_blacklist(auth_token):
-        # check whether auth token has been blacklisted
-        res = BlacklistToken.query.filter_by(token=str(auth_token)).first()
-        if res:
-            return True
-        else:
-            return False
+        # check whether auth token has been blacklisted. New tokens are added to redis on commit
+        return is_token_blacklisted(auth_token)
 
     def __init__(self, token):
         self.token = token
@@ -1221,6 +1726,64 @@ class SavedFilter(ModelBase):
     filter        = db.Column(JSON)
 
 
+class DatasetImportJob(ModelBase):
+    """
+    A spreadsheet import, run a chunk at a time by the worker, so that progress can be reported as it goes
+    """
+    __tablename__ = 'dataset_import_job'
+
+    # Either "PENDING", "RUNNING", "COMPLETE" or "FAILED"
+    status          = db.Column(db.String, default='PENDING')
+
+    # Rows are streamed from a stored spreadsheet, or otherwise read from the job's DatasetImportRows
+    spreadsheet_token   = db.Column(db.String)
+    header_positions    = db.Column(JSON)
+    first_data_row      = db.Column(db.Integer, default=0)
+    # Byte offset of the next row to import from a csv spreadsheet, so each chunk starts where the last one ended
+    spreadsheet_position = db.Column(db.BigInteger)
+
+    row_count       = db.Column(db.Integer, default=0)
+    processed_count = db.Column(db.Integer, default=0)
+    created_count   = db.Column(db.Integer, default=0)
+    updated_count   = db.Column(db.Integer, default=0)
+    failed_count    = db.Column(db.Integer, default=0)
+
+    # Set while a request is importing a chunk, see claim_import_job
+    processing_since = db.Column(db.DateTime)
+
+    error           = db.Column(db.String)
+
+    @property
+    def failures(self):
+        return [{'row': failure.row_number, 'message': failure.message} for failure in
+                DatasetImportFailure.query.filter_by(job_id=self.id).order_by(DatasetImportFailure.row_number)]
+
+
+class DatasetImportRow(ModelBase):
+    """
+    An attribute dict still to be imported by a DatasetImportJob, where it wasn't created from a stored spreadsheet
+    """
+    __tablename__ = 'dataset_import_row'
+    __table_args__ = (db.Index('ix_dataset_import_row_job_id_row_number', 'job_id', 'row_number'),)
+
+    row_number      = db.Column(db.Integer)
+    attribute_dict  = db.Column(JSON)
+
+    job_id          = db.Column(db.Integer, db.ForeignKey('dataset_import_job.id'))
+
+
+class DatasetImportFailure(ModelBase):
+    """
+    A row a DatasetImportJob couldn't import, and why
+    """
+    __tablename__ = 'dataset_import_failure'
+
+    row_number      = db.Column(db.Integer)
+    message         = db.Column(db.String)
+
+    job_id          = db.Column(db.Integer, db.ForeignKey('dataset_import_job.id'), index=True)
+
+
 class KycApplication(ModelBase):
     __tablename__       = 'kyc_application'
 
@@ -1343,13 +1906,16 @@ class IpAddress(ModelBase):
         self._ip = ip
 
         if ip is not None:
+            self.locate_ip(self.id, ip)
 
-            try:
-                task = {'ip_address_id': self.id, 'ip': ip}
-                ip_location_task = celery_app.signature('worker.celery_tasks.ip_location', args=(task,))
+    @staticmethod
+    def locate_ip(ip_address_id, ip):
+        try:
+            task = {'ip_address_id': ip_address_id, 'ip': ip}
+            ip_location_task = celery_app.signature('worker.celery_tasks.ip_location', args=(task,))
 
-                ip_location_task.delay()
-            except Exception as e:
-                print(e)
-                sentry.captureException()
-                pass
+            ip_location_task.delay()
+        except Exception as e:
+            print(e)
+            sentry.captureException()
+            pass
@@ -1,6 +1,9 @@
 from flask import g
 from marshmallow import Schema, fields, ValidationError, pre_load, post_dump, pre_dump
+from sqlalchemy.orm import selectinload, joinedload, configure_mappers
 from server.utils.amazon_s3 import get_file_url
+from server.utils.transfer_account import load_transfer_accounts_for_credit_transfers
+from server.utils.reference_data import get_reference_data
 from server import models
 
 class UserSchema(Schema):
@@ -42,11 +45,7 @@ class UserSchema(Schema):
 
     def get_json_data(self, obj):
         
-        allowed_custom_attributes_objs = models.CustomAttribute.query.all()
-        allowed_custom_attributes = []
-
-        for attribute in allowed_custom_attributes_objs:
-            allowed_custom_attributes.append(attribute.name)
+        allowed_custom_attributes = get_reference_data('custom_attributes')
 
         custom_attributes = obj.custom_attributes
 
@@ -102,6 +101,34 @@ class CreditTransferSchema(Schema):
 
     uuid = fields.String()
 
+    @pre_dump(pass_many=True)
+    def load_transfer_accounts(self, data, many):
+        if many and ('sender_transfer_account' in self.fields or 'recipient_transfer_account' in self.fields):
+            load_transfer_accounts_for_credit_transfers(data)
+        return data
+
+    @pre_dump(pass_many=True)
+    def load_authorising_users(self, data, many):
+        # Schema instances are shared between requests, so the cache only lives for one dump
+        self.context.pop('authorising_user_emails', None)
+
+        if many and 'authorising_user_email' in self.fields:
+            authorising_user_ids = set(transfer.authorising_user_id for transfer in data if transfer is not None)
+            authorising_user_ids.discard(None)
+
+            authorising_user_emails = {}
+            if authorising_user_ids:
+                authorising_user_emails = {
+                    row.id: row.email for row in
+                    models.User.query.with_entities(models.User.id, models.User.email)
+                    .filter(models.User.id.in_(authorising_user_ids))
+                    .all()
+                }
+
+            self.context['authorising_user_emails'] = authorising_user_emails
+
+        return data
+
     @post_dump(pass_many=True)
     def filter_rejected(self, data, many):
         if not self.context.get('filter_rejected'):
@@ -138,13 +165,18 @@ class CreditTransferSchema(Schema):
 
     blockchain_status = fields.Function(lambda obj: obj.blockchain_status)
     blockchain_status_breakdown = fields.Function(lambda obj: obj.blockchain_status_breakdown)
-    uncompleted_blockchain_tasks = fields.Function(lambda obj: list(obj.uncompleted_blockchain_tasks))
+    uncompleted_blockchain_tasks = fields.Function(
+        lambda obj: [task for task, details in obj.blockchain_status_breakdown.items() if details['status'] != 'SUCCESS'])
 
     def get_authorising_user_email(self, obj):
         authorising_user_id = obj.authorising_user_id
         if authorising_user_id is None:
             return None
 
+        authorising_user_emails = self.context.get('authorising_user_emails')
+        if authorising_user_emails is not None:
+            return authorising_user_emails.get(authorising_user_id)
+
         authorising_user = models.User.query.get(obj.authorising_user_id)
         if authorising_user is None:
             return None
@@ -152,6 +184,124 @@ class CreditTransferSchema(Schema):
         return authorising_user.email
 
 
+def credit_transfer_loader_options(schema):
+    """
+    Loader profile for a CreditTransferSchema: eager loads just the relationships the schema will serialize,
+    so that dumping a page of transfers takes a fixed number of queries rather than several per transfer.
+
+    :param schema: CreditTransferSchema instance that the query results will be dumped with
+    :return: list of options to apply to a CreditTransfer query
+    """
+
+    # Backref attributes only exist once the mappers have been configured
+    configure_mappers()
+
+    transfer = models.CreditTransfer
+
+    recipient_users = joinedload(transfer.recipient_transfer_account).selectinload(models.TransferAccount.users)
+
+    profile = {
+        'sender_user': [selectinload(transfer.sender_user)],
+        'recipient_user': [selectinload(transfer.recipient_user)],
+        'sender_transfer_account': [joinedload(transfer.sender_transfer_account)],
+        'recipient_transfer_account': [joinedload(transfer.recipient_transfer_account)],
+        'sender_blockchain_address': [joinedload(transfer.sender_blockchain_address)],
+        'recipient_blockchain_address': [joinedload(transfer.recipient_blockchain_address)],
+        'attached_images': [selectinload(transfer.attached_images)],
+        # lat and lng are taken from the recipient account's primary user
+        'lat': [recipient_users],
+        'lng': [recipient_users],
+    }
+
+    options = []
+    for field_name in schema.fields.keys():
+        for option in profile.get(field_name, []):
+            if option not in options:
+                options.append(option)
+
+    return options
+
+
+def transfer_account_loader_options(schema, via=None):
+    """
+    Loader profile for a TransferAccountSchema, see credit_transfer_loader_options.
+
+    :param schema: TransferAccountSchema instance that the query results will be dumped with
+    :param via: optional loader for the relationship the accounts are reached through, when nested in another schema
+    :return: list of options to apply to a TransferAccount query (or the query the loader is from)
+    """
+
+    configure_mappers()
+
+    account = models.TransferAccount
+
+    def load(relationship):
+        return via.selectinload(relationship) if via is not None else selectinload(relationship)
+
+    profile = {
+        'users': [load(account.users)],
+        # primary_user_id is picked from the account's users
+        'primary_user_id': [load(account.users)],
+        'blockchain_address': [load(account.blockchain_address)],
+        'credit_sends': [load(account.credit_sends)],
+        'credit_receives': [load(account.credit_receives)],
+    }
+
+    options = []
+    for field_name in schema.fields.keys():
+        for option in profile.get(field_name, []):
+            if option not in options:
+                options.append(option)
+
+    return options
+
+
+def user_loader_options(schema):
+    """
+    Loader profile for a UserSchema, see credit_transfer_loader_options.
+
+    :param schema: UserSchema instance that the query results will be dumped with
+    :return: list of options to apply to a User query
+    """
+
+    configure_mappers()
+
+    options = []
+    if 'transfer_account' in schema.fields:
+        via = joinedload(models.User.transfer_account)
+        options.append(via)
+        options.extend(transfer_account_loader_options(schema.fields['transfer_account'].schema, via=via))
+
+    return options
+
+
+def sparse_fieldset_schema(schema, requested_fields):
+    """
+    Restricts a schema to the top level fields listed in a comma separated fields= query parameter,
+    so that a view only pays for the fields it shows. Derive loader options from the returned schema.
+    The id is always included.
+
+    :param schema: schema instance to restrict
+    :param requested_fields: value of the fields= parameter, or None to use the schema as is
+    :return: schema instance
+    :raises ValueError: if a requested field isn't one the schema dumps
+    """
+
+    if not requested_fields:
+        return schema
+
+    field_names = ['id']
+    for field_name in requested_fields.split(','):
+        field_name = field_name.strip()
+        if field_name and field_name not in field_names:
+            field_names.append(field_name)
+
+    invalid_fields = [field_name for field_name in field_names if field_name not in schema.fields]
+    if invalid_fields:
+        raise ValueError('Invalid Filter: fields {}'.format(', '.join(invalid_fields)))
+
+    return schema.__class__(many=schema.many, only=field_names, exclude=schema.exclude, context=dict(schema.context))
+
 
 class TransferAccountSchema(Schema):
 
@@ -221,6 +371,20 @@ class SavedFilterSchema(Schema):
         return obj.filter
 
 
+class DatasetImportJobSchema(Schema):
+    id      = fields.Int(dump_only=True)
+    created = fields.DateTime(dump_only=True)
+
+    status          = fields.Str()
+    row_count       = fields.Int()
+    processed_count = fields.Int()
+    created_count   = fields.Int()
+    updated_count   = fields.Int()
+    failed_count    = fields.Int()
+    error           = fields.Str()
+    failures        = fields.Function(lambda obj: obj.failures)
+
+
 class BankAccountSchema(Schema):
     id              = fields.Int(dump_only=True)
     created         = fields.DateTime(dump_only=True)
@@ -339,6 +503,9 @@ uploaded_image_schema = UploadedImageSchema()
 referral_schema = ReferralSchema()
 referrals_schema = ReferralSchema(many=True)
 
+dataset_import_job_schema = DatasetImportJobSchema()
+dataset_import_progress_schema = DatasetImportJobSchema(exclude=("failures",))
+
 filter_schema = SavedFilterSchema()
 filters_schema = SavedFilterSchema(many=True)
 
@@ -1,6 +1,8 @@
 from functools import wraps, partial
 from flask import request, g, make_response, jsonify, current_app
-from server import models, db
+from server import models
+from server.utils.auth_cache import get_cached_auth_user, cache_user_auth_state
+from server.utils.user_activity import record_user_activity
 
 def requires_auth(f = None, required_roles=(), allowed_roles=(), ignore_tfa_requirement = False):
     if f is None:
@@ -53,7 +55,13 @@ def requires_auth(f = None, required_roles=(), allowed_roles=(), ignore_tfa_requ
 
             if not isinstance(resp, str):
 
-                    user = models.User.query.filter_by(id=resp['user_id']).first()
+                    real_ip_address = get_real_ip(request.headers.getlist("X-Forwarded-For"), num_proxy=1)
+
+                    user, known_ip_addresses = get_cached_auth_user(resp['user_id'])
+                    use_cached_user = user is not None
+
+                    if not use_cached_user:
+                        user = models.User.query.filter_by(id=resp['user_id']).first()
 
                     if not user:
                         responseObject = {
@@ -109,12 +117,13 @@ def requires_auth(f = None, required_roles=(), allowed_roles=(), ignore_tfa_requ
 
                     g.user = user
 
-                    proxies = request.headers.getlist("X-Forwarded-For")
-                    check_ip(proxies, user, num_proxy=1)
+                    if not use_cached_user:
+                        known_ip_addresses = cache_user_auth_state(user)
 
-                    # updates the validated user last seen timestamp
-                    user.update_last_seen_ts()
-                    db.session.commit()
+                    # Buffers the last seen timestamp and any new ip, to be saved by flush_user_activity
+                    if real_ip_address in known_ip_addresses:
+                        real_ip_address = None
+                    record_user_activity(user.id, real_ip_address)
 
                     #This is the point where you've made it through ok and you can return the top method
                     return f(*args, **kwargs)
@@ -171,7 +180,7 @@ def tfa_logic(user, tfa_token, ignore_tfa_requirement=False):
     return None
 
 
-def check_ip(proxies, user, num_proxy=0):
+def get_real_ip(proxies, num_proxy=0):
     """
     Proxies can be faked easily. Assumes there is a set number of proxies in production.
     Todo: make this more robust
@@ -179,9 +188,7 @@ def check_ip(proxies, user, num_proxy=0):
     correct_ip_index = num_proxy + 1
 
     if len(proxies) >= correct_ip_index:
-        real_ip_address = proxies[-correct_ip_index]  # get the correct referring client ip
-        if real_ip_address is not None and not models.IpAddress.check_user_ips(user, real_ip_address):
-            # IP exists in request and is not already saved
-            new_ip = models.IpAddress(ip=real_ip_address)
-            new_ip.user = user
-            db.session.add(new_ip)
+        return proxies[-correct_ip_index]  # get the correct referring client ip
+
+    return None
+
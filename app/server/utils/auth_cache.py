@@ -0,0 +1,157 @@
+import json
+import hashlib
+import time
+
+import jwt
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, make_transient_to_detached
+from sqlalchemy.orm.util import identity_key
+
+from server import db, models, red
+
+# Long enough to take most auth lookups off the database, short enough that a missed invalidation heals quickly
+USER_AUTH_STATE_TTL_SECONDS = 60
+
+# Everything requires_auth (and the roles endpoints check on g.user) needs, without loading the user
+USER_AUTH_STATE_COLUMNS = ['is_activated', 'is_disabled', 'TFA_enabled',
+                           '_is_vendor', '_is_supervendor', '_is_view', '_is_subadmin', '_is_admin', '_is_superadmin',
+                           'transfer_account_id']
+
+# Set once every blacklisted token in the database has been copied into redis
+BLACKLIST_WARMED_KEY = 'blacklisted_tokens_warmed'
+
+
+def _blacklisted_token_key(auth_token):
+    if isinstance(auth_token, bytes):
+        auth_token = auth_token.decode()
+
+    return 'blacklisted_token:' + hashlib.sha256(auth_token.encode()).hexdigest()
+
+
+def _user_auth_state_key(user_id):
+    return 'user_auth_state:{}'.format(user_id)
+
+
+def cache_blacklisted_token(auth_token):
+    """
+    Adds a token to the redis blacklist until it would have expired anyway
+    """
+    try:
+        expires_at = jwt.decode(auth_token, verify=False)['exp']
+    except (jwt.InvalidTokenError, KeyError):
+        # Without an expiry, the token can't be valid in the first place
+        return
+
+    ttl = int(expires_at - time.time())
+    if ttl > 0:
+        red.setex(_blacklisted_token_key(auth_token), ttl, 1)
+
+
+def warm_token_blacklist():
+    """
+    Copies every unexpired blacklisted token from the database into redis
+    """
+    for (token,) in db.session.query(models.BlacklistToken.token).yield_per(1000):
+        cache_blacklisted_token(token)
+
+    red.set(BLACKLIST_WARMED_KEY, 1)
+
+
+def is_token_blacklisted(auth_token):
+    """
+    Checks the redis blacklist, which is only read from the database if redis has lost it
+
+    :return: True if the token has been blacklisted
+    """
+    blacklisted, warmed = red.mget(_blacklisted_token_key(auth_token), BLACKLIST_WARMED_KEY)
+
+    if blacklisted is not None:
+        return True
+
+    if warmed is not None:
+        return False
+
+    warm_token_blacklist()
+
+    return red.exists(_blacklisted_token_key(auth_token)) > 0
+
+
+def cache_user_auth_state(user):
+    """
+    Caches the state requires_auth checks for a user, along with the ip addresses already saved for them
+
+    :return: set of the user's saved ip addresses
+    """
+    state = {column: getattr(user, column) for column in USER_AUTH_STATE_COLUMNS}
+    state['ip_addresses'] = [str(ip_address.ip) for ip_address in user.ip_addresses]
+
+    red.setex(_user_auth_state_key(user.id), USER_AUTH_STATE_TTL_SECONDS, json.dumps(state))
+
+    return set(state['ip_addresses'])
+
+
+def invalidate_user_auth_state(user_id):
+    red.delete(_user_auth_state_key(user_id))
+
+
+def get_cached_auth_user(user_id):
+    """
+    Builds a user from their cached auth state, without touching the database. The user is attached to the
+    session, so any attribute or relationship that wasn't cached is loaded from the database when first used.
+
+    :return: tuple of (User, set of known ip addresses), or (None, None) if the state isn't cached
+    """
+    cached_state = red.get(_user_auth_state_key(user_id))
+
+    if cached_state is None:
+        return None, None
+
+    state = json.loads(cached_state)
+    ip_addresses = set(state.pop('ip_addresses', []))
+
+    user = db.session.identity_map.get(identity_key(models.User, user_id))
+
+    if user is None:
+        user = models.User.__mapper__.class_manager.new_instance()
+        user.id = user_id
+        for column, value in state.items():
+            setattr(user, column, value)
+
+        # Treat the cached values as loaded, and everything else as expired
+        make_transient_to_detached(user)
+        db.session.add(user)
+
+    return user, ip_addresses
+
+
+@event.listens_for(Session, 'before_flush')
+def _collect_auth_cache_changes(session, flush_context, instances):
+    for obj in session.new:
+        if isinstance(obj, models.BlacklistToken):
+            session.info.setdefault('blacklisted_tokens', set()).add(obj.token)
+
+    for obj in session.deleted:
+        if isinstance(obj, models.User):
+            session.info.setdefault('invalidated_user_auth_states', set()).add(obj.id)
+
+    for obj in session.dirty:
+        if isinstance(obj, models.User):
+            attributes = inspect(obj).attrs
+            if any(attributes[column].history.has_changes() for column in USER_AUTH_STATE_COLUMNS):
+                session.info.setdefault('invalidated_user_auth_states', set()).add(obj.id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_auth_cache_changes(session):
+    # Only once committed, so that a concurrent request can't re-cache the old state
+    for user_id in session.info.pop('invalidated_user_auth_states', set()):
+        invalidate_user_auth_state(user_id)
+
+    for token in session.info.pop('blacklisted_tokens', set()):
+        cache_blacklisted_token(token)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_auth_cache_changes(session):
+    session.info.pop('invalidated_user_auth_states', None)
+    session.info.pop('blacklisted_tokens', None)
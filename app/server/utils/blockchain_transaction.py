@@ -1,8 +1,9 @@
 from flask import make_response, jsonify, current_app
 from sqlalchemy import or_, and_
-from server.models import BlockchainTransaction, BlockchainAddress
+from server.models import BlockchainTransaction, BlockchainAddress, CreditTransfer, TransferTypeEnum
 from server.exceptions import BlockchainError
 from server import db, celery_app, sentry
+from server.utils.master_wallet import settle_master_wallet_funds
 import datetime
 import random
 import time
@@ -83,6 +84,31 @@ def add_full_transaction_details(details_dict, method='POST', force_transaction_
     if has_output_txn is not None:
         blockchain_transaction.has_output_txn = has_output_txn
 
+    if blockchain_transaction.credit_transfer_id:
+        db.session.flush()
+
+        credit_transfer = CreditTransfer.query.get(blockchain_transaction.credit_transfer_id)
+
+        if credit_transfer:
+            if blockchain_transaction.transaction_type == 'master wallet approval':
+                if credit_transfer.transfer_type == TransferTypeEnum.WITHDRAWAL:
+                    approved_transfer_account = credit_transfer.sender_transfer_account
+                else:
+                    approved_transfer_account = credit_transfer.recipient_transfer_account
+
+                if approved_transfer_account:
+                    approved_transfer_account.update_master_wallet_approval_status(blockchain_transaction.status)
+
+            # After the approval state, as the transfer's required tasks depend on it
+            db.session.expire(credit_transfer, ['blockchain_transactions'])
+            credit_transfer.update_blockchain_status()
+
+    if (blockchain_transaction.transaction_type == 'disbursement' and blockchain_transaction.credit_transfer_id
+            and blockchain_transaction.status == 'SUCCESS'):
+        # The disbursement's master wallet funds are now spent on chain. A failed disbursement keeps its funds
+        # reserved, as it may be retried, until its transfer is rejected
+        settle_master_wallet_funds(blockchain_transaction.credit_transfer_id)
+
     return make_response(jsonify({'transaction_id': blockchain_transaction.id})), 201
 
 def claim_nonce(details_dict):
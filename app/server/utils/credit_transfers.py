@@ -3,26 +3,56 @@ import hmac
 import time
 
 from flask import make_response, jsonify, current_app
-from sqlalchemy.sql import func
+from sqlalchemy.sql import func, case
 from sqlalchemy.exc import IntegrityError
 import datetime, json
 
 from server.exceptions import NoTransferAccountError, UserNotFoundError, InsufficientBalanceError, AccountNotApprovedError, \
     InvalidTargetBalanceError, BlockchainError
-from server import db, celery_app, sentry, red
+from server import db, sentry, red
 from server import models
 from server.schemas import me_credit_transfer_schema
 from server.utils import user as UserUtils
 from server.utils import pusher
 from server.utils.misc import elapsed_time
+from server.utils.reference_data import get_reference_data
+from server.utils.master_wallet import master_wallet_funds_available, reserve_master_wallet_funds
+
+TIME_SERIES_BUCKETS = ['hour', 'day', 'week', 'month']
+
+# Hourly buckets can't be read from the daily rollups, so are limited to short ranges
+MAX_HOURLY_TIME_SERIES_RANGE = datetime.timedelta(days=7)
+
+DEFAULT_TIME_SERIES_DAYS = 30
+
+TIME_SERIES_CACHE_SECONDS = 60
+CLOSED_TIME_SERIES_CACHE_SECONDS = 60 * 60 * 24
+
 
 def calculate_transfer_stats(total_time_series=False):
 
-    total_distributed = db.session.query(func.sum(models.CreditTransfer.transfer_amount).label('total'))\
-        .filter(models.CreditTransfer.transfer_type == models.TransferTypeEnum.DISBURSEMENT).first().total
+    # Transfer totals are read from the daily rollups, which only include completed transfers
+    rollup = models.DailyTransferRollup
+
+    def summed_volume(transfer_type):
+        return db.session.query(func.coalesce(func.sum(rollup.volume), 0).label('total'))\
+            .filter(rollup.transfer_type == transfer_type)\
+            .filter(rollup.transfer_status == models.TransferStatusEnum.COMPLETE).first().total
 
-    total_spent = db.session.query(func.sum(models.CreditTransfer.transfer_amount).label('total'))\
-        .filter(models.CreditTransfer.transfer_type == models.TransferTypeEnum.PAYMENT).first().total
+    def daily_volume(transfer_type):
+        query = db.session.query(rollup.volume, rollup.date)\
+            .filter(rollup.transfer_type == transfer_type)\
+            .filter(rollup.transfer_status == models.TransferStatusEnum.COMPLETE)
+
+        if not total_time_series:
+            query = query.filter(
+                rollup.date >= datetime.datetime.utcnow() - datetime.timedelta(days=DEFAULT_TIME_SERIES_DAYS))
+
+        return query.order_by(rollup.date.desc()).all()
+
+    total_distributed = summed_volume(models.TransferTypeEnum.DISBURSEMENT)
+
+    total_spent = summed_volume(models.TransferTypeEnum.PAYMENT)
 
     total_beneficiaries = db.session.query(models.User).filter(models.User.is_beneficiary == True).count()
 
@@ -31,9 +61,11 @@ def calculate_transfer_stats(total_time_series=False):
 
     total_users = total_beneficiaries + total_vendors
 
-    has_transferred_count = db.session.query(func.count(func.distinct(models.CreditTransfer.sender_user_id))
-        .label('transfer_count'))\
-        .filter(models.CreditTransfer.transfer_type == models.TransferTypeEnum.PAYMENT).first().transfer_count
+    has_transferred_count = db.session.query(
+        func.count(func.distinct(models.DailyTransferSenderRollup.sender_user_id)).label('transfer_count'))\
+        .filter(models.DailyTransferSenderRollup.transfer_type == models.TransferTypeEnum.PAYMENT)\
+        .filter(models.DailyTransferSenderRollup.transfer_status == models.TransferStatusEnum.COMPLETE)\
+        .filter(models.DailyTransferSenderRollup.transfer_count > 0).first().transfer_count
 
     # zero_balance_count = db.session.query(func.count(models.TransferAccount.id).label('zero_balance_count'))\
     #     .filter(models.TransferAccount.balance == 0).first().zero_balance_count
@@ -44,15 +76,9 @@ def calculate_transfer_stats(total_time_series=False):
         .filter(models.CreditTransfer.transfer_type == models.TransferTypeEnum.PAYMENT) \
         .filter(models.TransferAccount.balance == 0).first().transfer_count
 
-    daily_transaction_volume = db.session.query(func.sum(models.CreditTransfer.transfer_amount).label('volume'),
-                 func.date_trunc('day', models.CreditTransfer.created).label('date'))\
-        .group_by(func.date_trunc('day', models.CreditTransfer.created))\
-        .filter(models.CreditTransfer.transfer_type == models.TransferTypeEnum.PAYMENT).all()
+    daily_transaction_volume = daily_volume(models.TransferTypeEnum.PAYMENT)
 
-    daily_disbursement_volume = db.session.query(func.sum(models.CreditTransfer.transfer_amount).label('volume'),
-                                                func.date_trunc('day', models.CreditTransfer.created).label('date')) \
-        .group_by(func.date_trunc('day', models.CreditTransfer.created)) \
-        .filter(models.CreditTransfer.transfer_type == models.TransferTypeEnum.DISBURSEMENT).all()
+    daily_disbursement_volume = daily_volume(models.TransferTypeEnum.DISBURSEMENT)
 
     try:
         master_wallet_balance = master_wallet_funds_available()
@@ -97,108 +123,163 @@ def calculate_transfer_stats(total_time_series=False):
     return data
 
 
-def master_wallet_funds_available(allowed_cache_age_seconds=60):
+def rebuild_daily_transfer_rollups():
     """
-    IF refreshing cash THEN:
-        return: [current blockchain balance] - [all transfers with blockchain state pending or unknown]
-        save to cache: [funds available at last cache], [ID of highest transfer used in cache], [cache creation datetime]
-    ELSE
-        return: [funds available at last cache] - [all non-failed transfers since cache created]
-    :param allowed_cache_age_seconds: how long between checking the blockchain for external funds added or removed
-    :return: amount of funds available
+    Recomputes the daily transfer rollup tables from the full credit transfer history.
+    Used to backfill the rollups, or to repair them if they've drifted. Caller commits.
     """
 
+    models.TransferAccountDailyRollup.query.delete()
+    models.DailyTransferSenderRollup.query.delete()
+    models.DailyTransferRollup.query.delete()
+
+    transfer = models.CreditTransfer
+    day = func.date_trunc('day', transfer.created)
+    resolved = transfer.transfer_status.in_(models.DailyTransferRollup.ROLLED_UP_STATUSES)
+    attributed_account_id = _attributed_transfer_account_id_expression()
+
+    sender_rollup_query = db.session.query(
+        func.now(), func.now(), day, transfer.transfer_type, transfer.transfer_status, transfer.sender_user_id,
+        func.count(transfer.id))\
+        .filter(resolved)\
+        .filter(transfer.sender_user_id.isnot(None))\
+        .group_by(day, transfer.transfer_type, transfer.transfer_status, transfer.sender_user_id)
+
+    sender_rollup = models.DailyTransferSenderRollup
+    db.session.execute(sender_rollup.__table__.insert().from_select(
+        ['created', 'updated', 'date', 'transfer_type', 'transfer_status', 'sender_user_id', 'transfer_count'],
+        sender_rollup_query
+    ))
+
+    rollup_query = db.session.query(
+        func.now(), func.now(), day, transfer.transfer_type, transfer.transfer_status,
+        func.count(transfer.id), func.coalesce(func.sum(transfer.transfer_amount), 0),
+        func.count(func.distinct(transfer.sender_user_id)))\
+        .filter(resolved)\
+        .group_by(day, transfer.transfer_type, transfer.transfer_status)
+
+    db.session.execute(models.DailyTransferRollup.__table__.insert().from_select(
+        ['created', 'updated', 'date', 'transfer_type', 'transfer_status',
+         'transfer_count', 'volume', 'distinct_senders'],
+        rollup_query
+    ))
+
+    account_rollup_query = db.session.query(
+        func.now(), func.now(), day, transfer.transfer_type, transfer.transfer_status, attributed_account_id,
+        func.count(transfer.id), func.coalesce(func.sum(transfer.transfer_amount), 0))\
+        .filter(resolved)\
+        .filter(attributed_account_id.isnot(None))\
+        .group_by(day, transfer.transfer_type, transfer.transfer_status, attributed_account_id)
+
+    db.session.execute(models.TransferAccountDailyRollup.__table__.insert().from_select(
+        ['created', 'updated', 'date', 'transfer_type', 'transfer_status', 'transfer_account_id',
+         'transfer_count', 'volume'],
+        account_rollup_query
+    ))
+
+
+def _attributed_transfer_account_id_expression():
+    transfer = models.CreditTransfer
+    return case(
+        [(transfer.transfer_type == models.TransferTypeEnum.DISBURSEMENT, transfer.recipient_transfer_account_id)],
+        else_=transfer.sender_transfer_account_id
+    )
+
+
+def calculate_transfer_time_series(start, end, bucket='day', transfer_account_ids=None, is_vendor=None):
+    """
+    Completed transfer count and volume per bucket between two dates, by transfer type.
+    Day, week and month buckets are read from the daily rollups; hour buckets from the transfers themselves.
+    Results are cached in redis per set of parameters.
+
+    :param start: datetime to start from
+    :param end: datetime to end at
+    :param bucket: one of TIME_SERIES_BUCKETS
+    :param transfer_account_ids: optional list of transfer account ids to segment by
+    :param is_vendor: optionally segment by vendor (True) or non-vendor (False) transfer accounts
+    :return: dict of time series, keyed by volume type
+    """
 
-    refresh_cache = False
-    funds_available_cache = red.get('funds_available_cache')
-
-    try:
-        parsed_cache = json.loads(funds_available_cache)
-
-        last_updated_datetime = datetime.datetime.fromtimestamp(float(parsed_cache['last_updated']))
-
-        earliest_allowed = datetime.datetime.utcnow() - datetime.timedelta(seconds=allowed_cache_age_seconds)
-        if last_updated_datetime < earliest_allowed:
-            refresh_cache = True
-
-    except Exception as e:
-        refresh_cache = True
-
-
-    if refresh_cache:
+    if bucket not in TIME_SERIES_BUCKETS:
+        raise ValueError('Bucket must be one of {}'.format(', '.join(TIME_SERIES_BUCKETS)))
 
-        blockchain_task = celery_app.signature('worker.celery_tasks.get_master_balance')
+    if bucket == 'hour' and end - start > MAX_HOURLY_TIME_SERIES_RANGE:
+        raise ValueError('Hourly buckets are limited to a range of {} days'.format(MAX_HOURLY_TIME_SERIES_RANGE.days))
 
-        result = blockchain_task.apply_async()
+    if transfer_account_ids is not None:
+        transfer_account_ids = sorted(set(transfer_account_ids))
 
-        try:
-            master_wallet_balance = result.wait(timeout=6, propagate=True, interval=0.5)
+    cache_key = 'transfer_time_series:' + json.dumps(
+        [start.isoformat(), end.isoformat(), bucket, transfer_account_ids, is_vendor])
 
-        except Exception as e:
-            print(e)
-            sentry.captureException()
-            raise BlockchainError("Blockchain Error")
+    cached = red.get(cache_key)
+    if cached:
+        return json.loads(cached)
 
-        finally:
-            result.forget()
+    segmented = transfer_account_ids is not None or is_vendor is not None
 
-        highest_transfer_id_checked = 0
-        required_blockchain_statuses = ['PENDING', 'UNKNOWN']
+    if bucket == 'hour':
+        source = models.CreditTransfer
+        date_column = source.created
+        account_id_column = _attributed_transfer_account_id_expression()
+        count = func.count(source.id)
+        volume = func.sum(source.transfer_amount)
+        start_date = start
 
     else:
-        cached_funds_available = parsed_cache['cached_funds_available']
-        highest_transfer_id_checked = parsed_cache['highest_transfer_id_checked']
-        required_blockchain_statuses = ['PENDING', 'UNKNOWN', 'COMPLETE']
-
-
-
-    new_dibursements     = (models.CreditTransfer.query
-                             .filter(models.CreditTransfer.transfer_type == models.TransferTypeEnum.DISBURSEMENT)
-                             .filter(models.CreditTransfer.transfer_status == models.TransferStatusEnum.COMPLETE)
-                             .filter(models.CreditTransfer.id > highest_transfer_id_checked)
-                             .filter(models.CreditTransfer.created >
-                                     datetime.datetime.utcnow() - datetime.timedelta(hours=36))
-                             .all())
-
-
-    local_disbursement_value = 0
-    for disbursement in new_dibursements:
-
-        status = disbursement.blockchain_status
-
-        if status in required_blockchain_statuses:
-            local_disbursement_value += disbursement.transfer_amount
-
-    if refresh_cache:
-
-        balance = master_wallet_balance - local_disbursement_value
-
-        if len(new_dibursements) > 0:
-            highest_transfer_id_checked = new_dibursements[-1].id
-        else:
-            all_transfers = models.CreditTransfer.query.all()
-            if len(all_transfers) > 0:
-                highest_transfer_id_checked = all_transfers[-1].id
-            else:
-                highest_transfer_id_checked = 0
-
-        cache_data = {
-            'cached_funds_available': balance,
-            'highest_transfer_id_checked': highest_transfer_id_checked,
-            'last_updated': datetime.datetime.utcnow().timestamp()
-        }
+        source = models.TransferAccountDailyRollup if segmented else models.DailyTransferRollup
+        date_column = source.date
+        account_id_column = getattr(source, 'transfer_account_id', None)
+        count = func.sum(source.transfer_count)
+        volume = func.sum(source.volume)
+        # Rollup dates are the start of the day
+        start_date = datetime.datetime(start.year, start.month, start.day)
+
+    period = func.date_trunc(bucket, date_column).label('date')
+
+    query = db.session.query(period, source.transfer_type, count.label('count'), volume.label('volume'))\
+        .select_from(source)\
+        .filter(source.transfer_status == models.TransferStatusEnum.COMPLETE)\
+        .filter(date_column >= start_date)\
+        .filter(date_column <= end)\
+        .group_by(period, source.transfer_type)\
+        .order_by(period)
+
+    if transfer_account_ids is not None:
+        query = query.filter(account_id_column.in_(transfer_account_ids))
+
+    if is_vendor is not None:
+        query = query.join(models.TransferAccount, models.TransferAccount.id == account_id_column)\
+            .filter(models.TransferAccount.is_vendor == is_vendor)
+
+    volume_keys = {
+        models.TransferTypeEnum.PAYMENT: 'transaction_volume',
+        models.TransferTypeEnum.DISBURSEMENT: 'disbursement_volume',
+        models.TransferTypeEnum.WITHDRAWAL: 'withdrawal_volume'
+    }
 
-        red.set('funds_available_cache', json.dumps(cache_data))
+    data = {
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'bucket': bucket
+    }
 
-        balance = master_wallet_balance - local_disbursement_value
+    for key in volume_keys.values():
+        data[key] = []
 
-        return balance
+    for row in query.all():
+        data[volume_keys[row.transfer_type]].append(
+            {'date': row.date.isoformat(), 'count': int(row.count or 0), 'volume': int(row.volume or 0)})
 
+    # Ranges ending before today won't change (short of a rollup rebuild) so can be kept for longer
+    if end < datetime.datetime.combine(datetime.datetime.utcnow().date(), datetime.time.min):
+        cache_seconds = CLOSED_TIME_SERIES_CACHE_SECONDS
     else:
+        cache_seconds = TIME_SERIES_CACHE_SECONDS
 
-        balance = cached_funds_available - local_disbursement_value
+    red.setex(cache_key, cache_seconds, json.dumps(data))
 
-        return balance
+    return data
 
 
 def find_user_with_transfer_account_from_identifiers(user_id, public_identifier, transfer_account_id):
@@ -397,12 +478,19 @@ def make_payment_transfer(transfer_amount,
             use_ids = transfer_use.split(',')  # passed as '3,4' etc.
         except AttributeError:
             use_ids = transfer_use
+
+        transfer_usages_by_id = {usage['id']: usage for usage in get_reference_data('transfer_usages')}
+
         for use_id in use_ids:
             if use_id != 'null':
-                use = models.TransferUsage.query.filter_by(id=use_id).first()
+                try:
+                    use = transfer_usages_by_id.get(int(use_id))
+                except (TypeError, ValueError):
+                    use = None
+
                 if use:
-                    usages.append(use.name)
-                    if use.is_cashout:
+                    usages.append(use['name'])
+                    if use['is_cashout']:
                         make_cashout_incentive_transaction = True
                 else:
                     usages.append('Other')
@@ -493,6 +581,16 @@ def make_disbursement_transfer(transfer_amount,
 
     transfer = create_and_commit_transfer(transfer_amount, receive_account=receive_account, uuid=uuid)
 
+    if current_app.config['USING_EXTERNAL_ERC20']:
+        try:
+            # Another process may have disbursed the same funds since they were checked above
+            reserve_master_wallet_funds(transfer.id, transfer_amount)
+
+        except InsufficientBalanceError:
+            transfer.resolve_as_rejected('Master Wallet has insufficient funds')
+            db.session.commit()
+            raise
+
     transfer.transfer_mode = transfer_mode
 
     elapsed_time('4.3: Created and commited')
@@ -0,0 +1,132 @@
+import json
+import os
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from server import red, sentry
+
+# Every app process subscribes to this, and evicts the keys published on it from its in-process caches
+INVALIDATION_CHANNEL = 'cache_invalidation'
+
+RESUBSCRIBE_DELAY_SECONDS = 5
+
+# model class name: cache keys to invalidate when one is written
+_watched_models = {}
+
+# key namespace: (function evicting one name, function evicting everything)
+_handlers = {}
+
+_subscriber_lock = threading.Lock()
+_subscriber_pid = None
+
+
+def watch_model(model_name, *keys):
+    """
+    Invalidates cache keys, in every process, whenever a model of this type is committed as new, changed or deleted.
+    Keys are '<namespace>:<name>', see on_invalidation.
+    """
+    _watched_models.setdefault(model_name, set()).update(keys)
+
+
+def on_invalidation(namespace, evict, evict_all):
+    """
+    Registers how an in-process cache evicts its keys
+
+    :param namespace: the part of the keys before the first ':'
+    :param evict: function of the part of a key after the ':', evicting it
+    :param evict_all: function evicting everything, for when invalidations may have been missed
+    """
+    _handlers[namespace] = (evict, evict_all)
+
+
+def _evict(keys):
+    for key in keys:
+        namespace, _, name = key.partition(':')
+
+        if namespace in _handlers:
+            _handlers[namespace][0](name)
+
+
+def _evict_all():
+    for evict, evict_all in _handlers.values():
+        evict_all()
+
+
+def publish_invalidation(keys):
+    """
+    Evicts keys in this process straight away, and in every other process once their subscriber receives them
+    """
+    keys = sorted(keys)
+
+    _evict(keys)
+
+    try:
+        red.publish(INVALIDATION_CHANNEL, json.dumps(keys))
+    except Exception as e:
+        print(e)
+        sentry.captureException()
+
+
+def _listen():
+    while True:
+        try:
+            pubsub = red.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(INVALIDATION_CHANNEL)
+
+            # Anything could have been written while this process wasn't subscribed
+            _evict_all()
+
+            for message in pubsub.listen():
+                _evict(json.loads(message['data']))
+
+        except Exception as e:
+            print(e)
+            sentry.captureException()
+            time.sleep(RESUBSCRIBE_DELAY_SECONDS)
+
+
+def ensure_invalidation_subscriber():
+    """
+    Starts this process's subscriber thread, if it isn't running. Called per request rather than at startup,
+    as uwsgi forks its processes after the app is loaded, and threads don't survive the fork.
+    """
+    global _subscriber_pid
+
+    if _subscriber_pid == os.getpid():
+        return
+
+    with _subscriber_lock:
+        if _subscriber_pid == os.getpid():
+            return
+
+        subscriber = threading.Thread(target=_listen, name='cache-invalidation-subscriber')
+        subscriber.daemon = True
+        subscriber.start()
+
+        _subscriber_pid = os.getpid()
+
+
+@event.listens_for(Session, 'before_flush')
+def _collect_invalidated_keys(session, flush_context, instances):
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        keys = _watched_models.get(type(obj).__name__)
+
+        if keys:
+            session.info.setdefault('invalidated_cache_keys', set()).update(keys)
+
+
+@event.listens_for(Session, 'after_commit')
+def _publish_invalidated_keys(session):
+    # Only once committed, so that no process can reload the old data after evicting it
+    keys = session.info.pop('invalidated_cache_keys', None)
+
+    if keys:
+        publish_invalidation(keys)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_invalidated_keys(session):
+    session.info.pop('invalidated_cache_keys', None)
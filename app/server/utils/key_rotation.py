@@ -0,0 +1,63 @@
+from sqlalchemy import and_, bindparam
+
+import key_management
+from server import db, models
+
+# (model, encrypted column) pairs that key_management secrets are used for
+ENCRYPTED_COLUMNS = [
+    ('BlockchainAddress', 'encoded_private_key'),
+    ('BlockchainKeypair', 'encoded_private_key'),
+    ('User', '_TFA_secret'),
+]
+
+
+def reencrypt_stale_secrets(batch_size=500):
+    """
+    Moves values encrypted with an older secret onto the newest one. Values already on the newest secret are
+    left untouched, and each batch is committed, so the sweep can be stopped and rerun at any time -
+    older values still decrypt in the meantime.
+
+    :param batch_size: number of rows to read, and commit the re-encrypted values of, at a time
+    :return: dict of model name: number of values re-encrypted
+    """
+
+    reencrypted_counts = {}
+
+    for model_name, column_name in ENCRYPTED_COLUMNS:
+        model = getattr(models, model_name)
+        table = model.__table__
+        column = getattr(model, column_name)
+
+        # Only overwrites the value that was read, in case it's been changed since
+        update = (table.update()
+                  .where(and_(table.c.id == bindparam('row_id'), table.c[column_name] == bindparam('stale_value')))
+                  .values({column_name: bindparam('reencrypted_value')}))
+
+        reencrypted_counts[model_name] = 0
+        last_id = 0
+
+        while True:
+            rows = (db.session.query(model.id, column)
+                    .filter(column.isnot(None))
+                    .filter(model.id > last_id)
+                    .order_by(model.id)
+                    .limit(batch_size)
+                    .all())
+
+            if not rows:
+                break
+
+            last_id = rows[-1][0]
+
+            stale_rows = [
+                {'row_id': row_id, 'stale_value': value, 'reencrypted_value': key_management.reencrypt(value)}
+                for row_id, value in rows if key_management.needs_reencryption(value)
+            ]
+
+            if stale_rows:
+                db.session.execute(update, stale_rows)
+                db.session.commit()
+
+            reencrypted_counts[model_name] += len(stale_rows)
+
+    return reencrypted_counts
@@ -0,0 +1,58 @@
+import os
+
+from ethereum import utils
+from flask import current_app
+from sqlalchemy.sql import func
+from web3 import Web3
+
+import key_management
+from server import db, models, red
+
+# Held while a batch is generated, so concurrent refills can't each see the same shortfall and over-fill the pool
+KEYPAIR_POOL_REFILL_LOCK_KEY = 'blockchain_keypair_pool_refill'
+KEYPAIR_POOL_REFILL_LOCK_SECONDS = 60
+
+
+def refill_blockchain_keypair_pool(watermark=None, batch_size=100):
+    """
+    Generates up to one batch of keypairs towards the watermark, committing it so that they're available to claim
+    straight away. The worker calls this repeatedly until the pool is full, so a refill never holds an app process
+    for more than a batch.
+
+    :param watermark: number of keypairs to keep available. Defaults to BLOCKCHAIN_KEYPAIR_POOL_WATERMARK
+    :param batch_size: most keypairs to generate, encrypt and insert
+    :return: tuple of (number of keypairs generated, number still needed to reach the watermark).
+        Nothing is generated while another refill holds the lock.
+    """
+
+    if watermark is None:
+        watermark = current_app.config['BLOCKCHAIN_KEYPAIR_POOL_WATERMARK']
+
+    lock = red.lock(KEYPAIR_POOL_REFILL_LOCK_KEY, timeout=KEYPAIR_POOL_REFILL_LOCK_SECONDS)
+
+    if not lock.acquire(blocking=False):
+        return 0, 0
+
+    try:
+        available = db.session.query(func.count(models.BlockchainKeypair.id)).scalar()
+
+        count = min(batch_size, max(watermark - available, 0))
+
+        if count:
+            hex_private_keys = [Web3.toHex(utils.sha3(os.urandom(4096))) for _ in range(count)]
+            encoded_private_keys = key_management.encrypt_many(hex_private_keys)
+
+            db.session.bulk_insert_mappings(models.BlockchainKeypair, [
+                {
+                    'address': utils.checksum_encode(utils.privtoaddr(hex_private_key)),
+                    'encoded_private_key': encoded_private_key
+                }
+                for hex_private_key, encoded_private_key in zip(hex_private_keys, encoded_private_keys)
+            ])
+
+            db.session.commit()
+
+        return count, max(watermark - available - count, 0)
+
+    finally:
+        lock.release()
@@ -0,0 +1,209 @@
+import json
+import time
+
+from server import db, models, red
+from server.exceptions import BlockchainError, InsufficientBalanceError
+
+# Published by the worker's publish_master_balance task
+MASTER_WALLET_BALANCE_KEY = 'master_wallet_balance'
+
+# Funds available to disburse: the last on chain balance less every reservation not yet reflected in it
+MASTER_WALLET_FUNDS_KEY = 'master_wallet_funds_available'
+# Hash of credit transfer id: amount for disbursements not yet confirmed on chain
+MASTER_WALLET_RESERVATIONS_KEY = 'master_wallet_reservations'
+# Sorted set of 'credit transfer id:amount', scored by the time the disbursement was confirmed on chain
+MASTER_WALLET_SETTLED_KEY = 'master_wallet_settled_reservations'
+# Read time of the on chain balance the funds were last rebased against
+MASTER_WALLET_REBASED_AT_KEY = 'master_wallet_funds_rebased_at'
+# Hash of credit transfer id: time reserved, for the reservations in MASTER_WALLET_RESERVATIONS_KEY
+MASTER_WALLET_RESERVED_AT_KEY = 'master_wallet_reservation_times'
+
+_LEDGER_KEYS = [MASTER_WALLET_FUNDS_KEY, MASTER_WALLET_RESERVATIONS_KEY,
+                MASTER_WALLET_SETTLED_KEY, MASTER_WALLET_REBASED_AT_KEY, MASTER_WALLET_RESERVED_AT_KEY]
+
+# Reservations older than this are checked against their credit transfers when the funds are rebased,
+# in case their outcome was never reported
+MASTER_WALLET_STALE_RESERVATION_SECONDS = 60 * 60
+
+# Each script runs atomically in redis, so reservations are safe across uwsgi processes
+_reserve_script = red.register_script("""
+local available = redis.call('GET', KEYS[1])
+if not available then
+    return -1
+end
+
+local amount = tonumber(ARGV[2])
+if tonumber(available) < amount then
+    return 0
+end
+
+redis.call('DECRBY', KEYS[1], amount)
+redis.call('HSET', KEYS[2], ARGV[1], amount)
+redis.call('HSET', KEYS[5], ARGV[1], ARGV[3])
+return 1
+""")
+
+_release_script = red.register_script("""
+local amount = redis.call('HGET', KEYS[2], ARGV[1])
+if not amount then
+    return 0
+end
+
+redis.call('HDEL', KEYS[2], ARGV[1])
+redis.call('HDEL', KEYS[5], ARGV[1])
+redis.call('INCRBY', KEYS[1], amount)
+return 1
+""")
+
+# Unlike a release, doesn't return the funds, as they've been spent and the next rebase will count them as such
+_drop_script = red.register_script("""
+redis.call('HDEL', KEYS[5], ARGV[1])
+return redis.call('HDEL', KEYS[2], ARGV[1])
+""")
+
+_settle_script = red.register_script("""
+local amount = redis.call('HGET', KEYS[2], ARGV[1])
+if not amount then
+    return 0
+end
+
+redis.call('HDEL', KEYS[2], ARGV[1])
+redis.call('HDEL', KEYS[5], ARGV[1])
+redis.call('ZADD', KEYS[3], ARGV[2], ARGV[1] .. ':' .. amount)
+return 1
+""")
+
+_rebase_script = red.register_script("""
+local read_at = tonumber(ARGV[2])
+local rebased_at = tonumber(redis.call('GET', KEYS[4]) or '0')
+if read_at <= rebased_at then
+    return 0
+end
+
+local available = tonumber(ARGV[1])
+
+for _, amount in ipairs(redis.call('HVALS', KEYS[2])) do
+    available = available - tonumber(amount)
+end
+
+-- Disbursements confirmed after the balance was read aren't reflected in it yet
+redis.call('ZREMRANGEBYSCORE', KEYS[3], '-inf', ARGV[2])
+for _, member in ipairs(redis.call('ZRANGE', KEYS[3], 0, -1)) do
+    available = available - tonumber(string.match(member, ':(%d+)$'))
+end
+
+redis.call('SET', KEYS[1], available)
+redis.call('SET', KEYS[4], ARGV[2])
+return 1
+""")
+
+
+def rebase_master_wallet_funds(allowed_balance_age_seconds=60 * 10):
+    """
+    Re-bases the funds available against the on chain balance most recently published by the worker,
+    if it hasn't been already. Cheap when there's nothing new to rebase against.
+
+    :param allowed_balance_age_seconds: how old the published balance can be before it's no longer trusted
+    """
+
+    published_balance = red.get(MASTER_WALLET_BALANCE_KEY)
+
+    try:
+        parsed_balance = json.loads(published_balance)
+        master_wallet_balance = int(parsed_balance['balance'])
+        last_updated = float(parsed_balance['last_updated'])
+
+    except Exception:
+        raise BlockchainError("Master wallet balance has not been published")
+
+    if time.time() - last_updated > allowed_balance_age_seconds:
+        raise BlockchainError("Master wallet balance is out of date")
+
+    if _rebase_script(keys=_LEDGER_KEYS, args=[master_wallet_balance, last_updated]):
+        # Only the process that made the rebase, and only once per published balance
+        reconcile_stale_reservations()
+
+
+def reconcile_stale_reservations(stale_seconds=MASTER_WALLET_STALE_RESERVATION_SECONDS):
+    """
+    Checks reservations held for longer than stale_seconds against their credit transfers, so that one whose
+    outcome was never reported isn't subtracted from every rebase forever. Reservations for transfers that were
+    rejected, or no longer exist, are released. Those whose disbursement succeeded on chain long ago are dropped.
+    Anything else, such as a failed disbursement that may yet be retried, stays reserved.
+
+    :return: number of reservations released or dropped
+    """
+    reserved_at = red.hgetall(MASTER_WALLET_RESERVED_AT_KEY)
+    stale_before = time.time() - stale_seconds
+
+    # Reservations made before reservation times were recorded count as stale
+    stale_ids = [int(credit_transfer_id) for credit_transfer_id in red.hkeys(MASTER_WALLET_RESERVATIONS_KEY)
+                 if float(reserved_at.get(credit_transfer_id, 0)) < stale_before]
+
+    if not stale_ids:
+        return 0
+
+    statuses = dict(db.session.query(models.CreditTransfer.id, models.CreditTransfer.transfer_status)
+                    .filter(models.CreditTransfer.id.in_(stale_ids)).all())
+
+    disbursed_ids = set(credit_transfer_id for (credit_transfer_id,) in
+                        db.session.query(models.BlockchainTransaction.credit_transfer_id)
+                        .filter(models.BlockchainTransaction.credit_transfer_id.in_(stale_ids))
+                        .filter(models.BlockchainTransaction.transaction_type == 'disbursement')
+                        .filter(models.BlockchainTransaction.status == 'SUCCESS').all())
+
+    reconciled = 0
+    for credit_transfer_id in stale_ids:
+        if statuses.get(credit_transfer_id) in [None, models.TransferStatusEnum.REJECTED]:
+            reconciled += release_master_wallet_funds(credit_transfer_id)
+
+        elif credit_transfer_id in disbursed_ids:
+            reconciled += bool(_drop_script(keys=_LEDGER_KEYS, args=[credit_transfer_id]))
+
+    return reconciled
+
+
+def master_wallet_funds_available(allowed_balance_age_seconds=60 * 10):
+    """
+    The master wallet's on chain balance, as last published to redis by the worker's publish_master_balance task,
+    less the disbursements reserved against it that weren't yet reflected on chain when it was read.
+    Never waits on the worker or the blockchain, and doesn't touch the database.
+
+    :param allowed_balance_age_seconds: how old the published balance can be before it's no longer trusted
+    :return: amount of funds available
+    """
+
+    rebase_master_wallet_funds(allowed_balance_age_seconds)
+
+    return int(red.get(MASTER_WALLET_FUNDS_KEY))
+
+
+def reserve_master_wallet_funds(credit_transfer_id, amount):
+    """
+    Atomically takes a disbursement out of the funds available, until it's confirmed or fails on chain.
+
+    :raises InsufficientBalanceError: if the funds available don't cover the amount
+    """
+
+    result = _reserve_script(keys=_LEDGER_KEYS, args=[credit_transfer_id, amount, time.time()])
+
+    if result == -1:
+        raise BlockchainError("Master wallet funds have not been calculated")
+
+    if result == 0:
+        raise InsufficientBalanceError("Master Wallet has insufficient funds")
+
+
+def release_master_wallet_funds(credit_transfer_id):
+    """
+    Returns a disbursement's reserved funds, as its transfer was rejected. Safe to call more than once.
+    """
+    return bool(_release_script(keys=_LEDGER_KEYS, args=[credit_transfer_id]))
+
+
+def settle_master_wallet_funds(credit_transfer_id):
+    """
+    Marks a disbursement's reservation as confirmed on chain, so that it's only counted against
+    balances read before confirmation. Safe to call more than once.
+    """
+    return bool(_settle_script(keys=_LEDGER_KEYS, args=[credit_transfer_id, time.time()]))
@@ -1,8 +1,6 @@
 import datetime
-import base64
-from ethereum import utils
-from flask import current_app
-from cryptography.fernet import Fernet
+import key_management
+from dateutil import parser
 
 last_marker = datetime.datetime.utcnow()
 
@@ -17,16 +15,21 @@ def elapsed_time(print_statement = None):
 
 
 def decrypt_string(encryped_string):
-
-    fernet_encryption_key = base64.b64encode(utils.sha3(current_app.config['SECRET_KEY']))
-    cipher_suite = Fernet(fernet_encryption_key)
-
-    return cipher_suite.decrypt(encryped_string.encode('utf-8')).decode('utf-8')
+    return key_management.decrypt(encryped_string)
 
 def encrypt_string(raw_string):
+    return key_management.encrypt(raw_string)
+
+def parse_utc_date(value):
+    """
+    Parses a date from a request. Dates are stored as naive UTC, so any offset given (such as a trailing Z)
+    is applied and then dropped.
 
-    fernet_encryption_key = base64.b64encode(utils.sha3(current_app.config['SECRET_KEY']))
-    cipher_suite = Fernet(fernet_encryption_key)
+    :raises ValueError, OverflowError: if it isn't a valid date
+    """
+    date = parser.parse(value)
 
-    return cipher_suite.encrypt(raw_string.encode('utf-8')).decode('utf-8')
+    if date.tzinfo is not None:
+        date = date.astimezone(datetime.timezone.utc).replace(tzinfo=None)
 
+    return date
@@ -1,10 +1,16 @@
 from flask import current_app
-from server import pusher_client, sentry
-from server.schemas import credit_transfer_schema
+from server import pusher_client, sentry, models
+from server.schemas import credit_transfer_schema, credit_transfer_loader_options, dataset_import_progress_schema
 from server.utils import credit_transfers
 
 
 def push_admin_credit_transfer(transfer):
+    # Reload with the schema's loader profile, rather than lazy loading each relationship as it's dumped
+    transfer = (models.CreditTransfer.query
+                .options(*credit_transfer_loader_options(credit_transfer_schema))
+                .populate_existing()
+                .get(transfer.id)) or transfer
+
     new_transfer = credit_transfer_schema.dump(transfer).data
 
     try:
@@ -26,4 +32,18 @@ def push_user_transfer_confirmation(receive_user, transfer_random_key):
         )
     except Exception as e:
         print(e)
-        sentry.captureException()
\ No newline at end of file
+        sentry.captureException()
+
+def push_dataset_import_progress(job):
+    # Without the failures, which can be fetched from the dataset api
+    progress = dataset_import_progress_schema.dump(job).data
+
+    try:
+        pusher_client.trigger(
+            current_app.config['PUSHER_ENV_CHANNEL'],
+            'dataset_import',
+            {'dataset_import_job': progress}
+        )
+    except Exception as e:
+        print(e)
+        sentry.captureException()
@@ -0,0 +1,120 @@
+import time
+
+from server import red, models
+from server.utils.invalidation import watch_model, on_invalidation, publish_invalidation
+
+# How long a process trusts its cached copy before checking redis for a newer version. Committed writes through
+# the ORM are evicted straight away by the invalidation bus, so this only bounds how stale other writes can get
+REFERENCE_DATA_VERSION_CHECK_SECONDS = 300
+
+_loaders = {}
+
+# name: (version, time the version was last checked, data)
+_cache = {}
+
+# name: number of times evicted, so that a load racing an eviction doesn't cache what it read
+_evictions = {}
+
+
+def reference_data(name):
+    """
+    Registers a function that loads a reference table, as plain data rather than models,
+    so it can be shared between sessions and requests
+    """
+    def decorator(loader):
+        _loaders[name] = loader
+        return loader
+
+    return decorator
+
+
+def _version_key(name):
+    return 'reference_data_version:{}'.format(name)
+
+
+def get_reference_data(name):
+    """
+    Reads reference data from this process's cache, loading it from the database when it's missing or its version
+    has been bumped. Other processes' bumps are picked up within REFERENCE_DATA_VERSION_CHECK_SECONDS.
+    """
+    cached = _cache.get(name)
+    now = time.time()
+
+    if cached is not None and now - cached[1] < REFERENCE_DATA_VERSION_CHECK_SECONDS:
+        return cached[2]
+
+    version = int(red.get(_version_key(name)) or 0)
+
+    if cached is not None and cached[0] == version:
+        _cache[name] = (version, now, cached[2])
+        return cached[2]
+
+    evictions = _evictions.get(name, 0)
+
+    data = _loaders[name]()
+
+    if _evictions.get(name, 0) == evictions:
+        _cache[name] = (version, now, data)
+
+    return data
+
+
+def bump_reference_data_version(name):
+    """
+    Call once a reference table has been written to other than through the ORM, such as by a bulk update.
+    Every process reloads it on its next read, as does any that misses the invalidation once it next checks the version.
+    """
+    red.incr(_version_key(name))
+    publish_invalidation(['reference_data:' + name])
+
+
+def evict_reference_data(name):
+    _evictions[name] = _evictions.get(name, 0) + 1
+    _cache.pop(name, None)
+
+
+def clear_reference_data_cache():
+    for name in list(_cache.keys()):
+        evict_reference_data(name)
+
+
+on_invalidation('reference_data', evict_reference_data, clear_reference_data_cache)
+
+watch_model('Settings', 'reference_data:settings')
+watch_model('CustomAttribute', 'reference_data:custom_attributes')
+watch_model('TransferUsage', 'reference_data:transfer_usages')
+watch_model('CurrencyConversion', 'reference_data:currency_conversions')
+
+
+# Where names or codes are repeated, the first saved wins
+
+@reference_data('settings')
+def load_settings():
+    settings = models.Settings.query.order_by(models.Settings.id).all()
+    return {setting.name: setting.value for setting in reversed(settings)}
+
+
+@reference_data('custom_attributes')
+def load_custom_attributes():
+    return [attribute.name for attribute in models.CustomAttribute.query.all()]
+
+
+@reference_data('transfer_usages')
+def load_transfer_usages():
+    return [
+        {
+            'id': usage.id,
+            'name': usage.name,
+            'icon': usage.icon,
+            'priority': usage.priority,
+            'translations': usage.translations,
+            'is_cashout': usage.is_cashout
+        }
+        for usage in models.TransferUsage.query.order_by(models.TransferUsage.priority, models.TransferUsage.id).all()
+    ]
+
+
+@reference_data('currency_conversions')
+def load_currency_conversions():
+    conversions = models.CurrencyConversion.query.order_by(models.CurrencyConversion.id).all()
+    return {conversion.code: conversion.rate for conversion in reversed(conversions)}
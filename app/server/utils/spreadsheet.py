@@ -0,0 +1,192 @@
+import csv
+import itertools
+import os
+import re
+import secrets
+
+from openpyxl import load_workbook
+
+from server import s3, sentry, red
+from server.utils.amazon_s3 import get_bucket_name, get_local_save_path, upload_local_file_to_s3
+
+# Rows returned to the mapping UI. The rest are only read when imported
+SPREADSHEET_PREVIEW_ROWS = 50
+
+SPREADSHEET_TOKEN_REGEX = re.compile(r'^[0-9a-f]{32}\.(xlsx|csv)$')
+
+# How long the row count found by a preview is kept for the import that follows it
+SPREADSHEET_ROW_COUNT_SECONDS = 60 * 60 * 24
+
+
+def _spreadsheet_filename(spreadsheet_token):
+    if not SPREADSHEET_TOKEN_REGEX.match(str(spreadsheet_token)):
+        raise ValueError('Invalid spreadsheet token {}'.format(spreadsheet_token))
+
+    return 'spreadsheet-' + spreadsheet_token
+
+
+def _local_spreadsheet_path(spreadsheet_token):
+    local_save_path = get_local_save_path(_spreadsheet_filename(spreadsheet_token))
+    os.makedirs(os.path.dirname(local_save_path), exist_ok=True)
+
+    return local_save_path
+
+
+def save_spreadsheet(spreadsheet):
+    """
+    Stores an uploaded spreadsheet locally, and in s3 for any other app instance that imports it
+
+    :param spreadsheet: uploaded xlsx or csv FileStorage
+    :return: token the spreadsheet can be read back with
+    """
+    extension = spreadsheet.filename.rsplit('.', 1)[1].lower()
+    spreadsheet_token = '{}.{}'.format(secrets.token_hex(16), extension)
+
+    local_save_path = _local_spreadsheet_path(spreadsheet_token)
+
+    spreadsheet.save(local_save_path)
+
+    try:
+        upload_local_file_to_s3(local_save_path, _spreadsheet_filename(spreadsheet_token))
+    except Exception as e:
+        print(e)
+        sentry.captureException()
+
+    return spreadsheet_token
+
+
+def get_spreadsheet_path(spreadsheet_token):
+    local_save_path = _local_spreadsheet_path(spreadsheet_token)
+
+    if not os.path.exists(local_save_path):
+        s3.download_file(get_bucket_name(), _spreadsheet_filename(spreadsheet_token), local_save_path)
+
+    return local_save_path
+
+
+def remove_local_spreadsheet(spreadsheet_token):
+    local_save_path = _local_spreadsheet_path(spreadsheet_token)
+
+    if os.path.exists(local_save_path):
+        os.remove(local_save_path)
+
+
+def iter_spreadsheet_rows(spreadsheet_token):
+    """
+    Streams a stored spreadsheet's rows, so only one is held in memory at a time.
+    xlsx is read in read_only mode, and csv with csv.reader.
+
+    :return: generator of lists of cell values
+    """
+    spreadsheet_path = get_spreadsheet_path(spreadsheet_token)
+
+    if spreadsheet_token.endswith('.csv'):
+        with open(spreadsheet_path, newline='', encoding='utf-8-sig') as csv_file:
+            for row in csv.reader(csv_file):
+                yield [value if value != '' else None for value in row]
+
+    else:
+        workbook = load_workbook(spreadsheet_path, read_only=True, data_only=True)
+        try:
+            for row in workbook.active.values:
+                yield list(row)
+        finally:
+            workbook.close()
+
+
+def _csv_reader(csv_file):
+    # Reads a csv opened in binary mode a line at a time, so that csv_file.tell() is the byte offset of the next row
+    return csv.reader(line.decode('utf-8-sig') for line in iter(csv_file.readline, b''))
+
+
+def read_spreadsheet_rows(spreadsheet_token, first_row, count, position=None):
+    """
+    Reads a run of rows from a stored spreadsheet, for importing it a chunk at a time
+
+    :param first_row: index of the first row to read
+    :param count: most rows to read
+    :param position: byte offset of first_row in a csv, as returned by the read before it, so that the file is
+        seeked rather than read from the start. xlsx files are always read from the start, but only first_row
+        onwards is loaded
+    :return: tuple of (list of lists of cell values, byte offset of the row after them or None for xlsx)
+    """
+    spreadsheet_path = get_spreadsheet_path(spreadsheet_token)
+
+    if spreadsheet_token.endswith('.csv'):
+        with open(spreadsheet_path, 'rb') as csv_file:
+            reader = _csv_reader(csv_file)
+
+            if position is not None:
+                csv_file.seek(position)
+            else:
+                for _ in itertools.islice(reader, first_row):
+                    pass
+
+            rows = [[value if value != '' else None for value in row] for row in itertools.islice(reader, count)]
+
+            return rows, csv_file.tell()
+
+    workbook = load_workbook(spreadsheet_path, read_only=True, data_only=True)
+    try:
+        return [[cell.value for cell in row] for row
+                in itertools.islice(workbook.active.iter_rows(min_row=first_row + 1), count)], None
+    finally:
+        workbook.close()
+
+
+def _row_count_key(spreadsheet_token):
+    return 'spreadsheet_row_count:{}'.format(spreadsheet_token)
+
+
+def get_spreadsheet_row_count(spreadsheet_token):
+    """
+    The number of rows in a stored spreadsheet, as found by its preview, or else by reading it
+    """
+    row_count = red.get(_row_count_key(spreadsheet_token))
+
+    if row_count is not None:
+        return int(row_count)
+
+    return sum(1 for _ in iter_spreadsheet_rows(spreadsheet_token))
+
+
+def preview_spreadsheet(spreadsheet_token, preview_rows=None):
+    """
+    Reads the first rows of a stored spreadsheet for the mapping UI, along with stats for each column over
+    every row, in one streamed pass. The row count is kept for get_spreadsheet_row_count
+
+    :param preview_rows: number of rows to return. Defaults to SPREADSHEET_PREVIEW_ROWS
+    :return: tuple of (dict of row index: dict of column index: value for the first rows, total number of rows,
+        list of dicts of stats per column)
+    """
+    if preview_rows is None:
+        preview_rows = SPREADSHEET_PREVIEW_ROWS
+
+    table_data = {}
+    row_count = 0
+    column_stats = []
+
+    for row_index, row in enumerate(iter_spreadsheet_rows(spreadsheet_token)):
+        row_count += 1
+
+        if row_index < preview_rows:
+            table_data[row_index] = {column_index: value for column_index, value in enumerate(row)}
+
+        for column_index, value in enumerate(row):
+            if column_index == len(column_stats):
+                column_stats.append({'column': column_index, 'filled_count': 0, 'example': None})
+
+            if value is None or value == '':
+                continue
+
+            stats = column_stats[column_index]
+            stats['filled_count'] += 1
+
+            # The first row is usually a header, so the example is taken from below it
+            if row_index > 0 and stats['example'] is None:
+                stats['example'] = value
+
+    # So that importing the spreadsheet doesn't need another pass to count its rows
+    red.setex(_row_count_key(spreadsheet_token), SPREADSHEET_ROW_COUNT_SECONDS, row_count)
+
+    return table_data, row_count, column_stats
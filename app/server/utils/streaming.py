@@ -0,0 +1,89 @@
+import json
+from flask import Response, stream_with_context
+
+DEFAULT_STREAM_CHUNK_SIZE = 500
+
+
+def streaming_requested(request_args):
+    """
+    List endpoints stream when asked for every result, rather than a page of them
+    """
+    return (request_args.get('per_page') is None
+            and 'after_id' not in request_args
+            and 'before_id' not in request_args)
+
+
+def stream_query_as_json(query, queried_object, schema, list_key,
+                         order_by=None, loader_options=None, extra_data=None, process_chunk=None,
+                         chunk_size=None):
+    """
+    Streams every result of a query as a JSON response with the same shape as the paginated list responses,
+    so that peak memory stays flat however many rows are returned.
+
+    Ids are streamed from the database with yield_per, and each chunk of ids is loaded (with any loader options),
+    dumped and written out before moving onto the next.
+
+    :param query: base query
+    :param queried_object: model being queried
+    :param schema: many=True schema to dump each chunk with
+    :param list_key: key of the list within the response's data
+    :param order_by: list of order clauses. Defaults to most recently created first
+    :param loader_options: eager loading options applied when loading each chunk
+    :param extra_data: dict of other (small) items to include in the response's data
+    :param process_chunk: optional function of (chunk objects, dumped chunk) to adjust the dumped items in place
+    :param chunk_size: number of rows to load and dump at a time. Defaults to DEFAULT_STREAM_CHUNK_SIZE
+    :return: flask Response
+    """
+
+    if chunk_size is None:
+        chunk_size = DEFAULT_STREAM_CHUNK_SIZE
+
+    if order_by is None:
+        order_by = [queried_object.created.desc(), queried_object.id.desc()]
+
+    id_query = query.order_by(None).order_by(*order_by).with_entities(queried_object.id).yield_per(chunk_size)
+
+    chunk_query = query.order_by(None)
+    if loader_options:
+        chunk_query = chunk_query.options(*loader_options)
+
+    def dump_chunk(ids):
+        objects_by_id = {obj.id: obj for obj in chunk_query.filter(queried_object.id.in_(ids)).all()}
+        objects = [objects_by_id[id] for id in ids if id in objects_by_id]
+
+        dumped = schema.dump(objects).data
+
+        if process_chunk:
+            process_chunk(objects, dumped)
+
+        return dumped
+
+    def generate():
+        yield '{{"status": "success", "message": "Successfully Loaded.", "data": {{{}: ['.format(json.dumps(list_key))
+
+        item_count = 0
+        ids = []
+
+        for row in id_query:
+            ids.append(row.id)
+
+            if len(ids) == chunk_size:
+                for item in dump_chunk(ids):
+                    yield (', ' if item_count else '') + json.dumps(item, default=str)
+                    item_count += 1
+                ids = []
+
+        if ids:
+            for item in dump_chunk(ids):
+                yield (', ' if item_count else '') + json.dumps(item, default=str)
+                item_count += 1
+
+        yield ']'
+
+        for key, value in (extra_data or {}).items():
+            yield ', {}: {}'.format(json.dumps(key), json.dumps(value, default=str))
+
+        # Only known once every row has been written
+        yield '}}, "items": {}, "pages": 1, "next_cursor": null, "previous_cursor": null}}'.format(item_count)
+
+    return Response(stream_with_context(generate()), status=201, mimetype='application/json')
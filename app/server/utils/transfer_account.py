@@ -0,0 +1,258 @@
+import datetime
+
+from sqlalchemy import inspect
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.sql import func, or_, select
+
+from server import db, models
+
+# Postgres advisory lock taken while balance checkpoints are created
+BALANCE_CHECKPOINT_LOCK_KEY = 7245001
+
+
+def load_transfer_accounts_for_credit_transfers(credit_transfers):
+    """
+    Loads the sender and recipient transfer accounts (and with them, their balances) for a list of
+    credit transfers in a single query, and attaches them to the transfers so that serializing
+    the list doesn't lazy load each account in turn.
+
+    :param credit_transfers: list of CreditTransfer objects
+    :return: dict of transfer account id: TransferAccount
+    """
+
+    credit_transfers = [transfer for transfer in credit_transfers if transfer is not None]
+
+    transfer_account_ids = set()
+    for transfer in credit_transfers:
+        transfer_account_ids.add(transfer.sender_transfer_account_id)
+        transfer_account_ids.add(transfer.recipient_transfer_account_id)
+
+    transfer_account_ids.discard(None)
+
+    if not transfer_account_ids:
+        return {}
+
+    transfer_accounts = {
+        transfer_account.id: transfer_account for transfer_account in
+        models.TransferAccount.query.filter(models.TransferAccount.id.in_(transfer_account_ids)).all()
+    }
+
+    for transfer in credit_transfers:
+        unloaded = inspect(transfer).unloaded
+
+        if 'sender_transfer_account' in unloaded:
+            set_committed_value(transfer, 'sender_transfer_account',
+                                transfer_accounts.get(transfer.sender_transfer_account_id))
+
+        if 'recipient_transfer_account' in unloaded:
+            set_committed_value(transfer, 'recipient_transfer_account',
+                                transfer_accounts.get(transfer.recipient_transfer_account_id))
+
+    return transfer_accounts
+
+
+def _sum_completed_transfers(transfer_account_ids=None):
+    """
+    Nets the COMPLETE transfers in and out of each account.
+    Done as two grouped aggregates regardless of the number of accounts.
+
+    :return: dict of transfer account id: net amount
+    """
+
+    def summed_by(account_id_column):
+        query = (db.session.query(account_id_column.label('transfer_account_id'),
+                                  func.sum(models.CreditTransfer.transfer_amount).label('total'))
+                 .filter(models.CreditTransfer.transfer_status == models.TransferStatusEnum.COMPLETE)
+                 .filter(account_id_column.isnot(None))
+                 .group_by(account_id_column))
+
+        if transfer_account_ids is not None:
+            query = query.filter(account_id_column.in_(transfer_account_ids))
+
+        return {row.transfer_account_id: int(row.total or 0) for row in query.all()}
+
+    received = summed_by(models.CreditTransfer.recipient_transfer_account_id)
+    sent = summed_by(models.CreditTransfer.sender_transfer_account_id)
+
+    return {
+        account_id: received.get(account_id, 0) - sent.get(account_id, 0)
+        for account_id in set(received.keys()) | set(sent.keys())
+    }
+
+
+def calculate_balances_from_transfer_history(transfer_account_ids=None):
+    """
+    Recomputes balances from the full credit transfer history, rather than the persisted balance column.
+
+    :param transfer_account_ids: optional list of ids to restrict to. Defaults to all accounts
+    :return: dict of transfer account id: balance, only containing accounts with completed transfers
+    """
+
+    return _sum_completed_transfers(transfer_account_ids)
+
+
+def _sum_ledger_entries(transfer_account_ids, entered_before, uncounted_by=None):
+    # Net of each account's ledger entries up to entered_before, leaving out any counted by checkpoint
+    # runs up to uncounted_by
+    entry = models.BalanceLedgerEntry
+
+    query = (db.session.query(entry.transfer_account_id, func.sum(entry.amount).label('total'))
+             .filter(entry.transfer_account_id.in_(transfer_account_ids))
+             .filter(entry.entry_date <= entered_before)
+             .group_by(entry.transfer_account_id))
+
+    if uncounted_by is not None:
+        query = query.filter(or_(entry.checkpoint_date.is_(None), entry.checkpoint_date > uncounted_by))
+
+    return {row.transfer_account_id: int(row.total or 0) for row in query.all()}
+
+
+def calculate_balances_as_of(transfer_account_ids, as_of):
+    """
+    Finds the balances of transfer accounts at a point in time, starting from each account's nearest
+    balance checkpoint and only summing the ledger entries it didn't count.
+
+    :param transfer_account_ids: list of transfer account ids
+    :param as_of: datetime to calculate the balances at
+    :return: dict of transfer account id: balance
+    """
+
+    transfer_account_ids = set(filter(None, transfer_account_ids))
+
+    if not transfer_account_ids:
+        return {}
+
+    checkpoints = (models.BalanceCheckpoint.query
+                   .filter(models.BalanceCheckpoint.transfer_account_id.in_(transfer_account_ids))
+                   .filter(models.BalanceCheckpoint.checkpoint_date <= as_of)
+                   .distinct(models.BalanceCheckpoint.transfer_account_id)
+                   .order_by(models.BalanceCheckpoint.transfer_account_id,
+                             models.BalanceCheckpoint.checkpoint_date.desc())
+                   .all())
+
+    balances = {account_id: 0 for account_id in transfer_account_ids}
+
+    # Checkpoints are made in runs, so most accounts share a checkpoint date - sum the deltas once per date
+    ids_by_checkpoint_date = {None: set(transfer_account_ids)}
+    for checkpoint in checkpoints:
+        balances[checkpoint.transfer_account_id] = checkpoint.balance
+        ids_by_checkpoint_date[None].discard(checkpoint.transfer_account_id)
+        ids_by_checkpoint_date.setdefault(checkpoint.checkpoint_date, set()).add(checkpoint.transfer_account_id)
+
+    for checkpoint_date, account_ids in ids_by_checkpoint_date.items():
+        if not account_ids:
+            continue
+
+        deltas = _sum_ledger_entries(account_ids, entered_before=as_of, uncounted_by=checkpoint_date)
+
+        for account_id, delta in deltas.items():
+            balances[account_id] += delta
+
+    return balances
+
+
+def create_balance_checkpoints(checkpoint_date=None):
+    """
+    Checkpoints the balance of every transfer account with balance ledger entries that no checkpoint has counted.
+    Each new checkpoint is the account's previous checkpoint plus the entries this run claims, which includes
+    reversals and any entry committed after an earlier run passed its entry_date.
+
+    :param checkpoint_date: datetime to checkpoint up to. Defaults to now
+    :return: list of new BalanceCheckpoint objects, added to the session (caller commits)
+    """
+
+    if checkpoint_date is None:
+        checkpoint_date = datetime.datetime.utcnow()
+
+    # Held until the caller commits, so concurrent runs can't both build on the same previous checkpoints
+    db.session.execute(select([func.pg_advisory_xact_lock(BALANCE_CHECKPOINT_LOCK_KEY)]))
+
+    previous_run_date = db.session.query(func.max(models.BalanceCheckpoint.checkpoint_date)).scalar()
+
+    if previous_run_date is not None and previous_run_date >= checkpoint_date:
+        return []
+
+    entry_table = models.BalanceLedgerEntry.__table__
+
+    claimed = (entry_table.update()
+               .where(entry_table.c.checkpoint_date.is_(None))
+               .where(entry_table.c.entry_date <= checkpoint_date)
+               .values(checkpoint_date=checkpoint_date)
+               .returning(entry_table.c.transfer_account_id,
+                          entry_table.c.amount,
+                          entry_table.c.credit_transfer_id)
+               .cte('claimed'))
+
+    deltas = {
+        row.transfer_account_id: (int(row.total or 0), row.last_transfer_id) for row in
+        db.session.execute(select([claimed.c.transfer_account_id,
+                                   func.sum(claimed.c.amount).label('total'),
+                                   func.max(claimed.c.credit_transfer_id).label('last_transfer_id')])
+                           .group_by(claimed.c.transfer_account_id))
+    }
+
+    if not deltas:
+        return []
+
+    previous_checkpoints = {
+        checkpoint.transfer_account_id: checkpoint for checkpoint in
+        models.BalanceCheckpoint.query
+        .filter(models.BalanceCheckpoint.transfer_account_id.in_(deltas.keys()))
+        .distinct(models.BalanceCheckpoint.transfer_account_id)
+        .order_by(models.BalanceCheckpoint.transfer_account_id, models.BalanceCheckpoint.checkpoint_date.desc())
+        .all()
+    }
+
+    new_checkpoints = []
+    for account_id, (delta, last_transfer_id) in deltas.items():
+        previous_checkpoint = previous_checkpoints.get(account_id)
+
+        balance = delta
+        if previous_checkpoint:
+            balance += previous_checkpoint.balance
+            last_transfer_id = max(filter(None, [last_transfer_id, previous_checkpoint.last_transfer_id]),
+                                   default=None)
+
+        checkpoint = models.BalanceCheckpoint(
+            transfer_account_id=account_id,
+            checkpoint_date=checkpoint_date,
+            balance=balance,
+            last_transfer_id=last_transfer_id
+        )
+
+        db.session.add(checkpoint)
+        new_checkpoints.append(checkpoint)
+
+    return new_checkpoints
+
+
+def reconcile_transfer_account_balances(fix=False):
+    """
+    Compares each transfer account's persisted balance with the balance implied by its transfer history.
+
+    :param fix: if true, overwrite any drifting persisted balance with the recomputed one (caller commits)
+    :return: list of dicts describing each account whose persisted balance has drifted
+    """
+
+    history_balances = calculate_balances_from_transfer_history()
+
+    drift = []
+    for transfer_account in models.TransferAccount.query.order_by(models.TransferAccount.id).yield_per(1000):
+
+        expected_balance = history_balances.get(transfer_account.id, 0)
+
+        if transfer_account.balance != expected_balance:
+            drift.append({
+                'transfer_account_id': transfer_account.id,
+                'persisted_balance': transfer_account.balance,
+                'expected_balance': expected_balance,
+                'difference': transfer_account.balance - expected_balance
+            })
+
+    if fix:
+        for item in drift:
+            (models.TransferAccount.query
+             .filter(models.TransferAccount.id == item['transfer_account_id'])
+             .update({models.TransferAccount._balance: item['expected_balance']}, synchronize_session=False))
+
+    return drift
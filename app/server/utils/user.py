@@ -1,6 +1,7 @@
 import threading, re
 from phonenumbers.phonenumberutil import NumberParseException
 from sqlalchemy.orm.attributes import flag_modified
+from sqlalchemy.sql import tuple_, literal
 from bit import base58
 from flask import current_app
 
@@ -13,6 +14,7 @@ from server.utils import credit_transfers as CreditTransferUtils
 from server.utils.phone import proccess_phone_number, send_onboarding_message
 from server.utils.amazon_s3 import generate_new_filename, save_to_s3_from_url, LoadFileException
 from server.utils.misc import elapsed_time
+from server.utils.reference_data import get_reference_data
 
 from ethereum import utils
 
@@ -45,47 +47,134 @@ def find_oldest_user_for_transfer_account(transfer_account):
     return oldest_user
 
 
-def find_user_from_public_identifier(*public_identifiers):
+def identifier_candidates(public_identifier):
+    """
+    :return: list of the (identifier type, normalized value) pairs a public identifier could match,
+        in the order they're tried
+    """
+    candidates = []
 
-    user = None
+    if public_identifier is None:
+        return candidates
 
-    for public_identifier in public_identifiers:
+    for identifier_type in models.UserIdentifier.TYPES:
+        value = models.UserIdentifier.normalize(identifier_type, public_identifier)
+        if value is not None:
+            candidates.append((identifier_type, value))
 
-        if public_identifier is None:
-            continue
+    try:
+        candidates.append((models.UserIdentifier.BLOCKCHAIN_ADDRESS, utils.checksum_encode(public_identifier)))
+    except Exception:
+        pass
 
-        user = models.User.query.filter_by(email=str(public_identifier).lower()).first()
-        if user:
-            continue
+    return candidates
 
-        try:
-            user = models.User.query.filter_by(phone=proccess_phone_number(public_identifier)).first()
-            if user:
-                continue
-        except NumberParseException:
-            pass
 
-        user = models.User.query.filter_by(public_serial_number=str(public_identifier).lower()).first()
-        if user:
-            continue
+def match_identifier_candidates(candidates, users_by_match):
+    """
+    :param candidates: list of candidate pair lists, in order of preference
+    :param users_by_match: dict of (identifier type, value): user
+    :return: the user for the first candidate pair found, or None
+    """
+    for identifier_candidates in candidates:
+        for pair in identifier_candidates:
+            if pair in users_by_match:
+                return users_by_match[pair]
 
-        user = models.User.query.filter_by(nfc_serial_number=public_identifier.upper()).first()
-        if user:
-            continue
+    return None
 
-        try:
-            checksummed = utils.checksum_encode(public_identifier)
-            blockchain_address = models.BlockchainAddress.query.filter_by(address=checksummed).first()
 
-            if blockchain_address and blockchain_address.transfer_account:
-                user = blockchain_address.transfer_account.primary_user
-                if user:
-                    continue
+def _identifier_match_query(*criterion):
+    return (db.session.query(models.UserIdentifier.user_id.label('user_id'),
+                             models.UserIdentifier.type.label('type'),
+                             models.UserIdentifier.value.label('value'))
+            .filter(*criterion))
 
-        except Exception:
-            pass
 
-    return user
+def _blockchain_address_match_query(addresses):
+    # An address belongs to a transfer account, and finds its primary (earliest created) user
+    return (db.session.query(models.User.id.label('user_id'),
+                             literal(models.UserIdentifier.BLOCKCHAIN_ADDRESS).label('type'),
+                             models.BlockchainAddress.address.label('value'))
+            .join(models.BlockchainAddress,
+                  models.BlockchainAddress.transfer_account_id == models.User.transfer_account_id)
+            .filter(models.BlockchainAddress.address.in_(addresses)))
+
+
+def _load_users_by_match(match_query):
+    matches = match_query.subquery()
+
+    users_by_match = {}
+    for user, identifier_type, value in (db.session.query(models.User, matches.c.type, matches.c.value)
+                                         .join(matches, models.User.id == matches.c.user_id)
+                                         .order_by(models.User.created.desc())
+                                         .all()):
+        # Descending, so the earliest created user is the one kept
+        users_by_match[(identifier_type, value)] = user
+
+    return users_by_match
+
+
+def find_users_by_identifiers(identifier_pairs):
+    """
+    Resolves many identifiers at once, such as for a bulk import, with one query per identifier type
+
+    :param identifier_pairs: iterable of (identifier type, normalized value) pairs, as from identifier_candidates
+    :return: dict of (identifier type, value): earliest created user with it, for the pairs that matched
+    """
+    values_by_type = {}
+    for identifier_type, value in identifier_pairs:
+        values_by_type.setdefault(identifier_type, set()).add(value)
+
+    users_by_match = {}
+    for identifier_type, values in values_by_type.items():
+        if identifier_type == models.UserIdentifier.BLOCKCHAIN_ADDRESS:
+            match_query = _blockchain_address_match_query(values)
+        else:
+            match_query = _identifier_match_query(models.UserIdentifier.type == identifier_type,
+                                                  models.UserIdentifier.value.in_(values))
+
+        users_by_match.update(_load_users_by_match(match_query))
+
+    return users_by_match
+
+
+def find_user_from_public_identifier(*public_identifiers):
+    """
+    Finds a user by email, phone, public serial number, nfc serial number or blockchain address, without
+    needing to know which each identifier is. Every candidate is looked up in one query, against the
+    user_identifier index and the blockchain address index.
+
+    :param public_identifiers: identifiers to try, in order of preference. Nones are skipped
+    :return: the user found by the first identifier that matches, or None
+    """
+
+    candidates = [identifier_candidates(public_identifier) for public_identifier in public_identifiers]
+
+    identifier_pairs = []
+    addresses = []
+    for public_identifier_candidates in candidates:
+        for identifier_type, value in public_identifier_candidates:
+            if identifier_type == models.UserIdentifier.BLOCKCHAIN_ADDRESS:
+                addresses.append(value)
+            else:
+                identifier_pairs.append((identifier_type, value))
+
+    match_queries = []
+
+    if identifier_pairs:
+        match_queries.append(_identifier_match_query(
+            tuple_(models.UserIdentifier.type, models.UserIdentifier.value).in_(identifier_pairs)))
+
+    if addresses:
+        match_queries.append(_blockchain_address_match_query(addresses))
+
+    if not match_queries:
+        return None
+
+    users_by_match = _load_users_by_match(match_queries[0].union_all(*match_queries[1:]))
+
+    return match_identifier_candidates(candidates, users_by_match)
 
 
 def get_transfer_card(public_serial_number):
@@ -285,13 +374,20 @@ def set_custom_attributes(attribute_dict, user):
 def force_attribute_dict_keys_to_lowercase(attribute_dict):
     return dict(zip(map(str.lower, attribute_dict.keys()), attribute_dict.values()))
 
-def apply_settings(attribute_dict):
-    for setting in CREATE_USER_SETTINGS:
-        if setting not in attribute_dict:
-            stored_setting = models.Settings.query.filter_by(name=setting).first()
+def load_create_user_settings():
+    """
+    :return: dict of name: value for the stored CREATE_USER_SETTINGS
+    """
+    settings = get_reference_data('settings')
+    return {name: settings[name] for name in CREATE_USER_SETTINGS if name in settings}
 
-            if stored_setting is not None:
-                attribute_dict[setting] = stored_setting.value
+def apply_settings(attribute_dict, stored_settings=None):
+    if stored_settings is None:
+        stored_settings = load_create_user_settings()
+
+    for setting in CREATE_USER_SETTINGS:
+        if setting not in attribute_dict and setting in stored_settings:
+            attribute_dict[setting] = stored_settings[setting]
 
     return attribute_dict
 
@@ -325,24 +421,26 @@ def strip_kobo_preslashes(attribute_dict):
 def strip_whitespace_characters(attribute_dict):
     return dict(zip(map(remove_whitespace_from_string,attribute_dict.keys()), map(remove_whitespace_from_string, attribute_dict.values())))
 
-def proccess_attribute_dict(attribute_dict,
-                            force_dict_keys_lowercase=False,
-                            allow_existing_user_modify=False,
-                            require_transfer_card_exists=False):
-    elapsed_time('1.0 Start')
-
+def prepare_attribute_dict(attribute_dict, force_dict_keys_lowercase=False, stored_settings=None):
     if force_dict_keys_lowercase:
         attribute_dict = force_attribute_dict_keys_to_lowercase(attribute_dict)
 
     attribute_dict = strip_kobo_preslashes(attribute_dict)
 
-    attribute_dict = apply_settings(attribute_dict)
+    attribute_dict = apply_settings(attribute_dict, stored_settings)
 
     attribute_dict = truthy_all_dict_values(attribute_dict)
 
     attribute_dict = strip_whitespace_characters(attribute_dict)
 
-    elapsed_time('2.0 Post Processing')
+    return attribute_dict
+
+def parse_user_attributes(attribute_dict):
+    """
+    Reads and validates the user details from a prepared attribute dict, without touching the database
+
+    :return: tuple of (dict of user attributes, None), or (None, error response object) if they're invalid
+    """
 
     email = attribute_dict.get('email')
     phone = attribute_dict.get('phone')
@@ -366,17 +464,7 @@ def proccess_attribute_dict(attribute_dict,
                             or attribute_dict.get('payment_card_qr_code')
                             or attribute_dict.get('payment_card_barcode'))
 
-    location = attribute_dict.get('location')
-
     use_precreated_pin = attribute_dict.get('use_precreated_pin')
-    use_last_4_digits_of_id_as_initial_pin = attribute_dict.get('use_last_4_digits_of_id_as_initial_pin')
-
-    transfer_account_name = attribute_dict.get('transfer_account_name')
-    first_name = attribute_dict.get('first_name')
-    last_name = attribute_dict.get('last_name')
-
-    primary_user_identifier = attribute_dict.get('primary_user_identifier')
-    primary_user_pin = attribute_dict.get('primary_user_pin')
 
     custom_initial_disbursement = attribute_dict.get('custom_initial_disbursement', None)
 
@@ -391,8 +479,7 @@ def proccess_attribute_dict(attribute_dict,
         try:
             base58.b58decode_check(blockchain_address)
         except ValueError:
-            response_object = {'message': 'Blockchain Address {} Not Valid'.format(blockchain_address)}
-            return response_object, 400
+            return None, {'message': 'Blockchain Address {} Not Valid'.format(blockchain_address)}
 
     if isinstance(phone,bool):
         phone = None
@@ -401,119 +488,133 @@ def proccess_attribute_dict(attribute_dict,
         try:
             phone = proccess_phone_number(phone)
         except NumberParseException as e:
-            response_object = {'message': 'Invalid Phone Number: ' + str(e)}
-            return response_object, 400
+            return None, {'message': 'Invalid Phone Number: ' + str(e)}
 
-    # Work out if there's an existing transfer account to bind to
-    existing_transfer_account = None
-    if primary_user_identifier:
+    if not (phone or email or public_serial_number or blockchain_address):
+        return None, {'message': 'Must provide a unique identifier'}
 
-        primary_user = find_user_from_public_identifier(primary_user_identifier)
+    if use_precreated_pin and not public_serial_number:
+        return None, {'message': 'Must provide public serial number to use a transfer card or pre-created pin'}
 
-        if not primary_user or not primary_user.verify_password(primary_user_pin):
-            response_object = {'message': 'Primary User not Found'}
-            return response_object, 400
+    if public_serial_number:
+        public_serial_number = str(public_serial_number)
 
-        if not primary_user.verify_password(primary_user_pin):
+    if custom_initial_disbursement and not custom_initial_disbursement <= current_app.config['MAXIMUM_CUSTOM_INITIAL_DISBURSEMENT']:
+        return None, {
+            'message': 'Disbursement more than maximum allowed amount ({} {})'
+                .format(current_app.config['MAXIMUM_CUSTOM_INITIAL_DISBURSEMENT']/100, current_app.config['CURRENCY_NAME'])
+        }
 
-            response_object = {'message': 'Invalid PIN for Primary User'}
-            return response_object, 400
+    user_attributes = dict(
+        first_name=attribute_dict.get('first_name'),
+        last_name=attribute_dict.get('last_name'),
+        phone=phone,
+        email=email,
+        public_serial_number=public_serial_number,
+        blockchain_address=blockchain_address,
+        transfer_account_name=attribute_dict.get('transfer_account_name'),
+        location=attribute_dict.get('location'),
+        use_precreated_pin=use_precreated_pin,
+        use_last_4_digits_of_id_as_initial_pin=attribute_dict.get('use_last_4_digits_of_id_as_initial_pin'),
+        primary_user_identifier=attribute_dict.get('primary_user_identifier'),
+        primary_user_pin=attribute_dict.get('primary_user_pin'),
+        custom_initial_disbursement=custom_initial_disbursement,
+        is_vendor=is_vendor,
+        is_beneficiary=is_beneficiary
+    )
 
-        primary_user_transfer_account = primary_user.transfer_account
+    return user_attributes, None
 
-        if not primary_user_transfer_account:
-            response_object = {'message': 'Primary User has no transfer account'}
-            return response_object, 400
+def check_user_attributes(user_attributes, require_transfer_card_exists=False, transfer_card_serial_numbers=None):
+    """
+    Checks the parts of parsed user attributes that depend on what's in the database
 
-    if not (phone or email or public_serial_number or blockchain_address):
-        response_object = {'message': 'Must provide a unique identifier'}
-        return response_object, 400
+    :param transfer_card_serial_numbers: set of public serial numbers known to have transfer cards, to check
+        against instead of querying, such as for a bulk import
+    :return: error response object, or None if the attributes are valid
+    """
 
-    if use_precreated_pin and not public_serial_number:
-        response_object = {
-            'message': 'Must provide public serial number to use a transfer card or pre-created pin'
-        }
-        return response_object, 400
+    # Work out if there's an existing transfer account to bind to
+    primary_user_identifier = user_attributes['primary_user_identifier']
+    if primary_user_identifier:
 
-    if public_serial_number:
-        public_serial_number = str(public_serial_number)
+        primary_user = find_user_from_public_identifier(primary_user_identifier)
 
-        if use_precreated_pin or require_transfer_card_exists:
-            transfer_card = models.TransferCard.query.filter_by(
-                public_serial_number=public_serial_number).first()
+        if not primary_user or not primary_user.verify_password(user_attributes['primary_user_pin']):
+            return {'message': 'Primary User not Found'}
 
-            if not transfer_card:
-                response_object = {'message': 'Transfer card not found'}
-                return response_object, 400
+        if not primary_user.verify_password(user_attributes['primary_user_pin']):
+            return {'message': 'Invalid PIN for Primary User'}
 
-    if custom_initial_disbursement and not custom_initial_disbursement <= current_app.config['MAXIMUM_CUSTOM_INITIAL_DISBURSEMENT']:
-        response_object = {
-            'message': 'Disbursement more than maximum allowed amount ({} {})'
-                .format(current_app.config['MAXIMUM_CUSTOM_INITIAL_DISBURSEMENT']/100, current_app.config['CURRENCY_NAME'])
-        }
-        return response_object, 400
+        primary_user_transfer_account = primary_user.transfer_account
 
-    existing_user = find_user_from_public_identifier(email, phone, public_serial_number, blockchain_address)
-    if existing_user:
+        if not primary_user_transfer_account:
+            return {'message': 'Primary User has no transfer account'}
 
-        if not allow_existing_user_modify:
-            response_object = {'message': 'User already exists for Identifier'}
-            return response_object, 400
+    public_serial_number = user_attributes['public_serial_number']
+    if public_serial_number and (user_attributes['use_precreated_pin'] or require_transfer_card_exists):
 
-        user = update_transfer_account_user(
-            existing_user,
-            first_name=first_name, last_name=last_name,
-            phone=phone, email=email, public_serial_number=public_serial_number,
-            use_precreated_pin=use_precreated_pin,
-            existing_transfer_account=existing_transfer_account,
-            is_beneficiary=is_beneficiary, is_vendor=is_vendor
-            )
+        if transfer_card_serial_numbers is None:
+            transfer_card_exists = models.TransferCard.query.filter_by(
+                public_serial_number=public_serial_number).first() is not None
+        else:
+            transfer_card_exists = public_serial_number in transfer_card_serial_numbers
 
-        default_attributes, custom_attributes = set_custom_attributes(attribute_dict, user)
-        flag_modified(user, "custom_attributes")
+        if not transfer_card_exists:
+            return {'message': 'Transfer card not found'}
 
-        db.session.commit()
+    return None
 
-        response_object = {
-            'message': 'User Updated',
-            'data': {'user': user_schema.dump(user).data}
-        }
+def update_user_from_attributes(user, user_attributes, attribute_dict):
+    user = update_transfer_account_user(
+        user,
+        first_name=user_attributes['first_name'], last_name=user_attributes['last_name'],
+        phone=user_attributes['phone'], email=user_attributes['email'],
+        public_serial_number=user_attributes['public_serial_number'],
+        use_precreated_pin=user_attributes['use_precreated_pin'],
+        existing_transfer_account=None,
+        is_beneficiary=user_attributes['is_beneficiary'], is_vendor=user_attributes['is_vendor']
+        )
 
-        return response_object, 200
+    default_attributes, custom_attributes = set_custom_attributes(attribute_dict, user)
+    flag_modified(user, "custom_attributes")
 
-    elapsed_time('3.0 Ready to create')
+    return user
 
+def create_user_from_attributes(user_attributes, attribute_dict):
+    """
+    :return: tuple of (created user, None), or (user, error response object) if its custom disbursement failed
+    """
     user = create_transfer_account_user(
-        first_name=first_name, last_name=last_name,
-        phone=phone, email=email, public_serial_number=public_serial_number,
-        blockchain_address=blockchain_address,
-        transfer_account_name=transfer_account_name,
-        location=location,
-        use_precreated_pin=use_precreated_pin,
-        use_last_4_digits_of_id_as_initial_pin = use_last_4_digits_of_id_as_initial_pin,
-        existing_transfer_account=existing_transfer_account,
-        is_beneficiary=is_beneficiary, is_vendor=is_vendor
+        first_name=user_attributes['first_name'], last_name=user_attributes['last_name'],
+        phone=user_attributes['phone'], email=user_attributes['email'],
+        public_serial_number=user_attributes['public_serial_number'],
+        blockchain_address=user_attributes['blockchain_address'],
+        transfer_account_name=user_attributes['transfer_account_name'],
+        location=user_attributes['location'],
+        use_precreated_pin=user_attributes['use_precreated_pin'],
+        use_last_4_digits_of_id_as_initial_pin=user_attributes['use_last_4_digits_of_id_as_initial_pin'],
+        existing_transfer_account=None,
+        is_beneficiary=user_attributes['is_beneficiary'], is_vendor=user_attributes['is_vendor']
     )
 
     elapsed_time('4.0 Created')
 
     default_attributes, custom_attributes = set_custom_attributes(attribute_dict, user)
 
-    if custom_initial_disbursement:
+    if user_attributes['custom_initial_disbursement']:
         try:
-            disbursement = CreditTransferUtils.make_disbursement_transfer(custom_initial_disbursement, user)
+            disbursement = CreditTransferUtils.make_disbursement_transfer(
+                user_attributes['custom_initial_disbursement'], user)
         except Exception as e:
-            response_object = {'message': str(e)}
-            return response_object, 400
+            return user, {'message': str(e)}
 
     elapsed_time('5.0 Disbursement done')
 
-    db.session.flush()
-
-    if location:
-        user.location = location
+    return user, None
 
-    if phone and current_app.config['ONBOARDING_SMS']:
+def send_user_onboarding_message(user):
+    if user.phone and current_app.config['ONBOARDING_SMS']:
         try:
             balance = user.transfer_account.balance
             if isinstance(balance, int):
@@ -521,7 +622,7 @@ def proccess_attribute_dict(attribute_dict,
 
             send_onboarding_message(
                 first_name=user.first_name,
-                to_phone=phone,
+                to_phone=user.phone,
                 credits=balance,
                 one_time_code=user.one_time_code
             )
@@ -529,20 +630,63 @@ def proccess_attribute_dict(attribute_dict,
             print(e)
             pass
 
-    if user.one_time_code:
-        response_object = {
-            'message': 'User Created',
-            'data': {
-                'user': user_schema.dump(user).data
-            }
-        }
+def proccess_attribute_dict(attribute_dict,
+                            force_dict_keys_lowercase=False,
+                            allow_existing_user_modify=False,
+                            require_transfer_card_exists=False):
+    elapsed_time('1.0 Start')
+
+    attribute_dict = prepare_attribute_dict(attribute_dict, force_dict_keys_lowercase)
+
+    elapsed_time('2.0 Post Processing')
+
+    user_attributes, error_response_object = parse_user_attributes(attribute_dict)
+
+    if error_response_object is None:
+        error_response_object = check_user_attributes(user_attributes, require_transfer_card_exists)
+
+    if error_response_object is not None:
+        return error_response_object, 400
+
+    existing_user = find_user_from_public_identifier(user_attributes['email'], user_attributes['phone'],
+                                                     user_attributes['public_serial_number'],
+                                                     user_attributes['blockchain_address'])
+    if existing_user:
+
+        if not allow_existing_user_modify:
+            response_object = {'message': 'User already exists for Identifier'}
+            return response_object, 400
+
+        user = update_user_from_attributes(existing_user, user_attributes, attribute_dict)
+
+        db.session.commit()
 
-    else:
         response_object = {
-            'message': 'User Created',
-            'data': {'user': user_schema.dump(user).data }
+            'message': 'User Updated',
+            'data': {'user': user_schema.dump(user).data}
         }
 
+        return response_object, 200
+
+    elapsed_time('3.0 Ready to create')
+
+    user, error_response_object = create_user_from_attributes(user_attributes, attribute_dict)
+
+    if error_response_object is not None:
+        return error_response_object, 400
+
+    db.session.flush()
+
+    if user_attributes['location']:
+        user.location = user_attributes['location']
+
+    send_user_onboarding_message(user)
+
+    response_object = {
+        'message': 'User Created',
+        'data': {'user': user_schema.dump(user).data}
+    }
+
     elapsed_time('6.0 Complete')
 
-    return response_object, 200
\ No newline at end of file
+    return response_object, 200
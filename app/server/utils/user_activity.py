@@ -0,0 +1,133 @@
+import datetime
+import time
+
+from sqlalchemy import text
+
+from server import db, models, red
+from server.utils.auth_cache import invalidate_user_auth_state
+
+# Hash of user id: unix time the user was last seen, since the last flush
+BUFFERED_LAST_SEEN_KEY = 'buffered_user_last_seen'
+# Set of 'user id|ip' for ips seen since the last flush that weren't known to be saved for the user
+BUFFERED_IP_ADDRESSES_KEY = 'buffered_user_ip_addresses'
+
+FLUSH_CHUNK_SIZE = 1000
+
+
+def record_user_activity(user_id, ip_address=None):
+    """
+    Buffers a user's last seen time, and optionally an ip address to save for them, in redis.
+    Nothing is written to the database until flush_user_activity runs.
+
+    :param user_id: id of the user seen
+    :param ip_address: ip to save for the user, if it's not already known to be saved
+    """
+    pipe = red.pipeline(transaction=False)
+    pipe.hset(BUFFERED_LAST_SEEN_KEY, user_id, time.time())
+
+    if ip_address is not None:
+        pipe.sadd(BUFFERED_IP_ADDRESSES_KEY, '{}|{}'.format(user_id, ip_address))
+
+    pipe.execute()
+
+
+def _take_buffered_activity():
+    # Read and clear each buffer atomically, so that activity recorded during a flush waits for the next one
+    pipe = red.pipeline()
+    pipe.hgetall(BUFFERED_LAST_SEEN_KEY)
+    pipe.delete(BUFFERED_LAST_SEEN_KEY)
+    pipe.smembers(BUFFERED_IP_ADDRESSES_KEY)
+    pipe.delete(BUFFERED_IP_ADDRESSES_KEY)
+    buffered_last_seen, _, buffered_ip_addresses, _ = pipe.execute()
+
+    last_seen_by_user_id = {
+        int(user_id): datetime.datetime.utcfromtimestamp(float(timestamp))
+        for user_id, timestamp in buffered_last_seen.items()
+    }
+
+    ip_addresses = set()
+    for member in buffered_ip_addresses:
+        user_id, ip_address = member.decode().split('|', 1)
+        ip_addresses.add((int(user_id), ip_address))
+
+    return last_seen_by_user_id, ip_addresses
+
+
+def _update_last_seen(last_seen_by_user_id):
+    items = sorted(last_seen_by_user_id.items())
+
+    for start in range(0, len(items), FLUSH_CHUNK_SIZE):
+        chunk = items[start:start + FLUSH_CHUNK_SIZE]
+
+        params = {}
+        values = []
+        for i, (user_id, last_seen) in enumerate(chunk):
+            params['user_id_{}'.format(i)] = user_id
+            params['last_seen_{}'.format(i)] = last_seen
+            values.append('(:user_id_{0}, :last_seen_{0})'.format(i))
+
+        db.session.execute(
+            text('UPDATE "user" SET _last_seen = buffered.last_seen '
+                 'FROM (VALUES {}) AS buffered (user_id, last_seen) '
+                 'WHERE "user".id = buffered.user_id '
+                 'AND ("user"._last_seen IS NULL OR "user"._last_seen < buffered.last_seen)'.format(', '.join(values))),
+            params
+        )
+
+
+def _save_new_ip_addresses(ip_addresses):
+    user_ids = set(user_id for user_id, _ in ip_addresses)
+
+    saved = set(
+        (row.user_id, str(row._ip)) for row in
+        db.session.query(models.IpAddress.user_id, models.IpAddress._ip)
+        .filter(models.IpAddress.user_id.in_(user_ids))
+        .all()
+    )
+
+    existing_user_ids = set(
+        row.id for row in db.session.query(models.User.id).filter(models.User.id.in_(user_ids)).all()
+    )
+
+    new_ip_addresses = []
+    for user_id, ip_address in sorted(ip_addresses - saved):
+        if user_id not in existing_user_ids:
+            continue
+
+        # Set directly rather than through the ip setter, so they're only located once they have an id
+        new_ip_address = models.IpAddress(user_id=user_id)
+        new_ip_address._ip = ip_address
+        db.session.add(new_ip_address)
+        new_ip_addresses.append(new_ip_address)
+
+    db.session.flush()
+
+    return new_ip_addresses
+
+
+def flush_user_activity():
+    """
+    Writes the buffered last seen times and ip addresses to the database: last seen times as one
+    UPDATE ... FROM (VALUES ...) per chunk of users, and only the ips not already saved for each user.
+    Commits, as the buffers have already been cleared. If the commit fails, that interval's activity is lost.
+
+    :return: tuple of (number of users seen, number of new ip addresses saved)
+    """
+
+    last_seen_by_user_id, ip_addresses = _take_buffered_activity()
+
+    if last_seen_by_user_id:
+        _update_last_seen(last_seen_by_user_id)
+
+    new_ip_addresses = []
+    if ip_addresses:
+        new_ip_addresses = _save_new_ip_addresses(ip_addresses)
+
+    db.session.commit()
+
+    for ip_address in new_ip_addresses:
+        models.IpAddress.locate_ip(ip_address.id, ip_address.ip)
+        # So the cached ips include the new one
+        invalidate_user_auth_state(ip_address.user_id)
+
+    return len(last_seen_by_user_id), len(new_ip_addresses)
@@ -0,0 +1,328 @@
+import datetime
+
+from server import db, models
+from server.utils import user as UserUtils
+from server.utils.pusher import push_dataset_import_progress
+from server.utils.spreadsheet import get_spreadsheet_row_count, read_spreadsheet_rows, remove_local_spreadsheet
+
+# Rows created or updated, and committed, at a time
+IMPORT_CHUNK_SIZE = 250
+
+# Rows imported per request from the worker for an import job
+IMPORT_JOB_CHUNK_SIZE = 1000
+
+# How long a request importing a chunk holds its job, before another may take over in case its process died
+IMPORT_JOB_CLAIM_SECONDS = 60 * 15
+
+
+def _row_candidates(user_attributes):
+    return [UserUtils.identifier_candidates(user_attributes[identifier])
+            for identifier in ['email', 'phone', 'public_serial_number', 'blockchain_address']]
+
+
+def _load_transfer_card_serial_numbers(parsed_rows):
+    serial_numbers = set(user_attributes['public_serial_number'] for _, user_attributes, _ in parsed_rows
+                         if user_attributes['public_serial_number'])
+
+    if not serial_numbers:
+        return set()
+
+    return set(serial_number for (serial_number,) in
+               db.session.query(models.TransferCard.public_serial_number)
+               .filter(models.TransferCard.public_serial_number.in_(serial_numbers)).all())
+
+
+def _register_user_identifiers(user, users_by_match):
+    # So that later rows in the import find users created or changed by earlier ones, as they would in the database
+    pairs = [(identifier.type, identifier.value) for identifier in user.identifiers]
+
+    if user.transfer_account and user.transfer_account.blockchain_address:
+        pairs.append((models.UserIdentifier.BLOCKCHAIN_ADDRESS, user.transfer_account.blockchain_address.address))
+
+    for pair in pairs:
+        users_by_match.setdefault(pair, user)
+
+
+def import_users(attribute_dicts,
+                 force_dict_keys_lowercase=False,
+                 allow_existing_user_modify=False,
+                 require_transfer_card_exists=False,
+                 chunk_size=None):
+    """
+    Creates or updates a user for each attribute dict, as proccess_attribute_dict does one at a time, but with the
+    database work batched:
+     - settings, existing users (one query per identifier type) and transfer cards are read once for the import
+     - every row is validated before anything is written
+     - rows are saved a chunk at a time, with one commit per chunk. Rows with a custom initial disbursement are
+       committed one at a time, as the disbursement is
+
+    :param attribute_dicts: list of attribute dicts, one per user
+    :param chunk_size: number of rows to save per commit. Defaults to IMPORT_CHUNK_SIZE
+    :return: list of (message, response code) diagnostics, one per attribute dict and in the same order
+    """
+
+    if chunk_size is None:
+        chunk_size = IMPORT_CHUNK_SIZE
+
+    diagnostics = [None] * len(attribute_dicts)
+
+    stored_settings = UserUtils.load_create_user_settings()
+
+    parsed_rows = []
+    for index, attribute_dict in enumerate(attribute_dicts):
+        attribute_dict = UserUtils.prepare_attribute_dict(attribute_dict, force_dict_keys_lowercase, stored_settings)
+
+        user_attributes, error_response_object = UserUtils.parse_user_attributes(attribute_dict)
+
+        if error_response_object is not None:
+            diagnostics[index] = (error_response_object.get('message'), 400)
+        else:
+            parsed_rows.append((index, user_attributes, attribute_dict))
+
+    transfer_card_serial_numbers = _load_transfer_card_serial_numbers(parsed_rows)
+
+    valid_rows = []
+    for index, user_attributes, attribute_dict in parsed_rows:
+        error_response_object = UserUtils.check_user_attributes(user_attributes, require_transfer_card_exists,
+                                                                transfer_card_serial_numbers)
+
+        if error_response_object is not None:
+            diagnostics[index] = (error_response_object.get('message'), 400)
+        else:
+            valid_rows.append((index, user_attributes, attribute_dict, _row_candidates(user_attributes)))
+
+    users_by_match = UserUtils.find_users_by_identifiers(
+        pair for _, _, _, candidates in valid_rows for identifier_candidates in candidates
+        for pair in identifier_candidates
+    )
+
+    for start in range(0, len(valid_rows), chunk_size):
+        created_users = []
+
+        for index, user_attributes, attribute_dict, candidates in valid_rows[start:start + chunk_size]:
+
+            existing_user = UserUtils.match_identifier_candidates(candidates, users_by_match)
+            if existing_user:
+
+                if not allow_existing_user_modify:
+                    diagnostics[index] = ('User already exists for Identifier', 400)
+                    continue
+
+                user = UserUtils.update_user_from_attributes(existing_user, user_attributes, attribute_dict)
+                _register_user_identifiers(user, users_by_match)
+
+                diagnostics[index] = ('User Updated', 200)
+                continue
+
+            if user_attributes['custom_initial_disbursement']:
+                # The disbursement commits as it's made, and these are the only rows that can fail once saving has
+                # started. So the chunk so far is saved first, and a failure only rolls back its own row.
+                _save_created_users(created_users)
+                created_users = []
+
+                user, error_response_object = UserUtils.create_user_from_attributes(user_attributes, attribute_dict)
+
+                if error_response_object is not None:
+                    db.session.rollback()
+                    diagnostics[index] = (error_response_object.get('message'), 400)
+                    continue
+            else:
+                user, _ = UserUtils.create_user_from_attributes(user_attributes, attribute_dict)
+
+            _register_user_identifiers(user, users_by_match)
+            created_users.append((user, user_attributes['location']))
+
+            diagnostics[index] = ('User Created', 200)
+
+        _save_created_users(created_users)
+
+    return diagnostics
+
+
+def _save_created_users(created_users):
+    # Commits the session, then sets the created users' locations and sends their onboarding messages
+    db.session.commit()
+
+    # Geolocation needs the users to have been committed
+    located_users = [(user, location) for user, location in created_users if location]
+    for user, location in located_users:
+        user.location = location
+
+    if located_users:
+        db.session.commit()
+
+    for user, _ in created_users:
+        UserUtils.send_user_onboarding_message(user)
+
+
+def attribute_dict_from_row(datarow, header_positions):
+    """
+    :param datarow: spreadsheet row, as a dict of column index: value or a list of values
+    :param header_positions: dict of column index: attribute name, for the columns to import
+    :return: attribute dict of the row's filled columns, or None if none of them are
+    """
+    attribute_dict = {}
+
+    for key, header_label in header_positions.items():
+
+        if isinstance(datarow, dict):
+            attribute = datarow.get(key)
+        else:
+            column_index = int(key)
+            attribute = datarow[column_index] if column_index < len(datarow) else None
+
+        if attribute:
+            attribute_dict[header_label] = attribute
+
+    return attribute_dict or None
+
+
+def create_import_job(attribute_dicts):
+    """
+    Saves attribute dicts to be imported by the worker, a chunk at a time, with run_import_job_chunk
+    """
+    job = models.DatasetImportJob(row_count=len(attribute_dicts))
+    db.session.add(job)
+    db.session.flush()
+
+    db.session.bulk_insert_mappings(models.DatasetImportRow, [
+        {'job_id': job.id, 'row_number': row_number, 'attribute_dict': attribute_dict}
+        for row_number, attribute_dict in enumerate(attribute_dicts)
+    ])
+
+    return job
+
+
+def create_spreadsheet_import_job(spreadsheet_token, header_positions, first_data_row=0):
+    """
+    Creates a job to import a spreadsheet stored by save_spreadsheet, which is streamed from a chunk at a time
+    rather than saved on the job
+
+    :param header_positions: dict of column index: attribute name, for the columns to import
+    :param first_data_row: index of the first row to import, after any headers
+    """
+    row_count = get_spreadsheet_row_count(spreadsheet_token)
+
+    job = models.DatasetImportJob(spreadsheet_token=spreadsheet_token,
+                                  header_positions=header_positions,
+                                  first_data_row=first_data_row,
+                                  row_count=max(row_count - first_data_row, 0))
+    db.session.add(job)
+
+    return job
+
+
+def _next_job_rows(job, chunk_size):
+    # (row number, attribute dict or None if it's empty) for the next chunk of the job,
+    # and the spreadsheet position after it
+    start = job.processed_count or 0
+
+    if not job.spreadsheet_token:
+        return (db.session.query(models.DatasetImportRow.row_number, models.DatasetImportRow.attribute_dict)
+                .filter(models.DatasetImportRow.job_id == job.id)
+                .filter(models.DatasetImportRow.row_number >= start)
+                .filter(models.DatasetImportRow.row_number < start + chunk_size)
+                .order_by(models.DatasetImportRow.row_number)
+                .all()), None
+
+    first_row = job.first_data_row + start
+    spreadsheet_rows, position = read_spreadsheet_rows(job.spreadsheet_token, first_row, chunk_size,
+                                                       position=job.spreadsheet_position)
+
+    return [(row_number, attribute_dict_from_row(row, job.header_positions))
+            for row_number, row in enumerate(spreadsheet_rows, first_row)], position
+
+
+def claim_import_job(job_id):
+    """
+    Locks a job for a request to import its next chunk, so that two requests can't import the same rows at once
+
+    :return: tuple of (job, or None if it doesn't exist, whether it was claimed)
+    """
+    job = models.DatasetImportJob.query.filter_by(id=job_id).with_for_update().first()
+
+    if job is None:
+        return None, False
+
+    # Nothing left to import, so nothing to hold
+    if job.status in ['COMPLETE', 'FAILED']:
+        return job, True
+
+    now = datetime.datetime.utcnow()
+
+    if job.processing_since and job.processing_since > now - datetime.timedelta(seconds=IMPORT_JOB_CLAIM_SECONDS):
+        db.session.commit()
+        return job, False
+
+    job.processing_since = now
+    db.session.commit()
+
+    return job, True
+
+
+def run_import_job_chunk(job, chunk_size=None):
+    """
+    Imports the next chunk of a job's rows, then records and pushes its progress. The worker calls this
+    repeatedly, so an import never holds an app process for more than a chunk.
+
+    If a chunk fails part way, the job is failed, and any users the chunk had already committed are kept.
+
+    :param chunk_size: number of rows to import. Defaults to IMPORT_JOB_CHUNK_SIZE
+    :return: the job
+    """
+    if chunk_size is None:
+        chunk_size = IMPORT_JOB_CHUNK_SIZE
+
+    if job.status in ['COMPLETE', 'FAILED']:
+        return job
+
+    job.status = 'RUNNING'
+
+    rows, spreadsheet_position = _next_job_rows(job, chunk_size)
+    importable_rows = [(row_number, attribute_dict) for row_number, attribute_dict in rows if attribute_dict]
+
+    diagnostics = import_users([attribute_dict for _, attribute_dict in importable_rows],
+                               force_dict_keys_lowercase=True, allow_existing_user_modify=True)
+
+    job.processed_count = (job.processed_count or 0) + len(rows)
+    job.spreadsheet_position = spreadsheet_position
+    job.created_count += sum(1 for message, response_code in diagnostics if message == 'User Created')
+    job.updated_count += sum(1 for message, response_code in diagnostics if message == 'User Updated')
+    job.failed_count += sum(1 for message, response_code in diagnostics if response_code != 200)
+
+    # Only failures are kept, as rows of their own, so a chunk's write doesn't grow with the rows before it
+    db.session.bulk_insert_mappings(models.DatasetImportFailure, [
+        {'job_id': job.id, 'row_number': row_number, 'message': message}
+        for (row_number, _), (message, response_code) in zip(importable_rows, diagnostics)
+        if response_code != 200
+    ])
+
+    job.processing_since = None
+
+    if job.processed_count >= job.row_count or len(rows) < chunk_size:
+        job.status = 'COMPLETE'
+
+        if job.spreadsheet_token:
+            remove_local_spreadsheet(job.spreadsheet_token)
+        else:
+            (models.DatasetImportRow.query
+             .filter(models.DatasetImportRow.job_id == job.id)
+             .delete(synchronize_session=False))
+
+    db.session.commit()
+
+    push_dataset_import_progress(job)
+
+    return job
+
+
+def fail_import_job(job, error):
+    db.session.rollback()
+
+    job.status = 'FAILED'
+    job.error = str(error)
+    job.processing_since = None
+
+    db.session.commit()
+
+    push_dataset_import_progress(job)
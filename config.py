@@ -83,9 +83,17 @@ AUTO_APPROVE_TRANSFER_ACCOUNTS = specific_parser['APP'].getboolean('AUTO_APPROVE
 MAXIMUM_CUSTOM_INITIAL_DISBURSEMENT = int(specific_parser['APP'].get('MAXIMUM_CUSTOM_INITIAL_DISBURSEMENT', 0))
 ONBOARDING_SMS = specific_parser['APP'].getboolean('ONBOARDING_SMS', False)
 TFA_REQUIRED_ROLES = specific_parser['APP']['TFA_REQUIRED_ROLES'].split(',')
+# Number of pre-generated keypairs the worker keeps available for new transfer accounts
+BLOCKCHAIN_KEYPAIR_POOL_WATERMARK = int(specific_parser['APP'].get('BLOCKCHAIN_KEYPAIR_POOL_WATERMARK', 1000))
 MOBILE_VERSION = specific_parser['APP']['MOBILE_VERSION']
 
 SECRET_KEY          = specific_parser['APP']['SECRET_KEY'] + DEPLOYMENT_NAME
+# Secrets that private keys and TFA secrets are encrypted with, newest first. Values encrypted with any of them
+# can be decrypted, and are moved to the newest by the reencrypt_secrets command. See key_management.py
+ENCRYPTION_SECRETS  = [secret for secret in specific_parser['APP'].get('ENCRYPTION_SECRETS', '').split(',') if secret]
+if SECRET_KEY not in ENCRYPTION_SECRETS:
+    ENCRYPTION_SECRETS.append(SECRET_KEY)
+
 ECDSA_SECRET        = hashlib.sha256(specific_parser['APP']['ECDSA_SECRET'].encode()).digest()[0:24]
 APP_HOST            = specific_parser['APP']['APP_HOST']
 
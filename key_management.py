@@ -0,0 +1,80 @@
+"""
+Encryption for the private keys and TFA secrets stored in the database. Shared by the app and the worker,
+which both ship it alongside config.py.
+
+Values are encrypted with the newest of config.ENCRYPTION_SECRETS, and can be decrypted with any of them,
+so a secret can be rotated by adding a new one to the front and re-encrypting (see needs_reencryption).
+"""
+import base64
+
+from cryptography.fernet import Fernet, MultiFernet, InvalidToken
+from ethereum import utils
+
+import config
+
+_ciphers = None
+
+
+def _fernet_key(secret):
+    return base64.b64encode(utils.sha3(secret))
+
+
+def get_ciphers():
+    """
+    Derives the Fernet instances once per process, as the sha3 and key setup dominates the cost of a short value
+
+    :return: tuple of (Fernet for the newest secret only, MultiFernet for all secrets)
+    """
+    global _ciphers
+
+    if _ciphers is None:
+        fernets = [Fernet(_fernet_key(secret)) for secret in config.ENCRYPTION_SECRETS]
+        _ciphers = (fernets[0], MultiFernet(fernets))
+
+    return _ciphers
+
+
+def encrypt(raw_string):
+    return get_ciphers()[1].encrypt(raw_string.encode('utf-8')).decode('utf-8')
+
+
+def decrypt(encrypted_string):
+    return get_ciphers()[1].decrypt(encrypted_string.encode('utf-8')).decode('utf-8')
+
+
+def encrypt_many(raw_strings):
+    """
+    Encrypts a batch of values, such as the private keys for a bulk account creation
+
+    :return: list of encrypted strings, in the same order
+    """
+    cipher = get_ciphers()[1]
+    return [cipher.encrypt(raw_string.encode('utf-8')).decode('utf-8') for raw_string in raw_strings]
+
+
+def decrypt_many(encrypted_strings):
+    """
+    Decrypts a batch of values, such as the private keys for a bulk approval
+
+    :return: list of decrypted strings, in the same order
+    """
+    cipher = get_ciphers()[1]
+    return [cipher.decrypt(encrypted_string.encode('utf-8')).decode('utf-8') for encrypted_string in encrypted_strings]
+
+
+def needs_reencryption(encrypted_string):
+    """
+    :return: True if the value wasn't encrypted with the newest secret
+    """
+    try:
+        get_ciphers()[0].decrypt(encrypted_string.encode('utf-8'))
+        return False
+    except InvalidToken:
+        return True
+
+
+def reencrypt(encrypted_string):
+    """
+    Re-encrypts a value with the newest secret, keeping its original timestamp
+    """
+    return get_ciphers()[1].rotate(encrypted_string.encode('utf-8')).decode('utf-8')
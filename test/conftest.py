@@ -130,6 +130,30 @@ def create_ip_address(create_admin_user):
     return ip_address
 
 
+@pytest.fixture(scope='function')
+def count_queries(test_client):
+    """
+    Returns a context manager that records every SQL statement executed inside it
+    """
+    from contextlib import contextmanager
+    from sqlalchemy import event
+
+    @contextmanager
+    def counter():
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            yield statements
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+    return counter
+
+
 @pytest.fixture(scope='module')
 def test_request_context():
     flask_app = create_app()
@@ -168,3 +192,12 @@ def init_database():
     with current_app.app_context():
         db.session.close_all()  # DO NOT DELETE THIS LINE. We need to close sessions before dropping tables.
         db.drop_all()
+
+    # Ids are reused by the next module's database, so cached auth state mustn't outlive this one
+    from server import red
+    for key in red.scan_iter('user_auth_state:*'):
+        red.delete(key)
+
+    # Nor reference data cached from it
+    from server.utils.reference_data import clear_reference_data_cache
+    clear_reference_data_cache()
@@ -4,5 +4,127 @@ This file (test_credit_transfer_api.py) contains the functional tests for the cr
 These tests use GETs, PUTs and POSTs to different URLs to check for the proper behavior
 of the credit_transfer blueprint.
 """
+import pytest
 
 # todo- get credit transfers / post credit transfers / put credit transfer
+
+
+@pytest.mark.parametrize('query_string,status_code', [
+    ('', 201),
+    ('?bucket=week&start=2019-01-01&end=2019-03-01', 201),
+    ('?bucket=month&is_vendor=true', 201),
+    ('?bucket=day&transfer_account_ids=1,2', 201),
+    ('?bucket=hour&start=2019-01-01&end=2019-01-03', 201),
+    ('?start=2019-01-01T00:00:00Z', 201),
+    ('?bucket=hour&start=2019-01-01T00:00:00Z&end=2019-01-02T10:00:00+10:00', 201),
+    ('?bucket=hour&start=2019-01-01&end=2019-03-01', 400),
+    ('?bucket=fortnight', 400),
+    ('?start=notadate', 400),
+    ('?start=2019-03-01&end=2019-01-01', 400),
+])
+def test_credit_transfer_stats_api(test_client, create_admin_user, query_string, status_code):
+    """
+    GIVEN a Flask application
+    WHEN the '/api/credit_transfer/stats/' page is requested (GET) with a range, bucket and segment
+    THEN check the response is valid
+    """
+    create_admin_user.is_activated = True
+    create_admin_user.TFA_enabled = True
+    create_admin_user.set_admin_role_using_tier_string('admin')
+    auth_token = create_admin_user.encode_auth_token().decode()
+    tfa_token = create_admin_user.encode_TFA_token(9999).decode()
+
+    response = test_client.get('/api/credit_transfer/stats/' + query_string,
+                               headers=dict(Authorization=auth_token + '|' + tfa_token, Accept='application/json'),
+                               follow_redirects=True)
+
+    assert response.status_code == status_code
+
+    if status_code == 201:
+        transfer_stats = response.json['data']['transfer_stats']
+        assert set(transfer_stats.keys()) >= {'transaction_volume', 'disbursement_volume', 'withdrawal_volume'}
+
+
+def test_credit_transfer_cursor_pagination(test_client, create_admin_user, create_transfer_account_user):
+    """
+    GIVEN a Flask application with several credit transfers
+    WHEN the '/api/credit_transfer/' page is requested (GET) following the next and previous cursors
+    THEN check each transfer is returned exactly once, most recent first, and that the count is opt-in
+    """
+    from server import db
+    from server.models import CreditTransfer
+
+    for _ in range(5):
+        db.session.add(CreditTransfer(amount=10, recipient=create_transfer_account_user))
+    db.session.commit()
+
+    create_admin_user.is_activated = True
+    create_admin_user.TFA_enabled = True
+    create_admin_user.set_admin_role_using_tier_string('admin')
+    auth_token = create_admin_user.encode_auth_token().decode()
+    tfa_token = create_admin_user.encode_TFA_token(9999).decode()
+    headers = dict(Authorization=auth_token + '|' + tfa_token, Accept='application/json')
+
+    expected_ids = [transfer.id for transfer in
+                    CreditTransfer.query.order_by(CreditTransfer.created.desc(), CreditTransfer.id.desc()).all()]
+
+    response = test_client.get('/api/credit_transfer/?per_page=2&after_id=', headers=headers)
+    assert response.status_code == 201
+    assert response.json['items'] is None
+    assert response.json['previous_cursor'] is None
+
+    seen_ids = [transfer['id'] for transfer in response.json['data']['credit_transfers']]
+    while response.json['next_cursor']:
+        last_response = response
+        response = test_client.get(
+            '/api/credit_transfer/?per_page=2&after_id=' + response.json['next_cursor'], headers=headers)
+        assert response.status_code == 201
+        seen_ids += [transfer['id'] for transfer in response.json['data']['credit_transfers']]
+
+    assert seen_ids == expected_ids
+
+    response = test_client.get(
+        '/api/credit_transfer/?per_page=2&count=true&before_id=' + response.json['previous_cursor'], headers=headers)
+    assert response.status_code == 201
+    assert response.json['items'] == len(expected_ids)
+    assert response.json['data']['credit_transfers'] == last_response.json['data']['credit_transfers']
+
+    response = test_client.get('/api/credit_transfer/?after_id=notacursor', headers=headers)
+    assert response.status_code == 400
+
+
+def test_credit_transfer_list_streamed(monkeypatch, test_client, create_admin_user, create_transfer_account_user):
+    """
+    GIVEN a Flask application with more credit transfers than fit in one streamed chunk
+    WHEN the '/api/credit_transfer/' page is requested (GET) without per_page
+    THEN check the streamed response is valid JSON containing every transfer, most recent first
+    """
+    import json
+    from server import db
+    from server.models import CreditTransfer
+    from server.utils import streaming
+
+    for _ in range(5):
+        db.session.add(CreditTransfer(amount=10, recipient=create_transfer_account_user))
+    db.session.commit()
+
+    create_admin_user.is_activated = True
+    create_admin_user.TFA_enabled = True
+    create_admin_user.set_admin_role_using_tier_string('admin')
+    auth_token = create_admin_user.encode_auth_token().decode()
+    tfa_token = create_admin_user.encode_TFA_token(9999).decode()
+    headers = dict(Authorization=auth_token + '|' + tfa_token, Accept='application/json')
+
+    expected_ids = [transfer.id for transfer in
+                    CreditTransfer.query.order_by(CreditTransfer.created.desc(), CreditTransfer.id.desc()).all()]
+
+    monkeypatch.setattr(streaming, 'DEFAULT_STREAM_CHUNK_SIZE', 2)
+
+    response = test_client.get('/api/credit_transfer/?get_stats=true', headers=headers)
+    assert response.status_code == 201
+    data = json.loads(response.get_data(as_text=True))
+
+    assert data['status'] == 'success'
+    assert [transfer['id'] for transfer in data['data']['credit_transfers']] == expected_ids
+    assert data['items'] == len(expected_ids)
+    assert 'transfer_stats' in data['data']
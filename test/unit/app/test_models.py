@@ -141,6 +141,24 @@ def test_create_transfer_account(create_transfer_account):
     assert create_transfer_account.blockchain_address is not None
 
 
+def test_transfer_account_balance_expression(create_transfer_account):
+    """
+    GIVEN A transfer account model
+    WHEN transfer accounts are filtered and sorted by balance in the database
+    THEN check the account is found by its balance
+    """
+    from server.models import TransferAccount
+
+    zero_balance_ids = [account.id for account in TransferAccount.query
+                        .filter(TransferAccount.balance == 0)
+                        .order_by(TransferAccount.balance.desc())
+                        .all()]
+
+    assert create_transfer_account.id in zero_balance_ids
+    assert TransferAccount.query.filter(TransferAccount.balance > 0).filter(
+        TransferAccount.id == create_transfer_account.id).first() is None
+
+
 # todo- requires mocking blockchain worker/endpoint.
 # def test_approve_beneficiary_transfer_account(new_transfer_account):
 #     """
@@ -167,6 +185,26 @@ def test_approve_vendor_transfer_account(new_transfer_account):
     assert new_transfer_account.balance is 0
 
 
+def test_update_master_wallet_approval_status(create_transfer_account):
+    """
+    GIVEN a TransferAccount model
+    WHEN its master wallet approval transaction is pending, succeeds and then a later one fails
+    THEN check the cached approval state follows it, and stays APPROVED once approved
+    """
+    from server.models import MasterWalletApprovalStatusEnum
+
+    create_transfer_account.update_master_wallet_approval_status('PENDING')
+    assert create_transfer_account._master_wallet_approval_status == MasterWalletApprovalStatusEnum.REQUESTED
+
+    create_transfer_account.update_master_wallet_approval_status('SUCCESS')
+    assert create_transfer_account._master_wallet_approval_status == MasterWalletApprovalStatusEnum.APPROVED
+    approved_at = create_transfer_account.master_wallet_approval_status_updated
+
+    create_transfer_account.update_master_wallet_approval_status('FAILED')
+    assert create_transfer_account._master_wallet_approval_status == MasterWalletApprovalStatusEnum.APPROVED
+    assert create_transfer_account.master_wallet_approval_status_updated == approved_at
+
+
 """ ----- Credit Transfer Model ----- """
 
 
@@ -203,6 +241,71 @@ def test_new_credit_transfer_rejected(create_credit_transfer):
     assert create_credit_transfer.resolution_message is not None
 
 
+def test_credit_transfer_updates_persisted_balance(create_transfer_account_user):
+    """
+    GIVEN a CreditTransfer model
+    WHEN a disbursement is resolved as complete, and then rejected
+    THEN check the recipient's persisted balance is incremented, then restored,
+         and that it always agrees with the transfer history
+    """
+    from server import db
+    from server.models import CreditTransfer
+    from server.utils.transfer_account import reconcile_transfer_account_balances
+
+    transfer_account = create_transfer_account_user.transfer_account
+    starting_balance = transfer_account.balance
+
+    disbursement = CreditTransfer(amount=50, recipient=create_transfer_account_user)
+    db.session.add(disbursement)
+    db.session.commit()
+
+    disbursement.resolve_as_completed()
+    db.session.commit()
+
+    assert transfer_account.balance == starting_balance + 50
+    assert reconcile_transfer_account_balances() == []
+
+    disbursement.resolve_as_rejected()
+    db.session.commit()
+
+    assert transfer_account.balance == starting_balance
+    assert reconcile_transfer_account_balances() == []
+
+
+def test_credit_transfer_persisted_blockchain_status(create_credit_transfer):
+    """
+    GIVEN a CreditTransfer model
+    WHEN its blockchain transaction is pending, fails and then succeeds
+    THEN check the persisted blockchain status and breakdown follow it, and can be filtered on in SQL
+    """
+    from server import db
+    from server.models import CreditTransfer, BlockchainTransaction
+
+    transaction = BlockchainTransaction(status='PENDING', transaction_type='transfer')
+    transaction.credit_transfer_id = create_credit_transfer.id
+    db.session.add(transaction)
+    db.session.flush()
+
+    for transaction_status, blockchain_status in [('PENDING', 'PENDING'), ('FAILED', 'ERROR'), ('SUCCESS', 'COMPLETE')]:
+        transaction.status = transaction_status
+        db.session.expire(create_credit_transfer, ['blockchain_transactions'])
+        create_credit_transfer.update_blockchain_status()
+        db.session.commit()
+
+        assert create_credit_transfer.blockchain_status == blockchain_status
+        assert create_credit_transfer.blockchain_status_breakdown['transfer']['status'] == transaction_status
+        assert create_credit_transfer in CreditTransfer.query.filter(
+            CreditTransfer.blockchain_status == blockchain_status).all()
+
+    # As for transfers made before the status was persisted
+    create_credit_transfer._blockchain_status = None
+    create_credit_transfer._blockchain_status_breakdown = None
+    db.session.commit()
+
+    assert create_credit_transfer.blockchain_status == 'COMPLETE'
+    assert create_credit_transfer.blockchain_status_breakdown['transfer']['status'] == 'SUCCESS'
+
+
 """ ----- Blacklisted Token Model ----- """
 
 
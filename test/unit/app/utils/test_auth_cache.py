@@ -0,0 +1,46 @@
+def test_blacklisted_token_checked_without_database(test_client, init_database, count_queries, create_blacklisted_token):
+    """
+    GIVEN a committed BlacklistToken
+    WHEN the blacklist is checked
+    THEN check the token is found in redis, without querying the database
+    """
+    from server.models import BlacklistToken
+    from server.utils.auth_cache import warm_token_blacklist
+
+    warm_token_blacklist()
+
+    with count_queries() as statements:
+        assert BlacklistToken.check_blacklist(create_blacklisted_token.token)
+
+    assert len(statements) == 0
+
+
+def test_user_auth_state_cached_and_invalidated(test_client, init_database, count_queries, create_transfer_account_user):
+    """
+    GIVEN a user whose auth state has been cached
+    WHEN the user is rebuilt from the cache, and then disabled
+    THEN check the cached user needs no queries, and that disabling the user invalidates the cache on commit
+    """
+    from server import db
+    from server.utils.auth_cache import cache_user_auth_state, get_cached_auth_user
+
+    user_id = create_transfer_account_user.id
+    create_transfer_account_user.is_activated = True
+    db.session.commit()
+
+    cache_user_auth_state(create_transfer_account_user)
+    db.session.expunge_all()
+
+    with count_queries() as statements:
+        cached_user, ip_addresses = get_cached_auth_user(user_id)
+        assert cached_user.is_activated
+        assert not cached_user.is_disabled
+        assert not cached_user.is_admin
+
+    assert len(statements) == 0
+    assert ip_addresses == set()
+
+    cached_user.is_disabled = True
+    db.session.commit()
+
+    assert get_cached_auth_user(user_id) == (None, None)
@@ -0,0 +1,153 @@
+"""
+This file (test_credit_transfers.py) contains the unit tests for the credit_transfers.py file in utils dir.
+"""
+import pytest
+
+
+def test_daily_transfer_rollup_tracks_status_changes(test_client, init_database, create_transfer_account_user):
+    """
+    GIVEN a disbursement
+    WHEN it is completed and then rejected
+    THEN check the daily rollup moves the transfer between status buckets, and agrees with a full rebuild
+    """
+    from server import db
+    from server.models import CreditTransfer, DailyTransferRollup, TransferTypeEnum, TransferStatusEnum
+    from server.utils.credit_transfers import rebuild_daily_transfer_rollups
+
+    def bucket(status):
+        return DailyTransferRollup.query\
+            .filter(DailyTransferRollup.transfer_type == TransferTypeEnum.DISBURSEMENT)\
+            .filter(DailyTransferRollup.transfer_status == status).all()
+
+    transfer = CreditTransfer(amount=25, recipient=create_transfer_account_user)
+    db.session.add(transfer)
+    db.session.commit()
+
+    previous_volume = sum(rollup.volume for rollup in bucket(TransferStatusEnum.COMPLETE))
+
+    transfer.resolve_as_completed()
+    db.session.commit()
+
+    assert sum(rollup.volume for rollup in bucket(TransferStatusEnum.COMPLETE)) == previous_volume + 25
+
+    transfer.resolve_as_rejected()
+    db.session.commit()
+
+    assert sum(rollup.volume for rollup in bucket(TransferStatusEnum.COMPLETE)) == previous_volume
+    assert sum(rollup.transfer_count for rollup in bucket(TransferStatusEnum.REJECTED)) >= 1
+
+    incremental = {(r.date, r.transfer_type, r.transfer_status): (r.transfer_count, r.volume)
+                   for r in DailyTransferRollup.query.all() if r.transfer_count}
+
+    rebuild_daily_transfer_rollups()
+    db.session.commit()
+
+    rebuilt = {(r.date, r.transfer_type, r.transfer_status): (r.transfer_count, r.volume)
+               for r in DailyTransferRollup.query.all()}
+
+    assert incremental == rebuilt
+
+
+
+@pytest.mark.parametrize("page_sizes", [(2, 8)])
+def test_credit_transfer_loader_options_query_count_is_constant(
+        test_client, init_database, count_queries, page_sizes):
+    """
+    GIVEN a CreditTransferSchema and its loader profile
+    WHEN a small and a large page of transfers is queried with the profile and serialized
+    THEN check the number of queries doesn't grow with the page size
+    """
+    from server import db
+    from server.models import CreditTransfer
+    from server.schemas import CreditTransferSchema, credit_transfer_loader_options
+    from server.utils.user import create_transfer_account_user
+
+    schema = CreditTransferSchema(many=True, exclude=('is_sender', 'authorising_user_email'))
+
+    query_counts = []
+    for page_size in page_sizes:
+        transfer_ids = []
+        for i in range(page_size):
+            user = create_transfer_account_user(first_name='Loader', last_name=str(i))
+            transfer = CreditTransfer(amount=10, recipient=user)
+            db.session.add(transfer)
+            db.session.flush()
+            transfer.update_blockchain_status()
+            transfer_ids.append(transfer.id)
+
+        db.session.commit()
+        db.session.expunge_all()
+
+        with count_queries() as statements:
+            transfers = (CreditTransfer.query
+                         .options(*credit_transfer_loader_options(schema))
+                         .filter(CreditTransfer.id.in_(transfer_ids))
+                         .all())
+            data = schema.dump(transfers).data
+
+        assert len(data) == page_size
+
+        query_counts.append(len(statements))
+
+    assert query_counts[0] == query_counts[1]
+
+
+def test_authorising_user_emails_loaded_in_one_query(test_client, init_database, count_queries, create_admin_user):
+    """
+    GIVEN a page of credit transfers authorised by the same admin
+    WHEN the page is serialized
+    THEN check the authorising user's email is loaded with a single query for the whole page
+    """
+    from server import db
+    from server.models import CreditTransfer
+    from server.schemas import CreditTransferSchema
+    from server.utils.user import create_transfer_account_user
+
+    schema = CreditTransferSchema(many=True, only=('id', 'authorising_user_email'))
+
+    transfers = []
+    for i in range(5):
+        user = create_transfer_account_user(first_name='Authorised', last_name=str(i))
+        transfer = CreditTransfer(amount=10, recipient=user)
+        transfer.authorising_user_id = create_admin_user.id
+        db.session.add(transfer)
+        transfers.append(transfer)
+
+    db.session.commit()
+
+    with count_queries() as statements:
+        data = schema.dump(transfers).data
+
+    assert all(item['authorising_user_email'] == create_admin_user.email for item in data)
+    assert len([statement for statement in statements if 'FROM "user"' in statement]) == 1
+
+
+def test_sparse_fieldset_schema_skips_expensive_fields(test_client, init_database, count_queries, create_transfer_account_user):
+    """
+    GIVEN the credit transfers list schema
+    WHEN it's restricted to a few cheap fields with sparse_fieldset_schema
+    THEN check only those fields (and the id) are dumped, nothing is eager loaded, and the dump makes no queries
+    """
+    from server import db
+    from server.models import CreditTransfer
+    from server.schemas import credit_transfers_schema, credit_transfer_loader_options, sparse_fieldset_schema
+
+    schema = sparse_fieldset_schema(credit_transfers_schema, 'transfer_amount, transfer_status')
+
+    assert set(schema.fields.keys()) == {'id', 'transfer_amount', 'transfer_status'}
+    assert credit_transfer_loader_options(schema) == []
+
+    db.session.add(CreditTransfer(amount=10, recipient=create_transfer_account_user))
+    db.session.commit()
+
+    transfers = CreditTransfer.query.options(*credit_transfer_loader_options(schema)).all()
+    with count_queries() as statements:
+        data = schema.dump(transfers).data
+
+    assert set(data[0].keys()) == {'id', 'transfer_amount', 'transfer_status'}
+    assert len(statements) == 0
+
+    assert sparse_fieldset_schema(credit_transfers_schema, None) is credit_transfers_schema
+
+    with pytest.raises(ValueError):
+        sparse_fieldset_schema(credit_transfers_schema, 'transfer_amount,not_a_field')
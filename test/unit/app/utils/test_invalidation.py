@@ -0,0 +1,59 @@
+"""
+This file (test_invalidation.py) contains the unit tests for the invalidation.py file in utils dir.
+"""
+import json
+
+
+def test_commit_publishes_watched_model_invalidations(test_client, init_database, monkeypatch):
+    """
+    GIVEN a cache watching TransferUsage
+    WHEN a transfer usage is added and rolled back, and then added and committed
+    THEN check the cache's key is only evicted and published once committed
+    """
+    from server import db, red
+    from server.models import TransferUsage
+    from server.utils import invalidation
+
+    # Registered as on_invalidation and watch_model would, but only for this test
+    evicted = []
+    monkeypatch.setitem(invalidation._handlers, 'test_cache', (evicted.append, lambda: None))
+    monkeypatch.setitem(invalidation._watched_models, 'TransferUsage',
+                        invalidation._watched_models.get('TransferUsage', set()) | {'test_cache:usages'})
+
+    pubsub = red.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(invalidation.INVALIDATION_CHANNEL)
+    pubsub.get_message(timeout=1)
+
+    db.session.add(TransferUsage(name='Rent', icon='food-apple'))
+    db.session.flush()
+    db.session.rollback()
+
+    assert evicted == []
+
+    db.session.add(TransferUsage(name='Rent', icon='food-apple'))
+    db.session.commit()
+
+    assert evicted == ['usages']
+
+    message = pubsub.get_message(timeout=1)
+    assert 'test_cache:usages' in json.loads(message['data'])
+
+    pubsub.close()
+
+
+def test_reference_data_evicted_on_commit(test_client, init_database):
+    """
+    GIVEN cached transfer usages
+    WHEN a usage is added through the ORM
+    THEN check it's read straight away, without a version bump
+    """
+    from server import db
+    from server.models import TransferUsage
+    from server.utils.reference_data import get_reference_data
+
+    get_reference_data('transfer_usages')
+
+    db.session.add(TransferUsage(name='School Fees', icon='food-apple'))
+    db.session.commit()
+
+    assert 'School Fees' in [usage['name'] for usage in get_reference_data('transfer_usages')]
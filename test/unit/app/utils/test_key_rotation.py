@@ -0,0 +1,37 @@
+"""
+This file (test_key_rotation.py) contains the unit tests for the key_rotation.py file in utils dir.
+"""
+
+
+def test_reencrypt_stale_secrets(test_client, init_database, monkeypatch):
+    """
+    GIVEN a blockchain address encrypted with the current secret
+    WHEN a new secret is added to the front of ENCRYPTION_SECRETS and the re-encrypt sweep is run
+    THEN check the private key still decrypts before and after, and is only re-encrypted once
+    """
+    import config
+    import key_management
+    from server import db
+    from server.models import BlockchainAddress
+    from server.utils.key_rotation import reencrypt_stale_secrets
+
+    address = BlockchainAddress(type='TRANSFER_ACCOUNT')
+    db.session.add(address)
+    db.session.commit()
+
+    private_key = address.decrypted_private_key
+
+    monkeypatch.setattr(config, 'ENCRYPTION_SECRETS', ['a-new-secret'] + config.ENCRYPTION_SECRETS)
+    monkeypatch.setattr(key_management, '_ciphers', None)
+
+    assert key_management.needs_reencryption(address.encoded_private_key)
+    assert address.decrypted_private_key == private_key
+
+    assert reencrypt_stale_secrets()['BlockchainAddress'] == 1
+
+    db.session.expire_all()
+    assert not key_management.needs_reencryption(address.encoded_private_key)
+    assert address.decrypted_private_key == private_key
+    assert key_management.decrypt_many(key_management.encrypt_many([private_key])) == [private_key]
+
+    assert reencrypt_stale_secrets()['BlockchainAddress'] == 0
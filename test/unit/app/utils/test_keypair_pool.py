@@ -0,0 +1,52 @@
+"""
+This file (test_keypair_pool.py) contains the unit tests for the keypair_pool.py file in utils dir.
+"""
+
+
+def test_blockchain_address_claims_pooled_keypair(test_client, init_database):
+    """
+    GIVEN a keypair pool refilled to a watermark
+    WHEN a TRANSFER_ACCOUNT blockchain address is created
+    THEN check it takes a pooled keypair whose private key matches its address, and the pool is topped back up
+    """
+    from ethereum import utils
+    from server import db
+    from server.models import BlockchainAddress, BlockchainKeypair
+    from server.utils.keypair_pool import refill_blockchain_keypair_pool
+
+    assert refill_blockchain_keypair_pool(watermark=3, batch_size=2) == (2, 1)
+    assert refill_blockchain_keypair_pool(watermark=3, batch_size=2) == (1, 0)
+    pooled_addresses = [keypair.address for keypair in BlockchainKeypair.query.all()]
+
+    address = BlockchainAddress(type='TRANSFER_ACCOUNT')
+    db.session.add(address)
+    db.session.commit()
+
+    assert address.address in pooled_addresses
+    assert utils.checksum_encode(utils.privtoaddr(address.decrypted_private_key)) == address.address
+    assert BlockchainKeypair.query.count() == 2
+
+    assert refill_blockchain_keypair_pool(watermark=3) == (1, 0)
+
+
+def test_refill_blockchain_keypair_pool_skipped_while_locked(test_client, init_database):
+    """
+    GIVEN another refill holding the keypair pool lock
+    WHEN the keypair pool is refilled
+    THEN check nothing is generated
+    """
+    from server import red
+    from server.models import BlockchainKeypair
+    from server.utils.keypair_pool import refill_blockchain_keypair_pool, KEYPAIR_POOL_REFILL_LOCK_KEY
+
+    available = BlockchainKeypair.query.count()
+
+    lock = red.lock(KEYPAIR_POOL_REFILL_LOCK_KEY, timeout=10)
+    assert lock.acquire(blocking=False)
+
+    try:
+        assert refill_blockchain_keypair_pool(watermark=available + 5) == (0, 0)
+    finally:
+        lock.release()
+
+    assert BlockchainKeypair.query.count() == available
@@ -0,0 +1,103 @@
+"""
+This file (test_master_wallet.py) contains the unit tests for the master_wallet.py file in utils dir.
+"""
+import json, time
+import pytest
+
+
+def publish_balance(balance, age_seconds=0):
+    from server import red
+    from server.utils.master_wallet import MASTER_WALLET_BALANCE_KEY
+
+    red.set(MASTER_WALLET_BALANCE_KEY, json.dumps({'balance': balance, 'last_updated': time.time() - age_seconds}))
+
+
+@pytest.fixture(scope='function')
+def empty_ledger(test_client):
+    from server import red
+    from server.utils import master_wallet
+
+    red.delete(master_wallet.MASTER_WALLET_BALANCE_KEY, *master_wallet._LEDGER_KEYS)
+
+
+def test_master_wallet_funds_available_reads_published_balance(empty_ledger):
+    """
+    GIVEN master_wallet_funds_available function
+    WHEN the worker has published a balance, or the published balance is missing or out of date
+    THEN check the published balance is used without waiting on the worker, or a BlockchainError is raised
+    """
+    from server.exceptions import BlockchainError
+    from server.utils.master_wallet import master_wallet_funds_available
+
+    with pytest.raises(BlockchainError):
+        master_wallet_funds_available()
+
+    publish_balance(10000, age_seconds=60 * 60)
+    with pytest.raises(BlockchainError):
+        master_wallet_funds_available()
+
+    publish_balance(10000)
+    assert master_wallet_funds_available() == 10000
+
+
+def test_master_wallet_reservations(empty_ledger):
+    """
+    GIVEN a published master wallet balance
+    WHEN disbursements reserve funds, are rejected, and are confirmed on chain
+    THEN check the funds available are reserved, released and re-based correctly
+    """
+    from server.exceptions import InsufficientBalanceError
+    from server.utils.master_wallet import (
+        master_wallet_funds_available,
+        reserve_master_wallet_funds,
+        release_master_wallet_funds,
+        settle_master_wallet_funds)
+
+    publish_balance(1000, age_seconds=10)
+    assert master_wallet_funds_available() == 1000
+
+    reserve_master_wallet_funds(1, 600)
+    reserve_master_wallet_funds(2, 300)
+    assert master_wallet_funds_available() == 100
+
+    with pytest.raises(InsufficientBalanceError):
+        reserve_master_wallet_funds(3, 200)
+
+    # Rejected
+    assert release_master_wallet_funds(2)
+    assert not release_master_wallet_funds(2)
+    assert master_wallet_funds_available() == 400
+
+    # Confirmed on chain, but a balance read beforehand doesn't reflect it yet
+    assert settle_master_wallet_funds(1)
+    publish_balance(1000, age_seconds=5)
+    assert master_wallet_funds_available() == 400
+
+    # A balance read after confirmation does
+    time.sleep(0.01)
+    publish_balance(400)
+    assert master_wallet_funds_available() == 400
+
+
+def test_stale_master_wallet_reservations(empty_ledger, init_database, create_credit_transfer):
+    """
+    GIVEN reservations for a pending credit transfer and one that doesn't exist
+    WHEN stale reservations are reconciled against their credit transfers
+    THEN check only the reservation for the missing transfer is released
+    """
+    from server import red
+    from server.utils.master_wallet import (
+        MASTER_WALLET_RESERVATIONS_KEY,
+        master_wallet_funds_available,
+        reserve_master_wallet_funds,
+        reconcile_stale_reservations)
+
+    publish_balance(1000)
+    assert master_wallet_funds_available() == 1000
+
+    reserve_master_wallet_funds(create_credit_transfer.id, 100)
+    reserve_master_wallet_funds(987654321, 200)
+
+    assert reconcile_stale_reservations(stale_seconds=0) == 1
+    assert red.hkeys(MASTER_WALLET_RESERVATIONS_KEY) == [str(create_credit_transfer.id).encode()]
+    assert master_wallet_funds_available() == 900
@@ -1,6 +1,8 @@
 """
 This file (test_misc.py) contains the unit tests for the misc.py file in utils dir.
 """
+import datetime
+import pytest
 
 
 def test_encrypt_and_decrypt_string(test_client):
@@ -19,3 +21,33 @@ def test_encrypt_and_decrypt_string(test_client):
 
     decrypted_string = decrypt_string(encrypted_string)
     assert decrypted_string == string
+
+
+@pytest.mark.parametrize("value, expected", [
+    ('2019-08-01', datetime.datetime(2019, 8, 1)),
+    ('2019-08-01T10:00:00Z', datetime.datetime(2019, 8, 1, 10)),
+    ('2019-08-01T10:00:00+10:00', datetime.datetime(2019, 8, 1, 0)),
+])
+def test_parse_utc_date(test_client, value, expected):
+    """
+    GIVEN parse_utc_date function
+    WHEN a date is parsed, with or without an offset
+    THEN check it's returned as a naive UTC datetime
+    """
+    from server.utils.misc import parse_utc_date
+
+    date = parse_utc_date(value)
+    assert date == expected
+    assert date.tzinfo is None
+
+
+def test_parse_utc_date_out_of_range(test_client):
+    """
+    GIVEN parse_utc_date function
+    WHEN a date that's out of range is parsed
+    THEN check it raises an error the api turns into a 400
+    """
+    from server.utils.misc import parse_utc_date
+
+    with pytest.raises((ValueError, OverflowError)):
+        parse_utc_date('99999999999999999999')
@@ -0,0 +1,53 @@
+"""
+This file (test_reference_data.py) contains the unit tests for the reference_data.py file in utils dir.
+"""
+
+
+def test_reference_data_cached_until_bumped(test_client, init_database, count_queries):
+    """
+    GIVEN cached transfer usages
+    WHEN a usage is inserted without the ORM, and then the transfer usage version is bumped
+    THEN check reads come from memory until the bump, and include the new usage after it
+    """
+    from server import db
+    from server.utils.reference_data import get_reference_data, bump_reference_data_version
+
+    bump_reference_data_version('transfer_usages')
+    initial_usages = get_reference_data('transfer_usages')
+
+    db.session.execute("INSERT INTO transfer_usage (name, _icon, priority) VALUES ('Water', 'food-apple', 1)")
+    db.session.commit()
+
+    with count_queries() as statements:
+        assert get_reference_data('transfer_usages') == initial_usages
+
+    assert len(statements) == 0
+
+    bump_reference_data_version('transfer_usages')
+
+    assert 'Water' in [usage['name'] for usage in get_reference_data('transfer_usages')]
+
+
+def test_reference_data_picks_up_other_process_bumps(test_client, init_database, monkeypatch):
+    """
+    GIVEN cached settings
+    WHEN a setting is inserted without the ORM, and another process bumps the settings version
+    THEN check they're reloaded once the version is next checked
+    """
+    from server import db, red
+    from server.utils import reference_data
+
+    reference_data.bump_reference_data_version('settings')
+    assert 'use_last_4_digits_of_id_as_initial_pin' not in reference_data.get_reference_data('settings')
+
+    db.session.execute("INSERT INTO settings (name, value) VALUES ('use_last_4_digits_of_id_as_initial_pin', 'true')")
+    db.session.commit()
+
+    # As another process would, without touching this one's cache
+    red.incr('reference_data_version:settings')
+
+    assert 'use_last_4_digits_of_id_as_initial_pin' not in reference_data.get_reference_data('settings')
+
+    monkeypatch.setattr(reference_data, 'REFERENCE_DATA_VERSION_CHECK_SECONDS', 0)
+
+    assert reference_data.get_reference_data('settings')['use_last_4_digits_of_id_as_initial_pin'] is True
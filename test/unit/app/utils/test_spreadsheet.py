@@ -0,0 +1,109 @@
+"""
+This file (test_spreadsheet.py) contains the unit tests for the spreadsheet.py file in utils dir.
+"""
+import pytest
+
+
+@pytest.fixture(scope='function')
+def stored_csv(test_client):
+    """
+    Stores a csv as save_spreadsheet would, without uploading it to s3
+    """
+    from server import red
+    from server.utils.spreadsheet import _local_spreadsheet_path, _row_count_key, remove_local_spreadsheet
+
+    spreadsheet_token = 'a' * 32 + '.csv'
+
+    with open(_local_spreadsheet_path(spreadsheet_token), 'w') as csv_file:
+        csv_file.write('First Name,Phone\nAda,0401000021\n,\nGrace,not a phone\nAlan,0401000022\n')
+
+    yield spreadsheet_token
+
+    remove_local_spreadsheet(spreadsheet_token)
+    red.delete(_row_count_key(spreadsheet_token))
+
+
+def test_preview_spreadsheet(stored_csv):
+    """
+    GIVEN a stored csv
+    WHEN it's previewed with fewer preview rows than it has
+    THEN check only those rows are returned, with the row count and column stats covering every row
+    """
+    from server.utils.spreadsheet import preview_spreadsheet
+
+    table_data, row_count, column_stats = preview_spreadsheet(stored_csv, preview_rows=2)
+
+    assert table_data == {0: {0: 'First Name', 1: 'Phone'}, 1: {0: 'Ada', 1: '0401000021'}}
+    assert row_count == 5
+    assert column_stats == [
+        {'column': 0, 'filled_count': 4, 'example': 'Ada'},
+        {'column': 1, 'filled_count': 4, 'example': '0401000021'},
+    ]
+
+
+def test_spreadsheet_row_count_from_preview(stored_csv):
+    """
+    GIVEN a stored csv that's been previewed
+    WHEN its row count is read
+    THEN check the count found by the preview is used, rather than reading the file again
+    """
+    from server.utils.spreadsheet import preview_spreadsheet, get_spreadsheet_row_count, _local_spreadsheet_path
+
+    preview_spreadsheet(stored_csv)
+
+    with open(_local_spreadsheet_path(stored_csv), 'a') as csv_file:
+        csv_file.write('Edsger,0401000023\n')
+
+    assert get_spreadsheet_row_count(stored_csv) == 5
+
+
+def test_read_spreadsheet_rows_from_position(stored_csv):
+    """
+    GIVEN a stored csv
+    WHEN its rows are read a run at a time, each from the position the last one returned
+    THEN check each run carries on from the row after the last
+    """
+    from server.utils.spreadsheet import read_spreadsheet_rows
+
+    rows, position = read_spreadsheet_rows(stored_csv, 1, 2)
+    assert rows == [['Ada', '0401000021'], [None, None]]
+
+    rows, position = read_spreadsheet_rows(stored_csv, 3, 2, position=position)
+    assert rows == [['Grace', 'not a phone'], ['Alan', '0401000022']]
+
+    assert read_spreadsheet_rows(stored_csv, 5, 2, position=position)[0] == []
+
+
+def test_invalid_spreadsheet_token(test_client):
+    """
+    GIVEN a spreadsheet token that isn't one save_spreadsheet made
+    WHEN its rows are read
+    THEN check it's rejected rather than used as a path
+    """
+    from server.utils.spreadsheet import iter_spreadsheet_rows
+
+    with pytest.raises(ValueError):
+        next(iter_spreadsheet_rows('../../config.py'))
+
+
+def test_spreadsheet_import_job(stored_csv, init_database):
+    """
+    GIVEN a stored csv with a header row, an empty row and an invalid phone
+    WHEN it's imported as a job, a chunk at a time
+    THEN check the rows are streamed from the file, and failures are reported against their spreadsheet row
+    """
+    from server import db
+    from server.utils.user_import import create_spreadsheet_import_job, run_import_job_chunk
+
+    job = create_spreadsheet_import_job(stored_csv, {'0': 'first_name', '1': 'phone'}, first_data_row=1)
+    db.session.commit()
+
+    assert job.row_count == 4
+
+    run_import_job_chunk(job, chunk_size=3)
+    assert (job.status, job.processed_count) == ('RUNNING', 3)
+    assert job.spreadsheet_position is not None
+
+    run_import_job_chunk(job, chunk_size=3)
+    assert (job.status, job.processed_count, job.created_count) == ('COMPLETE', 4, 2)
+    assert [failure['row'] for failure in job.failures] == [3]
@@ -0,0 +1,131 @@
+"""
+This file (test_transfer_account.py) contains the unit tests for the transfer_account.py file in utils dir.
+"""
+import pytest
+
+
+def create_disbursements(count):
+    from server import db
+    from server.models import CreditTransfer
+    from server.utils.user import create_transfer_account_user
+
+    transfers = []
+    for i in range(count):
+        user = create_transfer_account_user(first_name='Bulk', last_name=str(i))
+        transfer = CreditTransfer(amount=10, recipient=user)
+        db.session.add(transfer)
+        transfers.append(transfer)
+
+    db.session.commit()
+
+    return [transfer.id for transfer in transfers]
+
+
+@pytest.mark.parametrize("page_sizes", [(2, 8)])
+def test_list_page_balance_query_count_is_constant(test_client, init_database, count_queries, page_sizes):
+    """
+    GIVEN a list of credit transfers with their own transfer accounts
+    WHEN the list is serialized with the transfer account balances, for a small and a large page
+    THEN check the number of queries doesn't grow with the page size
+    """
+    from server import db
+    from server.models import CreditTransfer
+    from server.schemas import CreditTransferSchema
+
+    schema = CreditTransferSchema(many=True, only=('id', 'sender_transfer_account', 'recipient_transfer_account'))
+
+    query_counts = []
+    for page_size in page_sizes:
+        transfer_ids = create_disbursements(page_size)
+
+        with count_queries() as statements:
+            transfers = CreditTransfer.query.filter(CreditTransfer.id.in_(transfer_ids)).all()
+            data = schema.dump(transfers).data
+
+        assert len(data) == page_size
+        assert all(item['recipient_transfer_account']['balance'] == 0 for item in data)
+
+        query_counts.append(len(statements))
+
+    assert query_counts[0] == query_counts[1]
+
+
+def test_balance_as_of_from_checkpoint(create_transfer_account_user):
+    """
+    GIVEN create_balance_checkpoints and calculate_balances_as_of functions
+    WHEN a transfer is completed after a checkpoint is made
+    THEN check balances as of before and after the transfer are correct
+    """
+    import datetime
+    from server import db
+    from server.models import CreditTransfer
+    from server.utils.transfer_account import create_balance_checkpoints, calculate_balances_as_of
+
+    transfer_account = create_transfer_account_user.transfer_account
+    starting_balance = transfer_account.balance
+
+    create_balance_checkpoints(checkpoint_date=datetime.datetime.utcnow())
+    db.session.commit()
+
+    before_transfer = datetime.datetime.utcnow()
+
+    disbursement = CreditTransfer(amount=25, recipient=create_transfer_account_user)
+    db.session.add(disbursement)
+    db.session.commit()
+    disbursement.resolve_as_completed()
+    db.session.commit()
+
+    after_transfer = datetime.datetime.utcnow()
+
+    assert calculate_balances_as_of([transfer_account.id], before_transfer) == {transfer_account.id: starting_balance}
+    assert calculate_balances_as_of([transfer_account.id], after_transfer) == {transfer_account.id: starting_balance + 25}
+
+    checkpoints = create_balance_checkpoints(checkpoint_date=after_transfer)
+    db.session.commit()
+
+    account_checkpoint = [c for c in checkpoints if c.transfer_account_id == transfer_account.id][0]
+    assert account_checkpoint.balance == starting_balance + 25
+    assert account_checkpoint.last_transfer_id == disbursement.id
+
+
+def test_rejected_transfer_is_reversed_at_next_checkpoint(create_transfer_account_user):
+    """
+    GIVEN create_balance_checkpoints and calculate_balances_as_of functions
+    WHEN a transfer is completed, checkpointed, then rejected
+    THEN check the next checkpoint and balances as of after the rejection no longer count it
+    """
+    import datetime
+    from server import db
+    from server.models import CreditTransfer
+    from server.utils.transfer_account import create_balance_checkpoints, calculate_balances_as_of
+
+    transfer_account = create_transfer_account_user.transfer_account
+
+    create_balance_checkpoints(checkpoint_date=datetime.datetime.utcnow())
+    db.session.commit()
+
+    starting_balance = calculate_balances_as_of([transfer_account.id], datetime.datetime.utcnow())[transfer_account.id]
+
+    disbursement = CreditTransfer(amount=40, recipient=create_transfer_account_user)
+    db.session.add(disbursement)
+    db.session.commit()
+    disbursement.resolve_as_completed()
+    db.session.commit()
+
+    after_completion = datetime.datetime.utcnow()
+    create_balance_checkpoints(checkpoint_date=after_completion)
+    db.session.commit()
+
+    disbursement.resolve_as_rejected()
+    db.session.commit()
+
+    after_rejection = datetime.datetime.utcnow()
+
+    assert calculate_balances_as_of([transfer_account.id], after_completion) == {transfer_account.id: starting_balance + 40}
+    assert calculate_balances_as_of([transfer_account.id], after_rejection) == {transfer_account.id: starting_balance}
+
+    checkpoints = create_balance_checkpoints(checkpoint_date=after_rejection)
+    db.session.commit()
+
+    account_checkpoint = [c for c in checkpoints if c.transfer_account_id == transfer_account.id][0]
+    assert account_checkpoint.balance == starting_balance
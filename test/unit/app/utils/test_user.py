@@ -52,3 +52,48 @@ def test_save_device_info(save_device_info, create_transfer_account_user, serial
     assert device is not None
     assert device.user_id is create_transfer_account_user.id
 
+
+
+def test_find_user_from_public_identifier(create_transfer_account_user, count_queries):
+    """
+    GIVEN a user with an email, phone and transfer account
+    WHEN find_user_from_public_identifier is called with any of them, in any case
+    THEN check the user is found in a single query
+    """
+    from server import db
+    from server.utils.user import find_user_from_public_identifier
+
+    create_transfer_account_user.email = 'Tristan@Example.com'
+    db.session.commit()
+
+    address = create_transfer_account_user.transfer_account.blockchain_address.address
+
+    for public_identifier in ['tristan@example.COM', '0401391419', address.lower()]:
+        with count_queries() as statements:
+            user = find_user_from_public_identifier(None, public_identifier)
+
+        assert user is create_transfer_account_user
+        assert len(statements) == 1
+
+    assert find_user_from_public_identifier('nobody@example.com', None) is None
+
+
+def test_user_identifiers_follow_setters(create_transfer_account_user):
+    """
+    GIVEN a user with an email
+    WHEN their email is changed, and then cleared
+    THEN check their identifier is updated, and then removed
+    """
+    from server import db
+    from server.models import UserIdentifier
+
+    create_transfer_account_user.email = 'Tristan.Cole@Example.com'
+    db.session.commit()
+
+    emails = UserIdentifier.query.filter_by(user_id=create_transfer_account_user.id, type=UserIdentifier.EMAIL).all()
+    assert [email.value for email in emails] == ['tristan.cole@example.com']
+
+    create_transfer_account_user.email = None
+    db.session.commit()
+
+    assert UserIdentifier.query.filter_by(user_id=create_transfer_account_user.id, type=UserIdentifier.EMAIL).count() == 0
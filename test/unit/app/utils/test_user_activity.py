@@ -0,0 +1,27 @@
+def test_flush_user_activity(test_client, init_database, create_transfer_account_user):
+    """
+    GIVEN activity buffered for a user by record_user_activity
+    WHEN the buffer is flushed, and then flushed again after the same ip is seen
+    THEN check the last seen time and ip are saved, and the ip is only saved once
+    """
+    from server import db
+    from server.models import IpAddress, User
+    from server.utils.user_activity import record_user_activity, flush_user_activity
+
+    user_id = create_transfer_account_user.id
+
+    record_user_activity(user_id, '203.0.113.7')
+    record_user_activity(user_id)
+
+    assert flush_user_activity() == (1, 1)
+
+    db.session.expire_all()
+    assert User.query.get(user_id)._last_seen is not None
+    assert [str(ip_address.ip) for ip_address in IpAddress.query.filter_by(user_id=user_id).all()] == ['203.0.113.7']
+
+    record_user_activity(user_id, '203.0.113.7')
+
+    assert flush_user_activity() == (1, 0)
+    assert IpAddress.query.filter_by(user_id=user_id).count() == 1
+
+    assert flush_user_activity() == (0, 0)
@@ -0,0 +1,122 @@
+"""
+This file (test_user_import.py) contains the unit tests for the user_import.py file in utils dir.
+"""
+
+
+def test_import_users(create_transfer_account_user):
+    """
+    GIVEN rows for new users, an existing user, a repeated new user and an invalid phone
+    WHEN import_users is called with a chunk size smaller than the import
+    THEN check each row gets the diagnostic proccess_attribute_dict would give it, in order,
+        and that repeated rows update the user created earlier in the import
+    """
+    from server.models import User
+    from server.utils.user_import import import_users
+
+    diagnostics = import_users([
+        {'First_Name': 'Ada', 'Phone': '0401000001'},
+        {'first_name': 'Tristan', 'phone': '0401391419', 'favourite_colour': 'green'},
+        {'first_name': 'Nobody', 'phone': 'not a phone'},
+        {'first_name': 'Grace', 'email': 'Grace@Example.com'},
+        {'last_name': 'Hopper', 'email': 'grace@example.com'},
+    ], force_dict_keys_lowercase=True, allow_existing_user_modify=True, chunk_size=2)
+
+    assert [diagnostic[1] for diagnostic in diagnostics] == [200, 200, 400, 200, 200]
+    assert [diagnostic[0] for diagnostic in diagnostics] == [
+        'User Created', 'User Updated', diagnostics[2][0], 'User Created', 'User Updated'
+    ]
+    assert diagnostics[2][0].startswith('Invalid Phone Number')
+
+    assert create_transfer_account_user.custom_attributes['favourite_colour'] == {'value': 'green'}
+
+    grace = User.query.filter_by(first_name='Grace').all()
+    assert len(grace) == 1
+    assert grace[0].last_name == 'Hopper'
+    assert grace[0].email == 'grace@example.com'
+
+
+def test_import_users_without_modify(create_transfer_account_user):
+    """
+    GIVEN a row for an existing user
+    WHEN import_users is called without allowing existing users to be modified
+    THEN check the row is rejected
+    """
+    from server.utils.user_import import import_users
+
+    assert import_users([{'phone': '0401391419'}]) == [('User already exists for Identifier', 400)]
+
+
+def test_import_users_with_disbursement(test_client, init_database, monkeypatch):
+    """
+    GIVEN rows for new users, one of them with a custom initial disbursement
+    WHEN import_users is called
+    THEN check every user is created, and the disbursed user starts with the disbursement as their balance
+    """
+    from flask import current_app
+    from server.models import User
+    from server.utils.user_import import import_users
+
+    monkeypatch.setitem(current_app.config, 'MAXIMUM_CUSTOM_INITIAL_DISBURSEMENT', 1000)
+    monkeypatch.setitem(current_app.config, 'USING_EXTERNAL_ERC20', False)
+    monkeypatch.setitem(current_app.config, 'IS_USING_BITCOIN', False)
+
+    diagnostics = import_users([
+        {'first_name': 'Barbara', 'phone': '0401000021'},
+        {'first_name': 'Donald', 'phone': '0401000022', 'custom_initial_disbursement': 500},
+        {'first_name': 'Frances', 'phone': '0401000023'},
+    ])
+
+    assert diagnostics == [('User Created', 200)] * 3
+
+    assert User.query.filter_by(first_name='Donald').one().transfer_account.balance == 500
+    assert User.query.filter_by(first_name='Frances').one().transfer_account.balance == 0
+
+
+def test_run_import_job_chunk(test_client, init_database):
+    """
+    GIVEN an import job for three rows, one of them invalid
+    WHEN run_import_job_chunk is called with a chunk size of two, until the job is done
+    THEN check the progress counters after each chunk, and that the failure is reported against its row
+    """
+    from server import db
+    from server.models import DatasetImportRow
+    from server.utils.user_import import create_import_job, run_import_job_chunk
+
+    job = create_import_job([
+        {'first_name': 'Alan', 'phone': '0401000011'},
+        {'first_name': 'Nobody'},
+        {'first_name': 'Edsger', 'phone': '0401000012'},
+    ])
+    db.session.commit()
+
+    run_import_job_chunk(job, chunk_size=2)
+
+    assert job.status == 'RUNNING'
+    assert (job.processed_count, job.created_count, job.failed_count) == (2, 1, 1)
+
+    run_import_job_chunk(job, chunk_size=2)
+
+    assert job.status == 'COMPLETE'
+    assert (job.processed_count, job.created_count, job.failed_count) == (3, 2, 1)
+    assert job.failures == [{'row': 1, 'message': 'Must provide a unique identifier'}]
+    assert DatasetImportRow.query.filter_by(job_id=job.id).count() == 0
+
+
+def test_claim_import_job(test_client, init_database):
+    """
+    GIVEN an import job
+    WHEN it's claimed to import a chunk, and claimed again before and after the chunk is done
+    THEN check only one claim is held at a time
+    """
+    from server import db
+    from server.utils.user_import import create_import_job, claim_import_job, run_import_job_chunk
+
+    job = create_import_job([{'first_name': 'Margaret', 'phone': '0401000031'}, {'first_name': 'Kathleen'}])
+    db.session.commit()
+
+    job, claimed = claim_import_job(job.id)
+    assert claimed
+    assert not claim_import_job(job.id)[1]
+
+    run_import_job_chunk(job, chunk_size=1)
+    assert claim_import_job(job.id)[1]
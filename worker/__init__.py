@@ -19,6 +19,22 @@ if config.IS_USING_BITCOIN:
             "task": "worker.celery_tasks.find_new_ouputs",
             "schedule": 24.0
         },
+        "balance_checkpoints": {
+            "task": "worker.celery_tasks.create_balance_checkpoints",
+            "schedule": 60 * 60 * 24.0
+        },
+        "publish_master_balance": {
+            "task": "worker.celery_tasks.publish_master_balance",
+            "schedule": 30.0
+        },
+        "flush_user_activity": {
+            "task": "worker.celery_tasks.flush_user_activity",
+            "schedule": 60.0
+        },
+        "refill_blockchain_keypair_pool": {
+            "task": "worker.celery_tasks.refill_blockchain_keypair_pool",
+            "schedule": 60.0
+        },
     }
 else:
     celery_app.conf.beat_schedule = {
@@ -26,6 +42,22 @@ else:
             "task": "worker.celery_tasks.find_new_external_inbounds",
             "schedule": 10.0
         },
+        "balance_checkpoints": {
+            "task": "worker.celery_tasks.create_balance_checkpoints",
+            "schedule": 60 * 60 * 24.0
+        },
+        "publish_master_balance": {
+            "task": "worker.celery_tasks.publish_master_balance",
+            "schedule": 30.0
+        },
+        "flush_user_activity": {
+            "task": "worker.celery_tasks.flush_user_activity",
+            "schedule": 60.0
+        },
+        "refill_blockchain_keypair_pool": {
+            "task": "worker.celery_tasks.refill_blockchain_keypair_pool",
+            "schedule": 60.0
+        },
     }
 
 import worker.celery_tasks
@@ -1,13 +1,13 @@
 from ethereum import utils
 from datetime import datetime
-import requests
+import requests, json, time
 from requests.auth import HTTPBasicAuth
 
 import config
 
 from worker.bitcoin_processor import BitcoinProcessor
 from worker.ethereum_processor import MintableERC20Processor, UnmintableERC20Processor, PreBlockchainError
-from worker import celery_app
+from worker import celery_app, red
 from worker.ABIs import standard_erc20_abi, ccv_abi, mintable_abi, dai_abi
 from worker import rekognition
 from worker import geolocation
@@ -125,6 +125,16 @@ def approve_master_for_transfers(self, account_to_approve_encoded_pk, gas_requir
 def get_master_balance(self):
     return blockchain_processor.get_master_wallet_balance_async()
 
+@celery_app.task(soft_time_limit=60)
+def publish_master_balance():
+    # Read by the app instead of waiting on get_master_balance during a request
+    master_wallet_balance = blockchain_processor.get_master_wallet_balance_async()
+
+    red.set('master_wallet_balance', json.dumps({
+        'balance': master_wallet_balance,
+        'last_updated': time.time()
+    }))
+
 @celery_app.task(bind=True, max_retries=3, soft_time_limit=300)
 def get_usd_to_satoshi_rate(self):
     return blockchain_processor.get_usd_to_satoshi_rate()
@@ -283,6 +293,56 @@ def find_new_ouputs():
 def find_new_external_inbounds():
     blockchain_processor.find_new_external_inbounds()
 
+@celery_app.task()
+def create_balance_checkpoints():
+    r = requests.post(config.APP_HOST + '/api/transfer_account/balance_checkpoint/',
+                      auth=HTTPBasicAuth(config.BASIC_AUTH_USERNAME,
+                                         config.BASIC_AUTH_PASSWORD))
+
+@celery_app.task()
+def flush_user_activity():
+    r = requests.post(config.APP_HOST + '/api/user/activity_flush/',
+                      auth=HTTPBasicAuth(config.BASIC_AUTH_USERNAME,
+                                         config.BASIC_AUTH_PASSWORD))
+
+@celery_app.task()
+def refill_blockchain_keypair_pool():
+    # A batch per request, stopping once the pool is full or another refill holds the lock
+    while True:
+        r = requests.post(config.APP_HOST + '/api/blockchain_address/keypair_pool/',
+                          auth=HTTPBasicAuth(config.BASIC_AUTH_USERNAME,
+                                             config.BASIC_AUTH_PASSWORD))
+
+        if r.status_code != 201 or not r.json()['data']['generated'] or not r.json()['data']['shortfall']:
+            break
+
+@celery_app.task(bind=True, max_retries=8)
+def import_dataset(self, job_id):
+    # A chunk per request, so that the import takes turns with the rest of the api rather than holding an app process
+    while True:
+        try:
+            r = requests.post(config.APP_HOST + '/api/dataset/{}/process/'.format(job_id),
+                              auth=HTTPBasicAuth(config.BASIC_AUTH_USERNAME,
+                                                 config.BASIC_AUTH_PASSWORD),
+                              timeout=60 * 10)
+        except requests.exceptions.RequestException as e:
+            raise self.retry(exc=e, countdown=30 * 2 ** self.request.retries)
+
+        try:
+            status = r.json()['data']['dataset_import_job']['status']
+        except (ValueError, KeyError, TypeError):
+            status = None
+
+        if r.status_code == 200 and status == 'RUNNING':
+            continue
+
+        # Finished, failed (and marked as such by the app) or not found
+        if r.status_code in [200, 404] or status == 'FAILED':
+            break
+
+        # Including 409, where another request holds the job, such as one this task timed out waiting on
+        raise self.retry(countdown=30 * 2 ** self.request.retries)
+
 @celery_app.task()
 def geolocate_address(geo_task):
     app_host = config.APP_HOST
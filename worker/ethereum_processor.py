@@ -3,7 +3,6 @@ import json, base64, ssl
 from web3 import Web3, HTTPProvider, WebsocketProvider
 
 from ethereum import utils
-from cryptography.fernet import Fernet
 
 from celery import chain
 
@@ -13,6 +12,7 @@ from requests.auth import HTTPBasicAuth
 from worker import celery_tasks
 
 import config
+import key_management
 
 import datetime
 
@@ -50,10 +50,7 @@ class BaseERC20Processor(ABC):
 
     @staticmethod
     def decode_private_key(encoded_private_key):
-        fernet_encryption_key = base64.b64encode(utils.sha3(config.SECRET_KEY))
-        cipher_suite = Fernet(fernet_encryption_key)
-
-        return cipher_suite.decrypt(encoded_private_key.encode('utf-8')).decode('utf-8')
+        return key_management.decrypt(encoded_private_key)
 
     def get_decimals(self):
         return self.contract.functions.decimals().call()